@@ -39,11 +39,41 @@ resource "aws_dynamodb_table" "agencies_table" {
     type = "S"
   }
 
+  attribute {
+    name = "SampleSort"
+    type = "S"
+  }
+
+  attribute {
+    name = "Version"
+    type = "N"
+  }
+
   local_secondary_index {
     name            = "ParentIdIndex"
     range_key       = "LSI"
     projection_type = "ALL"
   }
+
+  # Sparse, only sampled responses carry SampleSort
+  global_secondary_index {
+    name            = "SampleIndex"
+    hash_key        = "Partition"
+    range_key       = "SampleSort"
+    projection_type = "ALL"
+    read_capacity   = 20
+    write_capacity  = 20
+  }
+
+  # Sparse, responses carry the Version of the sync that last wrote them
+  global_secondary_index {
+    name            = "VersionIndex"
+    hash_key        = "Partition"
+    range_key       = "Version"
+    projection_type = "ALL"
+    read_capacity   = 20
+    write_capacity  = 20
+  }
 }
 
 resource "aws_dynamodb_table" "producer_table" {
@@ -7,13 +7,19 @@ import logging
 import json
 import decimal
 from ast import literal_eval
-from statistics import mean
+from datetime import date, datetime, timedelta, timezone
+from math import sqrt
+from statistics import mean, stdev
 from functools import reduce
+from hashlib import md5
 from itertools import groupby
 from operator import itemgetter
 from operator import ior, iand
-import boto3
+import numpy as np
 from boto3.dynamodb.conditions import Key, Attr
+from dateutil import tz as dateutil_tz
+from clients import get_resource
+from snapshot import UNREAD, data_version, get_snapshot
 
 AGENCY_TABLE = None
 
@@ -35,11 +41,38 @@ DEFAULT_RESPONSE_FIELDS =  'Choice,LSI,#d,Sort,#p, #t, Topic,Gender,Longitude,Re
 DEFAULT_AGENCY_FIELDS = 'rojopolisEncounterScore,CityRacePercent,CityGenderPercent,#p,rojopolisGeneralScore,CityPopulation,Sort,LSI,ZoneofInterest,CityAgePercent,#n'
 DEFAULT_QUESTION_FIELDS = 'QuestionChoicesId,Sort,Category,#p,#t'
 
+# dayCount bucket sizes, weeks start on Monday
+GRANULARITIES = ('day', 'week', 'month')
+SECONDS_PER_DAY = 86400
+SECONDS_PER_HOUR = 3600
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Approximate mode reads the sparse SampleIndex.  Ingestion hashes each
+# respondent into one of SAMPLE_BUCKETS buckets and gives responses in the
+# first SAMPLED_BUCKETS a SampleSort key of S<bucket>#<Sort>
+SAMPLE_INDEX = 'SampleIndex'
+SAMPLE_BUCKETS = 100
+SAMPLED_BUCKETS = 10
+Z_95 = 1.96
+
+# Routes answering from responses only, which change when a sync records a
+# new agency DataVersion.  They get an ETag and answer If-None-Match with 304
+VERSIONED_ROUTES = ('questionResponsesMetadata', 'responsesSentimentMetadata',
+                    'responsesMetadata', 'dashboardMetadata', 'responses')
+CACHE_CONTROL = os.environ.get('CACHE_CONTROL', 'private, max-age=60')
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Method": "*",
+    "Access-Control-Allow-Headers" : "Content-Type,X-Amz-Date,Authorization,X-Api-Key,If-None-Match",
+    "Access-Control-Expose-Headers": "ETag"
+}
+
 def get_table():
     '''Manages lazy global table instantiation'''
     global AGENCY_TABLE # pylint: disable=global-statement
     if not AGENCY_TABLE:
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = get_resource('dynamodb')
         agency_table_id = os.environ['AGENCY_TABLE_ID']
         AGENCY_TABLE = dynamodb.Table(agency_table_id)
     LOG.debug(f"AGENCY TABLE: {AGENCY_TABLE}")
@@ -100,14 +133,28 @@ def entrypoint(event, context):
     LOG.debug(route_base)
     queryStringParameters = event['queryStringParameters'] or {}
 
+    headers = dict(CORS_HEADERS)
+    version = UNREAD
+    if route_base in VERSIONED_ROUTES:
+        # read once, the snapshot of the metadata routes reuses it
+        version = data_version(get_table(), aId)
+        etag = request_etag(aId, route_base, queryStringParameters, version)
+        if etag:
+            headers.update({"ETag": etag, "Cache-Control": CACHE_CONTROL})
+            if etag_matches(etag, event.get('headers')):
+                LOG.info(f"Not modified: {etag}")
+                return { "statusCode": 304, "headers": headers, "body": "" }
+
     if route_base == 'agency':
         response = agency(aId)
     elif route_base == 'questionResponsesMetadata':
-        response = questionResponsesMetadata(aId, **queryStringParameters)
+        response = questionResponsesMetadata(aId, dataVersion=version, **queryStringParameters)
     elif route_base == 'responsesSentimentMetadata':
-        response = responsesSentimentMetadata(aId, **queryStringParameters)
+        response = responsesSentimentMetadata(aId, dataVersion=version, **queryStringParameters)
     elif route_base == 'responsesMetadata':
-        response = responsesMetadata(aId, **queryStringParameters)
+        response = responsesMetadata(aId, dataVersion=version, **queryStringParameters)
+    elif route_base == 'dashboardMetadata':
+        response = dashboardMetadata(aId, dataVersion=version, **queryStringParameters)
     elif route_base == 'questions':
         response = questions(aId, **queryStringParameters)
     elif route_base == 'topics':
@@ -121,17 +168,38 @@ def entrypoint(event, context):
 
     try:
         return { "statusCode": 200,
-                 "headers": { 
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Method": "*",
-                    "Access-Control-Allow-Headers" : "Content-Type,X-Amz-Date,Authorization,X-Api-Key"
-                 },
+                 "headers": headers,
                  "body": json.dumps(response)}
     except:
         LOG.exception(response)
         raise
 
 
+def request_etag(aId, route_base, queryStringParameters, version=UNREAD):
+    '''
+    ETag of a request against the agency's data version, None until a sync
+    has recorded a DataVersion.  The deployed function version is part of
+    it, so a deploy changing results does not serve stale 304s.
+    '''
+    if version is UNREAD:
+        version = data_version(get_table(), aId)
+    if version is None:
+        return None
+    params = sorted((key, str(value).strip()) for key, value in queryStringParameters.items()
+                    if value not in (None, ''))
+    request = json.dumps([version, os.environ.get('AWS_LAMBDA_FUNCTION_VERSION'),
+                          route_base, aId, params])
+    return f'"{md5(request.encode()).hexdigest()}"'
+
+
+def etag_matches(etag, headers):
+    '''Whether an If-None-Match header, weak or strong, names etag'''
+    headers = {key.lower(): value for key, value in (headers or {}).items()}
+    candidates = [x.strip() for x in headers.get('if-none-match', '').split(',')]
+    candidates = [x[2:] if x.startswith('W/') else x for x in candidates]
+    return '*' in candidates or etag in candidates
+
+
 def agency(aId):
     # Enforce key convention
     if not aId.startswith('AID-'):
@@ -157,19 +225,28 @@ def questionResponsesMetadata(aId,
                               sentiment=None,
                               origin=None,
                               geo=None,
-                              topic=None):
-    response = _responses(aId,
-                          question=question,
-                          startDate=startDate,
-                          endDate=endDate,
-                          age=age,
-                          gender=gender,
-                          race=race,
-                          sentiment=sentiment,
-                          origin=origin,
-                          geo=geo,
-                          topic=topic)
-    response['Items'] = count_by_scale(response['Items'])
+                              topic=None,
+                              granularity='day',
+                              tz='UTC',
+                              dataVersion=UNREAD):
+    filters = {'question': question,
+               'startDate': startDate,
+               'endDate': endDate,
+               'age': age,
+               'gender': gender,
+               'race': race,
+               'sentiment': sentiment,
+               'origin': origin,
+               'geo': geo,
+               'topic': topic}
+    snapshot = get_snapshot(get_table(), aId, version=dataVersion)
+    if snapshot is not None:
+        columns = snapshot.select(snapshot.mask(**filters))
+        return _snapshot_response(snapshot, columns, columns_count_by_scale(
+            snapshot, columns, granularity=granularity, tz=tz))
+
+    response = _responses(aId, allPages=True, **filters)
+    response['Items'] = count_by_scale(response['Items'], granularity=granularity, tz=tz)
     return response
 
 
@@ -183,32 +260,44 @@ def responsesSentimentMetadata(aId,
                               sentiment=None,
                               origin=None,
                               geo=None,
-                              topic=None):
-    response = _responses(aId,
-                          question=question,
-                          startDate=startDate,
-                          endDate=endDate,
-                          age=age,
-                          gender=gender,
-                          race=race,
-                          sentiment=sentiment,
-                          origin=origin,
-                          geo=geo,
-                          topic=topic)
-    response['Items'] = count_by_scale(response['Items'], group_field='Sentiment')
+                              topic=None,
+                              granularity='day',
+                              tz='UTC',
+                              dataVersion=UNREAD):
+    filters = {'question': question,
+               'startDate': startDate,
+               'endDate': endDate,
+               'age': age,
+               'gender': gender,
+               'race': race,
+               'sentiment': sentiment,
+               'origin': origin,
+               'geo': geo,
+               'topic': topic}
+    snapshot = get_snapshot(get_table(), aId, version=dataVersion)
+    if snapshot is not None:
+        columns = snapshot.select(snapshot.mask(**filters))
+        return _snapshot_response(snapshot, columns, columns_count_by_scale(
+            snapshot, columns, group_field='Sentiment', granularity=granularity, tz=tz))
+
+    response = _responses(aId, allPages=True, **filters)
+    response['Items'] = count_by_scale(response['Items'], group_field='Sentiment',
+                                       granularity=granularity, tz=tz)
     return response
 
 
-def count_by_scale(data, group_field='Choice'):
+def count_by_scale(data, group_field='Choice', granularity='day', tz='UTC'):
     '''
     Aggregate response data grouped by scale values
     and it's quetions possible scale
 
     group_field: top level field for grouping, 'Choice' and 'Sentiment' are
     only supported fields.
+    granularity, tz: dayCount bucket size and the time zone buckets start in,
+    dayBins holds the start date of each bucket.
     '''
     if not data:
-        return {'age':[], 'race': [], 'gender': [], 'sentiment': [], 'dayCount': []}
+        return {'age':[], 'race': [], 'gender': [], 'sentiment': [], 'dayCount': [], 'dayBins': []}
 
     scales = SCALES
 
@@ -218,6 +307,8 @@ def count_by_scale(data, group_field='Choice'):
     elif group_field == 'Sentiment':
         indices = range(len(scales['sentiment']))
 
+    day_bins = bin_dates(data, granularity=granularity, tz=tz)
+
     metadata = {
         # Age
         'age': field_count_by_scale('Age', data, indices, keys=scales['age'], group_field=group_field),
@@ -228,10 +319,170 @@ def count_by_scale(data, group_field='Choice'):
         # Sentiment
         'sentiment': field_count_by_scale('Sentiment', data, indices, keys=scales['sentiment'], group_field=group_field),
         # DayCount
-        'dayCount': field_count_by_scale('Date', data, indices, group_field=group_field) }
+        'dayCount': field_count_by_scale('DateBin', data, indices, keys=day_bins, group_field=group_field),
+        'dayBins': day_bins }
     return metadata
 
 
+def columns_count_by_scale(snapshot, columns, group_field='Choice', granularity='day', tz='UTC'):
+    '''
+    count_by_scale over the response columns selected from a snapshot
+    '''
+    if not len(columns['Date']):
+        return {'age':[], 'race': [], 'gender': [], 'sentiment': [], 'dayCount': [], 'dayBins': []}
+
+    scales = SCALES
+
+    if group_field == 'Choice':
+        # All responses are for same question => same question scale
+        first = {'Partition': snapshot.agency_id,
+                 'QuestionChoicesId': snapshot.label('QuestionChoicesId', columns['QuestionChoicesId'][0])}
+        width = len(_get_question_choices_count(first))
+    elif group_field == 'Sentiment':
+        width = len(scales['sentiment'])
+
+    values = columns[group_field]
+    date_bins, day_bins = bin_date_array(columns['Date'], granularity=granularity, tz=tz)
+
+    metadata = {
+        'age': array_count_by_scale(columns['Age'], values, len(scales['age']), width),
+        'race': array_count_by_scale(columns['Race'], values, len(scales['race']), width),
+        'gender': array_count_by_scale(columns['Gender'], values, len(scales['gender']), width),
+        'sentiment': array_count_by_scale(columns['Sentiment'], values, len(scales['sentiment']), width),
+        'dayCount': array_count_by_scale(date_bins, values, len(day_bins), width),
+        'dayBins': day_bins }
+    return metadata
+
+
+def array_count_by_scale(codes, values, size, width):
+    '''
+    field_count_by_scale for arrays of group codes and scale values,
+    a size by width table of counts
+    '''
+    counted = (codes >= 0) & (codes < size) & (values >= 0) & (values < width)
+    cells = codes[counted].astype(np.int64) * width + values[counted]
+    counts = np.bincount(cells, minlength=size * width)
+    return counts.reshape(size, width).tolist()
+
+
+def bin_dates(data, granularity='day', tz='UTC'):
+    '''
+    Bucket each item's epoch Date by day, week or month in the tz time zone.
+
+    Sets DateBin on every dated item to its bucket's offset from the first
+    bucket, and returns the start date of every bucket from the first to the
+    last, gaps included, so DateBin indexes the returned list.
+    '''
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {GRANULARITIES}")
+    zone = dateutil_tz.gettz(tz)
+    if zone is None:
+        raise ValueError(f"Unknown time zone {tz!r}")
+
+    offsets = {}
+    def local_day(epoch):
+        # utc offsets only change on the hour, so look them up once per hour
+        hour = epoch // SECONDS_PER_HOUR
+        if hour not in offsets:
+            offsets[hour] = _utc_offset(hour, zone)
+        return (epoch + offsets[hour]) // SECONDS_PER_DAY
+
+    dated = []
+    for item in data:
+        epoch = _epoch_seconds(item.get('Date'))
+        if epoch is None:
+            continue
+        day = local_day(epoch)
+        if granularity == 'day':
+            key = day
+        elif granularity == 'week':
+            # 1970-01-01 was a Thursday, shift so weeks start on Monday
+            key = (day + 3) // 7
+        else:
+            year, month, _ = _civil_from_days(day)
+            key = year * 12 + month - 1
+        dated.append((item, key))
+
+    if not dated:
+        return []
+    first = min(key for _, key in dated)
+    last = max(key for _, key in dated)
+    for item, key in dated:
+        item['DateBin'] = key - first
+    return [_bin_label(key, granularity) for key in range(first, last + 1)]
+
+
+def bin_date_array(epochs, granularity='day', tz='UTC'):
+    '''
+    bin_dates for an array of epoch seconds, NaN where undated.
+
+    Returns each row's bucket offset, -1 where undated, and the start date of
+    every bucket from the first to the last.
+    '''
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {GRANULARITIES}")
+    zone = dateutil_tz.gettz(tz)
+    if zone is None:
+        raise ValueError(f"Unknown time zone {tz!r}")
+
+    bins = np.full(len(epochs), -1, dtype=np.int64)
+    dated = ~np.isnan(epochs)
+    if not dated.any():
+        return bins, []
+    seconds = epochs[dated].astype(np.int64)
+    hours, hour_index = np.unique(seconds // SECONDS_PER_HOUR, return_inverse=True)
+    offsets = np.array([_utc_offset(int(hour), zone) for hour in hours], dtype=np.int64)
+    days = (seconds + offsets[hour_index]) // SECONDS_PER_DAY
+    if granularity == 'day':
+        keys = days
+    elif granularity == 'week':
+        keys = (days + 3) // 7
+    else:
+        year, month, _ = _civil_from_days(days)
+        keys = year * 12 + month - 1
+
+    first, last = int(keys.min()), int(keys.max())
+    bins[dated] = keys - first
+    return bins, [_bin_label(key, granularity) for key in range(first, last + 1)]
+
+
+def _utc_offset(hour, zone):
+    '''Seconds zone is ahead of UTC at a count of hours since the epoch'''
+    utcoffset = (EPOCH + timedelta(hours=hour)).astimezone(zone).utcoffset()
+    return int(utcoffset.total_seconds())
+
+
+def _epoch_seconds(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _civil_from_days(days):
+    '''
+    (year, month, day) of a count of days since 1970-01-01, in integers only
+    so it works on NumPy arrays too
+    http://howardhinnant.github.io/date_algorithms.html#civil_from_days
+    '''
+    days += 719468
+    era = days // 146097
+    day_of_era = days - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    shifted_month = (5 * day_of_year + 2) // 153
+    day = day_of_year - (153 * shifted_month + 2) // 5 + 1
+    month = shifted_month + 3 - 12 * (shifted_month >= 10)
+    return year_of_era + era * 400 + (month <= 2), month, day
+
+
+def _bin_label(key, granularity):
+    if granularity == 'month':
+        return f"{key // 12:04d}-{key % 12 + 1:02d}-01"
+    days = key if granularity == 'day' else key * 7 - 3
+    return (date(1970, 1, 1) + timedelta(days=days)).isoformat()
+
+
 def _get_question_choices_count(item):
     aid = item['Partition']
     questionChoiceId = item['QuestionChoicesId']
@@ -278,27 +529,129 @@ def responsesMetadata(aId,
                       sentiment=None,
                       origin=None,
                       geo=None,
-                      topic=None):
-    response = _responses(aId,
-                          startDate=startDate,
-                          endDate=endDate,
-                          age=age,
-                          gender=gender,
-                          race=race,
-                          sentiment=sentiment,
-                          origin=origin,
-                          geo=geo,
-                          topic=topic)
-    response['Items'] = count_and_mean(response['Items'])
+                      topic=None,
+                      granularity='day',
+                      tz='UTC',
+                      approx=None,
+                      sampleRate=None,
+                      dataVersion=UNREAD):
+    '''
+    approx=true aggregates a hash sample of the agency's responses instead of
+    reading them all, see approx_count_and_mean. sampleRate picks the
+    fraction sampled, at most and by default 0.1.
+    dataVersion is the agency's data_version when the entrypoint read it.
+    '''
+    filters = {'startDate': startDate,
+               'endDate': endDate,
+               'age': age,
+               'gender': gender,
+               'race': race,
+               'sentiment': sentiment,
+               'origin': origin,
+               'geo': geo,
+               'topic': topic}
+    sample_buckets = None
+    if _is_true(approx):
+        sample_buckets = _sample_buckets(sampleRate)
+    else:
+        snapshot = get_snapshot(get_table(), aId, version=dataVersion)
+        if snapshot is not None:
+            columns = snapshot.select(snapshot.mask(**filters))
+            return _snapshot_response(snapshot, columns, columns_count_and_mean(
+                columns, granularity=granularity, tz=tz))
+
+    response = _responses(aId, sampleBuckets=sample_buckets, allPages=True, **filters)
+    if sample_buckets is None:
+        response['Items'] = count_and_mean(response['Items'], granularity=granularity, tz=tz)
+        return response
+
+    fraction = sample_buckets / SAMPLE_BUCKETS
+    response['Approximate'] = {'sampleRate': fraction,
+                               'sampledItems': len(response['Items']),
+                               'confidenceLevel': 0.95}
+    response['Items'] = approx_count_and_mean(response['Items'], fraction,
+                                              granularity=granularity, tz=tz)
     return response
 
 
-def count_and_mean(data):
+def dashboardMetadata(aId,
+                      question=None,
+                      startDate=None,
+                      endDate=None,
+                      age=None,
+                      gender=None,
+                      race=None,
+                      sentiment=None,
+                      origin=None,
+                      geo=None,
+                      topic=None,
+                      granularity='day',
+                      tz='UTC',
+                      dataVersion=UNREAD):
+    '''
+    responsesMetadata, responsesSentimentMetadata and questionResponsesMetadata
+    for the same filters, from one read of the responses.
+
+    question only narrows the questionResponsesMetadata section, which is
+    left out without it.
+    '''
+    filters = {'startDate': startDate,
+               'endDate': endDate,
+               'age': age,
+               'gender': gender,
+               'race': race,
+               'sentiment': sentiment,
+               'origin': origin,
+               'geo': geo,
+               'topic': topic}
+    snapshot = get_snapshot(get_table(), aId, version=dataVersion)
+    if snapshot is not None:
+        mask = snapshot.mask(**filters)
+        columns = snapshot.select(mask)
+        items = {
+            'responsesMetadata': columns_count_and_mean(columns, granularity=granularity, tz=tz),
+            'responsesSentimentMetadata': columns_count_by_scale(
+                snapshot, columns, group_field='Sentiment', granularity=granularity, tz=tz)}
+        if question:
+            question_columns = snapshot.select(mask & snapshot.mask(question=question))
+            items['questionResponsesMetadata'] = columns_count_by_scale(
+                snapshot, question_columns, granularity=granularity, tz=tz)
+        return _snapshot_response(snapshot, columns, items)
+
+    response = _responses(aId, allPages=True, **filters)
+    data = response['Items']
+    items = {'responsesMetadata': count_and_mean(data, granularity=granularity, tz=tz)}
+    if question:
+        items['questionResponsesMetadata'] = count_by_scale(
+            [x for x in data if x.get('LSI') == question], granularity=granularity, tz=tz)
+    # Last, count_by_scale fills in Sentiment on items lacking it
+    items['responsesSentimentMetadata'] = count_by_scale(data, group_field='Sentiment',
+                                                         granularity=granularity, tz=tz)
+    response['Items'] = items
+    return response
+
+
+def _is_true(value):
+    return str(value).lower() in ('true', '1', 'yes')
+
+
+def _sample_buckets(sample_rate=None):
+    if sample_rate is None:
+        return SAMPLED_BUCKETS
+    buckets = round(float(sample_rate) * SAMPLE_BUCKETS)
+    return max(1, min(SAMPLED_BUCKETS, buckets))
+
+
+def count_and_mean(data, granularity='day', tz='UTC'):
     '''
     Aggregate data grouped by scale values, count it, and
     calculate mean for rojopolis score(s).
+
+    granularity, tz: dayCount bucket size and the time zone buckets start in,
+    dayBins holds the start date of each bucket.
     '''
     scales = SCALES
+    day_bins = bin_dates(data, granularity=granularity, tz=tz)
 
     metadata = {
         # Age
@@ -310,7 +663,8 @@ def count_and_mean(data):
         # Sentiment
         'sentiment': field_count_score_avg('Sentiment', data, scales['sentiment']),
         # DayCount
-        'dayCount': field_count_score_avg('Date', data) }
+        'dayCount': field_count_score_avg('DateBin', data, day_bins),
+        'dayBins': day_bins }
     return metadata
 
 def field_count_score_avg(field_name, data, keys=None):
@@ -335,6 +689,118 @@ def field_count_score_avg(field_name, data, keys=None):
         responses.append(response)
     return responses
 
+def columns_count_and_mean(columns, granularity='day', tz='UTC'):
+    '''
+    count_and_mean over the response columns selected from a snapshot
+    '''
+    scales = SCALES
+    date_bins, day_bins = bin_date_array(columns['Date'], granularity=granularity, tz=tz)
+
+    metadata = {
+        'age': array_count_score_avg('Age', columns['Age'], columns, len(scales['age'])),
+        'race': array_count_score_avg('Race', columns['Race'], columns, len(scales['race'])),
+        'gender': array_count_score_avg('Gender', columns['Gender'], columns, len(scales['gender'])),
+        'sentiment': array_count_score_avg('Sentiment', columns['Sentiment'], columns, len(scales['sentiment'])),
+        'dayCount': array_count_score_avg('DateBin', date_bins, columns, len(day_bins)),
+        'dayBins': day_bins }
+    return metadata
+
+def array_count_score_avg(field_name, codes, columns, size):
+    '''field_count_score_avg for an array of group codes, -1 where missing'''
+    grouped = codes >= 0
+    if len(np.unique(codes[grouped])) > size:
+        raise ValueError(f"More groups found than keys for field '{field_name}'")
+    counted = grouped & (codes < size)
+    counts = np.bincount(codes[counted].astype(np.int64), minlength=size)
+
+    averages = {}
+    for score in ('rojopolisGeneralScore', 'rojopolisEncounterScore'):
+        scored = counted & ~np.isnan(columns[score])
+        scored_codes = codes[scored].astype(np.int64)
+        totals = np.bincount(scored_codes, weights=columns[score][scored], minlength=size)
+        scored_counts = np.bincount(scored_codes, minlength=size)
+        averages[score] = np.divide(totals, scored_counts, out=np.zeros(size), where=scored_counts > 0)
+
+    return [{'count': int(counts[i]),
+             'rojopolisGeneralScoreAvg': _number(averages['rojopolisGeneralScore'][i]),
+             'rojopolisEncounterScoreAvg': _number(averages['rojopolisEncounterScore'][i])}
+            for i in range(size)]
+
+def _number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+def _snapshot_response(snapshot, columns, items):
+    return {'Items': items, 'Count': len(columns['Date']), 'ScannedCount': len(snapshot)}
+
+def approx_count_and_mean(data, fraction, granularity='day', tz='UTC'):
+    '''
+    count_and_mean estimated from a sample holding fraction of the responses.
+
+    Counts are scaled up by 1/fraction, and every count, percent and score
+    mean comes with a 95% confidence interval.  Intervals treat responses as
+    independent, respondents are sampled whole so they are somewhat narrow.
+    '''
+    scales = SCALES
+    day_bins = bin_dates(data, granularity=granularity, tz=tz)
+
+    metadata = {
+        # Age
+        'age': field_estimate('Age', data, fraction, scales['age']),
+        # Race
+        'race': field_estimate('Race', data, fraction, scales['race']),
+        # Gender
+        'gender': field_estimate('Gender', data, fraction, scales['gender']),
+        # Sentiment
+        'sentiment': field_estimate('Sentiment', data, fraction, scales['sentiment']),
+        # DayCount
+        'dayCount': field_estimate('DateBin', data, fraction, day_bins),
+        'dayBins': day_bins }
+    return metadata
+
+def field_estimate(field_name, data, fraction, keys=None):
+    responses = []
+    grouped = _groupby(field_name, data)
+    total = len(data)
+
+    # All fields except Date have a set number of possible responses
+    keys = range(len(keys)) if keys else sorted(grouped.keys())
+
+    for i in keys:
+        group = grouped.get(i, [])
+        sampled = len(group)
+        # binomial sampling of each response with probability fraction
+        count_margin = Z_95 * sqrt(sampled * (1 - fraction)) / fraction
+        share = sampled / total if total else 0
+        share_margin = Z_95 * sqrt(share * (1 - share) / total) if total else 0
+        response = {
+            'count': round(sampled / fraction),
+            'countCi': _interval(sampled / fraction, count_margin, upper=None),
+            'percent': 100 * share,
+            'percentCi': _interval(100 * share, 100 * share_margin, upper=100),
+            }
+        for score in ('rojopolisGeneralScore', 'rojopolisEncounterScore'):
+            avg, margin = _mean_margin([x[score] for x in group if score in x])
+            response[f'{score}Avg'] = avg
+            response[f'{score}AvgCi'] = _interval(avg, margin, lower=None, upper=None)
+        responses.append(response)
+    return responses
+
+def _mean_margin(values):
+    if not values:
+        return 0, 0
+    if len(values) < 2:
+        return mean(values), 0
+    return mean(values), Z_95 * stdev(values) / sqrt(len(values))
+
+def _interval(value, margin, lower=0, upper=None):
+    low, high = value - margin, value + margin
+    if lower is not None:
+        low = max(lower, low)
+    if upper is not None:
+        high = min(upper, high)
+    return [low, high]
+
 def questions(aId, limit=None, exclusiveStartKey=None):
     params = { 'KeyConditionExpression':Key('Partition').eq(aId) & Key('Sort').begins_with('QID'),
                'ProjectionExpression':DEFAULT_QUESTION_FIELDS,
@@ -423,7 +889,15 @@ def _responses(aId,
                topic=None,
                projectionExpression=None,
                exclusiveStartKey=None,
-               limit=None):
+               limit=None,
+               sampleBuckets=None,
+               allPages=False):
+    '''
+    Query the agency's responses.  With sampleBuckets only responses in the
+    first sampleBuckets sample buckets are read, from the SampleIndex.  Every
+    page is followed with sampleBuckets or allPages, otherwise only the first
+    page is returned with its LastEvaluatedKey.
+    '''
     ProjectionExpression = projectionExpression or DEFAULT_RESPONSE_FIELDS
     filters = []
     if question:
@@ -465,6 +939,11 @@ def _responses(aId,
               'ProjectionExpression':ProjectionExpression,
               'ExpressionAttributeNames':{"#p":"Partition", "#d": "Date", "#t": "Text"}}
 
+    if sampleBuckets is not None:
+        params['IndexName'] = SAMPLE_INDEX
+        params['KeyConditionExpression'] = (Key('Partition').eq(aId) &
+                                            Key('SampleSort').lt(f"S{sampleBuckets:02d}"))
+
     if filters:
             params['FilterExpression'] = reduce(iand, filters)
 
@@ -475,6 +954,14 @@ def _responses(aId,
         params['ExclusiveStartKey'] = literal_eval(exclusiveStartKey)
         
     response = get_table().query(**params)
+    if sampleBuckets is not None or allPages:
+        items = response['Items']
+        while 'LastEvaluatedKey' in response:
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+            response = get_table().query(**params)
+            items.extend(response['Items'])
+        response['Items'] = items
+        response['Count'] = len(items)
     LOG.debug(f"Response before casting ints: {response}")
 
     response['Items'] = _cast_ints(response['Items'])
@@ -0,0 +1,293 @@
+'''
+Warm container snapshots of agency responses
+
+Each agency's responses are held column by column in NumPy arrays, so the
+metadata endpoints filter and aggregate with vectorized masks instead of
+querying and deserializing every item again on each request.
+
+Ingestion stamps every response it writes with the Version of its sync and
+updates the agency's DataVersion item when the sync finishes.  A snapshot is
+refreshed when DataVersion changed, reading only responses stamped since the
+newest Version it holds from the sparse VersionIndex.
+
+Snapshots are kept least recently used first and evicted past the memory
+cap.  Loads and refreshes run inside the API request, so they stop as soon
+as a snapshot outgrows the cap or reading takes longer than LOAD_SECONDS,
+and that agency is left to the DynamoDB queries for MAX_AGE seconds.  A
+container runs one invocation at a time, so there is no locking.
+
+Environment:
+    SNAPSHOT_MEMORY_MB: memory all snapshots may use, 0 disables snapshots
+    SNAPSHOT_MAX_AGE: seconds before a snapshot is reloaded in full
+    SNAPSHOT_LOAD_SECONDS: longest a load or refresh may read for
+'''
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+from boto3.dynamodb.conditions import Key
+
+# Small integer codes: scale indexes and choices
+CODE_FIELDS = ('Age', 'Gender', 'Race', 'Sentiment', 'Choice')
+# Epoch Date, geo offsets and scores
+NUMBER_FIELDS = ('Date', 'LatitudeOffset', 'LongitudeOffset',
+                 'rojopolisGeneralScore', 'rojopolisEncounterScore')
+# Strings, dictionary encoded per snapshot
+CATEGORY_FIELDS = ('LSI', 'Origin', 'Topic', 'QuestionChoicesId')
+SNAPSHOT_FIELDS = ','.join(('Sort', 'Version', '#d') + CODE_FIELDS + NUMBER_FIELDS[1:] + CATEGORY_FIELDS)
+
+VERSION_INDEX = 'VersionIndex'
+DATA_VERSION_SORT = 'DataVersion'
+MISSING = -1
+# get_snapshot reads DataVersion itself unless the caller already has it
+UNREAD = object()
+
+# Sort key index entry per row, on top of the column arrays
+INDEX_BYTES_PER_ROW = 200
+# Longest a sync runs, the responses it stamps can land after newer syncs finish
+OVERLAP_MS = 900 * 1000
+
+MEMORY_BYTES = int(float(os.environ.get('SNAPSHOT_MEMORY_MB', 128)) * 2 ** 20)
+MAX_AGE = int(os.environ.get('SNAPSHOT_MAX_AGE', 3600))
+LOAD_SECONDS = float(os.environ.get('SNAPSHOT_LOAD_SECONDS', 5))
+
+_SNAPSHOTS = OrderedDict()
+# Agencies whose responses outgrew the cap or took too long to read, and when
+_TOO_LARGE = {}
+
+LOG = logging.getLogger()
+
+
+class ResponseSnapshot():
+    '''Columns of one agency's responses, a row per response item'''
+
+    def __init__(self, agency_id):
+        self.agency_id = agency_id
+        self.rows = {}
+        self.categories = {x: {} for x in CATEGORY_FIELDS}
+        self.labels = {x: [] for x in CATEGORY_FIELDS}
+        self.columns = {x: np.full(0, MISSING, np.int16) for x in CODE_FIELDS}
+        self.columns.update({x: np.full(0, np.nan) for x in NUMBER_FIELDS})
+        self.columns.update({x: np.full(0, MISSING, np.int32) for x in CATEGORY_FIELDS})
+        self.version = None
+        self.data_version = None
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        return sum(x.nbytes for x in self.columns.values()) + INDEX_BYTES_PER_ROW * len(self.rows)
+
+    def column(self, field):
+        return self.columns[field][:len(self.rows)]
+
+    def label(self, field, code):
+        return self.labels[field][code] if code != MISSING else None
+
+    def _grow(self, size):
+        '''Doubles capacity as needed, so loading page by page stays linear'''
+        capacity = len(self.columns['Date'])
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity)
+        for field, column in self.columns.items():
+            grown = np.full(capacity, np.nan if field in NUMBER_FIELDS else MISSING, column.dtype)
+            grown[:len(column)] = column
+            self.columns[field] = grown
+
+    def _encode(self, field, value):
+        if value is None:
+            return np.nan if field in NUMBER_FIELDS else MISSING
+        if field in CODE_FIELDS:
+            return int(value) if str(value).isdigit() else MISSING
+        if field in NUMBER_FIELDS:
+            try:
+                return float(value)
+            except ValueError:
+                return np.nan
+        value = str(value)
+        if value not in self.categories[field]:
+            self.categories[field][value] = len(self.labels[field])
+            self.labels[field].append(value)
+        return self.categories[field][value]
+
+    def upsert(self, items):
+        '''Adds new responses and overwrites the rows of changed ones'''
+        positions = []
+        for item in items:
+            positions.append(self.rows.setdefault(item['Sort'], len(self.rows)))
+            if 'Version' in item:
+                version = int(item['Version'])
+                self.version = version if self.version is None else max(self.version, version)
+        if not positions:
+            return
+        self._grow(len(self.rows))
+        for field, column in self.columns.items():
+            column[positions] = [self._encode(field, item.get(field)) for item in items]
+
+    def mask(self,
+             question=None,
+             startDate=None,
+             endDate=None,
+             age=None,
+             gender=None,
+             race=None,
+             sentiment=None,
+             origin=None,
+             geo=None,
+             topic=None):
+        '''
+        Rows matching the filters, with the same meaning as the
+        FilterExpression built by app._responses
+        '''
+        mask = np.ones(len(self.rows), dtype=bool)
+        if question:
+            mask &= self._category_mask('LSI', [question])
+        if startDate:
+            mask &= self.column('Date') >= float(startDate)
+        if endDate:
+            mask &= self.column('Date') <= float(endDate)
+        if age:
+            mask &= self._code_mask('Age', age)
+        if gender:
+            mask &= self._code_mask('Gender', gender)
+        if race:
+            mask &= self._code_mask('Race', race)
+        if sentiment:
+            sentiment = sentiment.split(',') if isinstance(sentiment, str) else sentiment
+            mask &= self._code_mask('Sentiment', sentiment)
+        if origin:
+            mask &= self._category_mask('Origin', origin)
+        if geo:
+            # [bottom left coordinates, upper right coordinates]
+            geo = [float(x) for x in geo.split(',')]
+            latitude, longitude = self.column('LatitudeOffset'), self.column('LongitudeOffset')
+            mask &= (latitude >= geo[0]) & (latitude <= geo[2])
+            mask &= (longitude >= geo[1] + 200) & (longitude <= geo[3] + 200)
+        if topic:
+            mask &= self._category_mask('Topic', [topic])
+        return mask
+
+    def _code_mask(self, field, values):
+        codes = [int(x) for x in (str(x) for x in values) if x.isdigit()]
+        return np.isin(self.column(field), codes)
+
+    def _category_mask(self, field, values):
+        codes = [self.categories[field][str(x)] for x in values if str(x) in self.categories[field]]
+        return np.isin(self.column(field), codes)
+
+    def select(self, mask):
+        '''Column arrays of the rows in mask'''
+        return {field: self.column(field)[mask] for field in self.columns}
+
+
+def _query_pages(table, params):
+    while True:
+        response = table.query(**params)
+        yield response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def _read(table, params, snapshot, max_bytes, max_seconds):
+    '''
+    Upserts every page into snapshot, False once it grows past max_bytes
+    or reading takes longer than max_seconds
+    '''
+    start = time.perf_counter()
+    for items in _query_pages(table, params):
+        snapshot.upsert(items)
+        if snapshot.nbytes > max_bytes:
+            LOG.info(f"Snapshot of {snapshot.agency_id} passed {max_bytes} bytes",
+                     extra={"rows": len(snapshot), "nbytes": snapshot.nbytes})
+            return False
+        if time.perf_counter() - start > max_seconds:
+            LOG.info(f"Snapshot of {snapshot.agency_id} passed {max_seconds} seconds",
+                     extra={"rows": len(snapshot), "nbytes": snapshot.nbytes})
+            return False
+    return True
+
+
+def load(table, agency_id, max_bytes=None, max_seconds=None):
+    '''
+    Reads every response of the agency into a new snapshot.
+    None when it grows past max_bytes, MEMORY_BYTES by default, or reading
+    takes longer than max_seconds, LOAD_SECONDS by default.
+    '''
+    max_bytes = MEMORY_BYTES if max_bytes is None else max_bytes
+    max_seconds = LOAD_SECONDS if max_seconds is None else max_seconds
+    snapshot = ResponseSnapshot(agency_id)
+    params = {'KeyConditionExpression': Key('Partition').eq(agency_id) & Key('Sort').begins_with('RID'),
+              'ProjectionExpression': SNAPSHOT_FIELDS,
+              'ExpressionAttributeNames': {'#d': 'Date'}}
+    return snapshot if _read(table, params, snapshot, max_bytes, max_seconds) else None
+
+
+def refresh(table, snapshot, max_bytes=None, max_seconds=None):
+    '''
+    Reads the responses stamped since the snapshot's newest Version.
+    Versions are stamped when a sync starts, so the read reaches back
+    OVERLAP_MS to pick up syncs still writing when newer ones finished.
+    None when the snapshot grows past max_bytes or reading takes longer
+    than max_seconds, it is then only partly refreshed and must be dropped.
+    '''
+    max_bytes = MEMORY_BYTES if max_bytes is None else max_bytes
+    max_seconds = LOAD_SECONDS if max_seconds is None else max_seconds
+    since = (snapshot.version or 0) - OVERLAP_MS
+    params = {'IndexName': VERSION_INDEX,
+              'KeyConditionExpression': Key('Partition').eq(snapshot.agency_id) & Key('Version').gt(since),
+              'ProjectionExpression': SNAPSHOT_FIELDS,
+              'ExpressionAttributeNames': {'#d': 'Date'}}
+    return snapshot if _read(table, params, snapshot, max_bytes, max_seconds) else None
+
+
+def data_version(table, agency_id):
+    '''The agency's DataVersion, None until a sync has recorded one'''
+    response = table.get_item(Key={'Partition': agency_id, 'Sort': DATA_VERSION_SORT})
+    version = response.get('Item', {}).get('DataVersion')
+    return int(version) if version is not None else None
+
+
+def get_snapshot(table, agency_id, now=None, version=UNREAD):
+    '''
+    The agency's snapshot, loaded or refreshed as needed.
+    version is the agency's data_version when the caller already read it.
+    None when snapshots are disabled or the agency's responses do not fit
+    in MEMORY_BYTES or cannot be read within LOAD_SECONDS.
+    '''
+    if MEMORY_BYTES <= 0:
+        return None
+    now = time.time() if now is None else now
+    too_large = _TOO_LARGE.get(agency_id)
+    if too_large is not None and now - too_large <= MAX_AGE:
+        return None
+    # read before the responses, so changes made while reading show up next time
+    if version is UNREAD:
+        version = data_version(table, agency_id)
+    snapshot = _SNAPSHOTS.pop(agency_id, None)
+    if snapshot is None or now - snapshot.loaded_at > MAX_AGE:
+        snapshot = load(table, agency_id)
+    elif version != snapshot.data_version:
+        snapshot = refresh(table, snapshot)
+    if snapshot is None:
+        _TOO_LARGE[agency_id] = now
+        return None
+    _TOO_LARGE.pop(agency_id, None)
+    snapshot.data_version = version
+    _SNAPSHOTS[agency_id] = snapshot
+    evict()
+    return snapshot
+
+
+def evict(memory_bytes=None):
+    '''Drops least recently used snapshots until they fit in memory_bytes'''
+    memory_bytes = MEMORY_BYTES if memory_bytes is None else memory_bytes
+    total = sum(x.nbytes for x in _SNAPSHOTS.values())
+    while _SNAPSHOTS and total > memory_bytes:
+        _, snapshot = _SNAPSHOTS.popitem(last=False)
+        total -= snapshot.nbytes
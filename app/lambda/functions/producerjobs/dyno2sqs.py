@@ -3,13 +3,22 @@ Dynamo to SQS
 """
 
 import click
-import boto3
 import json
+import queue
 import sys
 import os
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from itertools import islice
 
-DYNAMODB = boto3.resource('dynamodb')
-SQS = boto3.client("sqs")
+import requests
+
+from clients import configure, get_client, get_resource
 
 #SETUP LOGGING
 import logging
@@ -22,15 +31,112 @@ formatter = jsonlogger.JsonFormatter()
 logHandler.setFormatter(formatter)
 LOG.addHandler(logHandler)
 
-def scan_table(table):
-    """Scans table and return results"""
-    
-    LOG.info(f"Scanning Table {table}")
-    producer_table = DYNAMODB.Table(table)
-    response = producer_table.scan()
-    items = response['Items']
-    LOG.info(f"Found {len(items)} surveys")
-    return items
+SQS_BATCH_SIZE = 10
+SEND_CONCURRENCY = 8
+SEND_RETRIES = 3
+configure(max_pool_connections=SEND_CONCURRENCY + 2)
+
+QUALTRICS_API_URL = "https://co1.qualtrics.com/API/v3/"
+CHECK_CONCURRENCY = 8
+MAX_AGE = 24 * 60 * 60
+MAX_DELAY_SECONDS = 900
+SCHEDULE_SLOTS = 30
+DEFAULT_SYNC_SECONDS = 30
+AGENCY_CONCURRENCY = 2
+
+_QUEUE_URLS = {}
+_SESSION = requests.Session()
+_SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=CHECK_CONCURRENCY))
+
+def scan_pages(table, segment=None, total_segments=None):
+    """Yields pages of a table scan, following LastEvaluatedKey to the end
+
+    Pass segment and total_segments to scan one segment of a parallel scan.
+    """
+
+    producer_table = get_resource('dynamodb').Table(table)
+    scan_kwargs = {}
+    if total_segments:
+        scan_kwargs.update(Segment=segment, TotalSegments=total_segments)
+    while True:
+        response = producer_table.scan(**scan_kwargs)
+        yield response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def parallel_scan_pages(table, segments):
+    """Yields pages from a parallel scan, one thread per segment
+
+    Pages are yielded as soon as any segment returns them.  Closing the
+    generator early stops the segment scans after their current page.
+    """
+
+    pages = queue.Queue(maxsize=segments * 2)
+    stop = threading.Event()
+    finished = object()
+
+    def put(item):
+        # blocks while the consumer is behind, gives up once it has stopped
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def scan_segment(segment):
+        try:
+            for page in scan_pages(table, segment=segment, total_segments=segments):
+                if stop.is_set():
+                    return
+                put(page)
+        finally:
+            put(finished)
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        futures = [executor.submit(scan_segment, segment) for segment in range(segments)]
+        try:
+            remaining = segments
+            while remaining:
+                page = pages.get()
+                if page is finished:
+                    remaining -= 1
+                    continue
+                yield page
+        finally:
+            stop.set()
+        for future in futures:
+            # surface scan errors from any segment
+            future.result()
+
+def scan_table_pages(table, segments=1):
+    """Scans the whole table, yielding pages of items
+
+    segments > 1 runs a DynamoDB parallel scan across that many threads.
+    """
+
+    LOG.info(f"Scanning Table {table}", extra={"segments": segments})
+    if segments > 1:
+        return parallel_scan_pages(table, segments)
+    return scan_pages(table)
+
+def scan_table(table, segments=1):
+    """Scans the whole table, yielding items as pages arrive"""
+
+    count = 0
+    for page in scan_table_pages(table, segments=segments):
+        count += len(page)
+        yield from page
+    LOG.info(f"Found {count} surveys")
+
+def get_queue_url(queue_name):
+    """Resolves a queue url once per container"""
+
+    if queue_name not in _QUEUE_URLS:
+        sqs = get_client("sqs")
+        _QUEUE_URLS[queue_name] = sqs.get_queue_url(QueueName=queue_name)["QueueUrl"]
+    return _QUEUE_URLS[queue_name]
 
 def send_sqs_msg(msg, queue_name, delay=0):
     """Send SQS Message
@@ -39,12 +145,13 @@ def send_sqs_msg(msg, queue_name, delay=0):
     Returns a response dictionary. 
     """
 
-    queue_url = SQS.get_queue_url(QueueName=queue_name)["QueueUrl"]
+    sqs = get_client("sqs")
+    queue_url = get_queue_url(queue_name)
     queue_send_log_msg = "Send message to queue url: %s, with body: %s" %\
         (queue_url, msg)
     LOG.info(queue_send_log_msg)
     json_msg = json.dumps(msg)
-    response = SQS.send_message(
+    response = sqs.send_message(
         QueueUrl=queue_url,
         MessageBody=json_msg,
         DelaySeconds=delay)
@@ -53,14 +160,230 @@ def send_sqs_msg(msg, queue_name, delay=0):
     LOG.info(queue_send_log_msg_resp)
     return response
 
-def send_emissions(table, queue_name):
-    """Send Emissions"""
-    
-    surveys = scan_table(table=table)
-    for survey in surveys:
-        LOG.info(f"Sending survey {survey} to queue: {queue_name}")
-        response = send_sqs_msg(survey, queue_name=queue_name)
-        LOG.debug(response)
+def send_sqs_batch(msgs, queue_name, delay=0, retries=SEND_RETRIES, delays=None):
+    """Send up to 10 SQS messages in one SendMessageBatch call
+
+    delays optionally gives each message its own DelaySeconds.
+    Entries that fail with a server side error are retried with backoff,
+    entries that fail with a sender fault are not.
+    Returns (sent, failed) counts.
+    """
+
+    sqs = get_client("sqs")
+    queue_url = get_queue_url(queue_name)
+    delays = delays or [delay] * len(msgs)
+    entries = {str(number): {"Id": str(number),
+                             "MessageBody": json.dumps(msg, default=json_default),
+                             "DelaySeconds": msg_delay}
+               for number, (msg, msg_delay) in enumerate(zip(msgs, delays))}
+    sent = 0
+    failed = []
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(min(0.1 * 2 ** attempt, 2))
+        response = sqs.send_message_batch(QueueUrl=queue_url,
+                                          Entries=list(entries.values()))
+        sent += len(response.get("Successful", []))
+        # sender faults fail for good, the rest count only if the last attempt fails them
+        failed.extend(x for x in response.get("Failed", []) if x.get("SenderFault"))
+        retryable = [x for x in response.get("Failed", []) if not x.get("SenderFault")]
+        entries = {x["Id"]: entries[x["Id"]] for x in retryable}
+        if not entries:
+            break
+    failed.extend(retryable)
+    if failed:
+        LOG.error(f"Failed to send {len(failed)} messages to queue: {queue_name}",
+            extra={"failed": failed})
+    return sent, len(failed)
+
+def batches(items, size=SQS_BATCH_SIZE):
+    """Groups an iterable into lists of at most size items"""
+
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+class Scheduler():
+    """Spreads survey jobs across a window of SQS delays
+
+    The window is split into slots.  Each job goes to the slot with the least
+    scheduled sync cost, where cost is the survey's LastSyncSeconds from the
+    producer table, skipping slots in which the agency already has
+    agency_concurrency jobs running.  Jobs are placed as they are scanned,
+    so no full scan is held in memory.
+    """
+
+    def __init__(self, window, agency_concurrency=AGENCY_CONCURRENCY,
+                 slots=SCHEDULE_SLOTS, default_cost=DEFAULT_SYNC_SECONDS, seed=None):
+        self.window = min(window, MAX_DELAY_SECONDS)
+        self.slots = max(1, min(slots, self.window))
+        self.slot_seconds = self.window / self.slots
+        self.agency_concurrency = agency_concurrency
+        self.default_cost = default_cost
+        self.load = [0.0] * self.slots
+        self.agency_jobs = {}
+        self.random = random.Random(seed)
+
+    def cost(self, survey):
+        return float(survey.get("LastSyncSeconds") or self.default_cost)
+
+    def _running(self, agency_id, slot):
+        start = slot * self.slot_seconds
+        return sum(1 for begin, end in self.agency_jobs.get(agency_id, [])
+                   if begin <= start < end)
+
+    def delay(self, survey):
+        """Picks the DelaySeconds for a job and books its cost"""
+
+        cost = self.cost(survey)
+        agency_id = survey.get("AgencyId")
+        by_load = sorted(range(self.slots), key=lambda slot: (self.load[slot], slot))
+        allowed = [slot for slot in by_load
+                   if self._running(agency_id, slot) < self.agency_concurrency]
+        slot = (allowed or by_load)[0]
+        self.load[slot] += cost
+        start = slot * self.slot_seconds
+        self.agency_jobs.setdefault(agency_id, []).append((start, start + cost))
+        jitter = self.random.uniform(0, self.slot_seconds)
+        return min(int(start + jitter), MAX_DELAY_SECONDS)
+
+def json_default(value):
+    """Serializes the Decimals DynamoDB returns for numbers"""
+
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+
+def survey_metadata(survey_id, api_token, api_url=QUALTRICS_API_URL):
+    """Response count and last modified date of a survey from the Qualtrics API"""
+
+    endpoint = urllib.parse.urljoin(f"{api_url}surveys/", survey_id)
+    response = _SESSION.get(endpoint, headers={"x-api-token": api_token}, timeout=(5, 30))
+    response.raise_for_status()
+    result = response.json()["result"]
+    counts = result.get("responseCounts", {})
+    return {"response_count": counts.get("auditable", 0) + counts.get("generated", 0),
+            "last_modified": result.get("lastModifiedDate")}
+
+def sync_reason(survey, metadata, max_age=MAX_AGE, now=None):
+    """Why a survey needs a sync job, None when it is up to date
+
+    survey is the producer table item, which records the response count and
+    time of the last successful sync. metadata is None when the check failed.
+    """
+
+    now = now or datetime.now(timezone.utc)
+    if not survey.get("LastSyncedAt"):
+        return "never synced"
+    last_synced = parse_date(survey["LastSyncedAt"])
+    if (now - last_synced).total_seconds() > max_age:
+        return "max age"
+    if metadata is None:
+        return "check failed"
+    if metadata["response_count"] != survey.get("LastResponseCount"):
+        return "new responses"
+    if metadata["last_modified"] and parse_date(metadata["last_modified"]) > last_synced:
+        return "survey modified"
+    return None
+
+def check_survey(survey, api_token, max_age=MAX_AGE, api_url=QUALTRICS_API_URL):
+    """Returns the survey job to emit, or None when the survey is unchanged
+
+    A survey whose check fails is emitted.  The job carries the observed ResponseCount, surveyjobs records it in the
+    producer table once the sync succeeds.
+    """
+
+    try:
+        metadata = survey_metadata(survey["SurveyId"], api_token, api_url=api_url)
+        reason = sync_reason(survey, metadata, max_age=max_age)
+    except (requests.RequestException, KeyError, ValueError):
+        # unreachable API, unexpected payload or unparseable dates, sync anyway
+        LOG.exception(f"Metadata check failed for survey {survey['SurveyId']}")
+        metadata = None
+        reason = "check failed"
+    LOG.debug(f"Survey {survey['SurveyId']} sync reason: {reason}")
+    if reason is None:
+        return None
+    job = dict(survey)
+    if metadata:
+        job["ResponseCount"] = metadata["response_count"]
+    return job
+
+def send_emissions(table, queue_name, segments=1, max_workers=SEND_CONCURRENCY,
+                   api_token=None, max_age=MAX_AGE, api_url=QUALTRICS_API_URL,
+                   scheduler=None):
+    """Send Emissions
+
+    Scan pages feed a bounded queue of batches drained by sender workers.
+    The scan waits while the senders are behind, so memory stays constant
+    however large the table grows.
+
+    With an api_token each survey is checked against Qualtrics first, and
+    only surveys with new responses, a modified definition or a last sync
+    older than max_age seconds are emitted.
+
+    With a Scheduler the jobs are spread across its window with DelaySeconds
+    instead of all starting at once.
+    Returns a report of pages, surveys, skipped, sent and failed messages.
+    """
+
+    pending = queue.Queue(maxsize=max_workers * 2)
+    finished = object()
+    report = {"pages": 0, "surveys": 0, "skipped": 0, "sent": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def sender():
+        while True:
+            batch = pending.get()
+            if batch is finished:
+                return
+            try:
+                sent, failed = send_sqs_batch([job for job, _ in batch], queue_name=queue_name,
+                                              delays=[delay for _, delay in batch])
+            except Exception: # pylint: disable=broad-except
+                LOG.exception(f"Error sending batch to queue: {queue_name}")
+                sent, failed = 0, len(batch)
+            with lock:
+                report["sent"] += sent
+                report["failed"] += failed
+
+    def jobs(page, checker):
+        if not api_token:
+            return page
+        checked = checker.map(
+            lambda survey: check_survey(survey, api_token, max_age=max_age, api_url=api_url),
+            page)
+        return [job for job in checked if job]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            ThreadPoolExecutor(max_workers=CHECK_CONCURRENCY) as checker:
+        workers = [executor.submit(sender) for _ in range(max_workers)]
+        try:
+            for page in scan_table_pages(table, segments=segments):
+                page_jobs = jobs(page, checker)
+                delays = [scheduler.delay(job) if scheduler else 0 for job in page_jobs]
+                for batch in batches(zip(page_jobs, delays)):
+                    pending.put(batch)
+                with lock:
+                    report["pages"] += 1
+                    report["surveys"] += len(page)
+                    report["skipped"] += len(page) - len(page_jobs)
+                    progress = dict(report)
+                LOG.info(f"Queued page {progress['pages']} for queue: {queue_name}",
+                    extra=progress)
+        finally:
+            for _ in workers:
+                pending.put(finished)
+        for worker in workers:
+            worker.result()
+    LOG.info(f"Sent surveys to queue: {queue_name}", extra=report)
+    return report
 
 def entrypoint(event, context):
     '''
@@ -83,7 +406,17 @@ def cli():
     help="Dynamo Table")
 @click.option("--queue", envvar="PRODUCER_JOB_QUEUE",
     help="SQS")
-def emit(table, queue):
+@click.option("--segments", envvar="PRODUCER_SCAN_SEGMENTS", default=1,
+    help="Parallel scan segments")
+@click.option("--apitoken", envvar="X_API_TOKEN", default=None,
+    help="Qualtrics api token, when set only changed surveys are emitted")
+@click.option("--max-age", envvar="PRODUCER_MAX_AGE", default=MAX_AGE,
+    help="seconds after which a survey is emitted even if unchanged")
+@click.option("--spread", envvar="PRODUCER_SPREAD_SECONDS", default=0,
+    help="spread jobs over this many seconds (at most 900), 0 sends them all at once")
+@click.option("--agency-concurrency", envvar="PRODUCER_AGENCY_CONCURRENCY",
+    default=AGENCY_CONCURRENCY, help="jobs per agency allowed to run at once when spreading")
+def emit(table, queue, segments, apitoken, max_age, spread, agency_concurrency):
     """Emit Surveys from DynamoDB into SQS
     
     To run with environmental variables
@@ -95,7 +428,9 @@ def emit(table, queue):
 
     LOG.info(f"Running Click emit with table: {table}, queue: {queue}")
     try:
-        send_emissions(table=table, queue_name=queue)
+        scheduler = Scheduler(spread, agency_concurrency=agency_concurrency) if spread else None
+        send_emissions(table=table, queue_name=queue, segments=segments,
+                       api_token=apitoken, max_age=max_age, scheduler=scheduler)
     except AttributeError:
         LOG.exception(f"Error, check passed in values: table: {table}, queue: {queue}")
         sys.exit(1)
@@ -0,0 +1,176 @@
+import sys;sys.path.append("..")
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import threading
+from datetime import datetime, timezone
+
+import pytest
+import requests
+
+import dyno2sqs
+from dyno2sqs import (MAX_DELAY_SECONDS, Scheduler, check_survey, parallel_scan_pages,
+                      scan_pages, send_emissions, send_sqs_batch, sync_reason)
+
+class StubTable():
+    '''Producer table answering scans from a list of pages per segment'''
+    def __init__(self, pages, fail_segment=None):
+        self.pages = pages
+        self.fail_segment = fail_segment
+        self.scans = []
+
+    def scan(self, **kwargs):
+        self.scans.append(kwargs)
+        segment = kwargs.get('Segment', 0)
+        if segment == self.fail_segment:
+            raise RuntimeError(f"segment {segment} failed")
+        index = kwargs.get('ExclusiveStartKey', {}).get('page', 0)
+        response = {'Items': self.pages[segment][index]}
+        if index + 1 < len(self.pages[segment]):
+            response['LastEvaluatedKey'] = {'page': index + 1}
+        return response
+
+class StubDynamoDB():
+    def __init__(self, table):
+        self.table = table
+
+    def Table(self, name): # pylint: disable=invalid-name
+        return self.table
+
+def stub_table(monkeypatch, pages, fail_segment=None):
+    table = StubTable(pages, fail_segment=fail_segment)
+    monkeypatch.setattr(dyno2sqs, 'get_resource', lambda service_name: StubDynamoDB(table))
+    return table
+
+class StubSQS():
+    '''Fails the entries listed for each call, sender faults for ids in sender_faults'''
+    def __init__(self, failures=(), sender_faults=()):
+        self.failures = list(failures)
+        self.sender_faults = set(sender_faults)
+        self.batches = []
+
+    def get_queue_url(self, QueueName):
+        return {'QueueUrl': f"https://sqs/{QueueName}"}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.batches.append(Entries)
+        failing = self.failures.pop(0) if self.failures else set()
+        return {'Successful': [{'Id': x['Id']} for x in Entries if x['Id'] not in failing],
+                'Failed': [{'Id': x['Id'], 'SenderFault': x['Id'] in self.sender_faults}
+                           for x in Entries if x['Id'] in failing]}
+
+def stub_sqs(monkeypatch, sqs):
+    monkeypatch.setattr(dyno2sqs, 'get_client', lambda service_name: sqs)
+    monkeypatch.setattr(dyno2sqs, '_QUEUE_URLS', {})
+    monkeypatch.setattr(dyno2sqs.time, 'sleep', lambda seconds: None)
+    return sqs
+
+NOW = datetime(2019, 3, 1, tzinfo=timezone.utc)
+SURVEY = {'AgencyId': 'AID-BOS-dd3244', 'SurveyId': 'SV_1',
+          'LastSyncedAt': '2019-02-28T12:00:00Z', 'LastResponseCount': 10}
+
+def test_sync_reason():
+    metadata = {'response_count': 10, 'last_modified': '2019-02-01T00:00:00Z'}
+    assert sync_reason(SURVEY, metadata, now=NOW) is None
+    assert sync_reason(dict(SURVEY, LastSyncedAt=None), metadata, now=NOW) == 'never synced'
+    assert sync_reason(SURVEY, metadata, max_age=3600, now=NOW) == 'max age'
+    assert sync_reason(SURVEY, None, now=NOW) == 'check failed'
+    assert sync_reason(SURVEY, dict(metadata, response_count=11), now=NOW) == 'new responses'
+    assert sync_reason(SURVEY, dict(metadata, last_modified='2019-02-28T13:00:00Z'),
+                       now=NOW) == 'survey modified'
+
+def test_check_survey(monkeypatch):
+    answers = {}
+    def fake_metadata(survey_id, api_token, api_url=None):
+        if isinstance(answers[survey_id], Exception):
+            raise answers[survey_id]
+        return answers[survey_id]
+    monkeypatch.setattr(dyno2sqs, 'survey_metadata', fake_metadata)
+    recent = dict(SURVEY, LastSyncedAt=datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+    answers['SV_1'] = {'response_count': 10, 'last_modified': None}
+    assert check_survey(recent, 'token') is None
+    answers['SV_1'] = {'response_count': 12, 'last_modified': None}
+    assert check_survey(recent, 'token') == dict(recent, ResponseCount=12)
+    answers['SV_1'] = requests.ConnectionError()
+    assert check_survey(recent, 'token') == recent
+    # a date in another format fails the check instead of the whole emission
+    answers['SV_1'] = {'response_count': 10, 'last_modified': '2019-02-28 13:00:00'}
+    assert check_survey(recent, 'token') == recent
+
+def test_scan_pages_follows_last_evaluated_key(monkeypatch):
+    table = stub_table(monkeypatch, {0: [[1, 2], [3], [4, 5]]})
+
+    assert list(scan_pages('producer')) == [[1, 2], [3], [4, 5]]
+    assert [x.get('ExclusiveStartKey') for x in table.scans] == [None, {'page': 1}, {'page': 2}]
+
+def test_parallel_scan_pages_reads_every_segment(monkeypatch):
+    pages = {segment: [[f"{segment}-{x}"] for x in range(3)] for segment in range(4)}
+    table = stub_table(monkeypatch, pages)
+
+    items = [item for page in parallel_scan_pages('producer', 4) for item in page]
+
+    assert sorted(items) == sorted(f"{s}-{x}" for s in range(4) for x in range(3))
+    assert {(x['Segment'], x['TotalSegments']) for x in table.scans} == {(s, 4) for s in range(4)}
+
+def test_send_sqs_batch_retries_only_server_failures(monkeypatch):
+    sqs = stub_sqs(monkeypatch, StubSQS(failures=[{'1', '2', '3'}, {'2'}], sender_faults={'3'}))
+
+    sent, failed = send_sqs_batch([{'n': x} for x in range(5)], 'jobs', delays=[0, 5, 10, 15, 20])
+
+    assert (sent, failed) == (4, 1)
+    assert [[x['Id'] for x in batch] for batch in sqs.batches] == [
+        ['0', '1', '2', '3', '4'], ['1', '2'], ['2']]
+    assert [x['DelaySeconds'] for x in sqs.batches[1]] == [5, 10]
+
+def test_send_sqs_batch_gives_up_after_retries(monkeypatch):
+    sqs = stub_sqs(monkeypatch, StubSQS(failures=[{'0'}] * 10))
+
+    assert send_sqs_batch([{'n': 0}, {'n': 1}], 'jobs', retries=2) == (1, 1)
+    assert len(sqs.batches) == 3
+
+def _surveys(segment, pages=3, size=7):
+    return [[{'AgencyId': f"AID-{segment}", 'SurveyId': f"SV_{segment}_{page}_{x}"}
+             for x in range(size)] for page in range(pages)]
+
+def test_send_emissions_sends_every_survey(monkeypatch):
+    stub_table(monkeypatch, {segment: _surveys(segment) for segment in range(3)})
+    sqs = stub_sqs(monkeypatch, StubSQS())
+
+    report = send_emissions('producer', 'jobs', segments=3, max_workers=2)
+
+    assert report == {'pages': 9, 'surveys': 63, 'skipped': 0, 'sent': 63, 'failed': 0}
+    assert all(len(batch) <= 10 for batch in sqs.batches)
+
+def test_send_emissions_surfaces_segment_errors(monkeypatch):
+    stub_table(monkeypatch, {segment: _surveys(segment) for segment in range(3)}, fail_segment=1)
+    stub_sqs(monkeypatch, StubSQS())
+    threads = threading.active_count()
+
+    with pytest.raises(RuntimeError, match="segment 1 failed"):
+        send_emissions('producer', 'jobs', segments=3, max_workers=2)
+    # scan and sender workers were drained and joined
+    assert threading.active_count() == threads
+
+def test_scheduler_respects_agency_concurrency():
+    scheduler = Scheduler(600, agency_concurrency=2, slots=10, seed=1)
+    survey = {'AgencyId': 'AID-BOS-dd3244', 'LastSyncSeconds': 120}
+
+    slots = [int(scheduler.delay(survey) // scheduler.slot_seconds) for _ in range(5)]
+
+    # each job runs two slots, so no slot start sees more than two of them
+    for slot in range(scheduler.slots):
+        start = slot * scheduler.slot_seconds
+        running = [x for x in slots if x * scheduler.slot_seconds <= start < x * scheduler.slot_seconds + 120]
+        assert len(running) <= 2
+    # other agencies fill the least loaded slots regardless
+    other = scheduler.delay({'AgencyId': 'AID-NYC-1', 'LastSyncSeconds': 1})
+    assert int(other // scheduler.slot_seconds) not in slots
+
+def test_scheduler_caps_delays():
+    scheduler = Scheduler(3600, seed=1)
+    delays = [scheduler.delay({'AgencyId': f"AID-{x % 7}", 'LastSyncSeconds': x % 90})
+              for x in range(500)]
+
+    assert scheduler.window == MAX_DELAY_SECONDS == 900
+    assert all(0 <= x <= MAX_DELAY_SECONDS for x in delays)
+    assert max(delays) > MAX_DELAY_SECONDS / 2
@@ -0,0 +1,65 @@
+'''
+Shared AWS clients
+
+Clients are built once per container and reused across invocations, with
+connection pooling and adaptive retries.  boto3 clients are thread safe and
+shared by every thread, resources are not, so resources are cached per
+thread.
+
+Config only takes options the botocore of the python3.6 Lambda runtime
+(1.23) knows, it raises TypeError on any other.
+
+Each Lambda function is archived from its own directory, so this module is
+copied into every function that uses it.  Keep the copies identical.
+'''
+import threading
+
+import boto3
+from botocore.config import Config
+
+MAX_POOL_CONNECTIONS = 10
+MAX_ATTEMPTS = 10
+
+_CLIENTS = {}
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+
+def configure(max_pool_connections=MAX_POOL_CONNECTIONS):
+    '''
+    Size the connection pool to the calling module's concurrency.
+    Must be called before the first client is built.
+    '''
+    global MAX_POOL_CONNECTIONS # pylint: disable=global-statement
+    MAX_POOL_CONNECTIONS = max_pool_connections
+
+
+def client_config():
+    return Config(max_pool_connections=MAX_POOL_CONNECTIONS,
+                  retries={'max_attempts': MAX_ATTEMPTS, 'mode': 'adaptive'})
+
+
+def get_client(service_name, region_name=None):
+    '''Returns the container wide client for a service'''
+    key = (service_name, region_name)
+    client = _CLIENTS.get(key)
+    if client is None:
+        with _LOCK:
+            client = _CLIENTS.get(key)
+            if client is None:
+                client = boto3.session.Session().client(
+                    service_name, region_name=region_name, config=client_config())
+                _CLIENTS[key] = client
+    return client
+
+
+def get_resource(service_name, region_name=None):
+    '''Returns this thread's resource for a service'''
+    resources = getattr(_LOCAL, 'resources', None)
+    if resources is None:
+        resources = _LOCAL.resources = {}
+    key = (service_name, region_name)
+    if key not in resources:
+        resources[key] = boto3.session.Session().resource(
+            service_name, region_name=region_name, config=client_config())
+    return resources[key]
@@ -0,0 +1,186 @@
+"""
+Stage level profiling for survey sync jobs
+
+A StageProfiler is activated for the thread running a job, and the sync code
+marks its stages with `stage`.  Outside an active profiler `stage` does
+nothing, so library calls and tests pay no cost:
+
+with StageProfiler(job={"survey_id": survey_id}) as profiler:
+    with stage("parse") as parse:
+        parse.add_records(len(chunk))
+LOG.info("SYNC PROFILE", extra={"profile": profiler.report()})
+
+Memory tracing is opt in, without it peak_memory_bytes is None rather than
+a measured zero.  A stage's peak memory is the highest traced memory above
+what was traced when it started, sampled when stages start and end and when
+records are added.  tracemalloc is process wide, it runs while
+any profiler tracing memory is active, and when several jobs run at once in
+one container their allocations overlap.
+"""
+import cProfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_LOCAL = threading.local()
+
+# profilers tracing memory, tracemalloc runs while there are any
+_TRACE_LOCK = threading.Lock()
+_TRACE_USERS = 0
+_TRACE_STARTED = False
+
+
+def _start_tracing():
+    global _TRACE_USERS, _TRACE_STARTED # pylint: disable=global-statement
+    with _TRACE_LOCK:
+        if not _TRACE_USERS and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _TRACE_STARTED = True
+        _TRACE_USERS += 1
+
+
+def _stop_tracing():
+    """Stops tracemalloc when the last user leaves, unless someone else started it"""
+
+    global _TRACE_USERS, _TRACE_STARTED # pylint: disable=global-statement
+    with _TRACE_LOCK:
+        _TRACE_USERS -= 1
+        if not _TRACE_USERS and _TRACE_STARTED:
+            tracemalloc.stop()
+            _TRACE_STARTED = False
+
+
+class Stage():
+    """Accumulated measurements of one named stage"""
+
+    def __init__(self, name, sample=None):
+        self.name = name
+        self.calls = 0
+        self.records = 0
+        self.seconds = 0.0
+        self.peak_memory = None
+        self._sample = sample
+
+    def add_records(self, count):
+        self.records += count
+        if self._sample:
+            self._sample()
+
+    def report(self):
+        return {
+            "seconds": round(self.seconds, 6),
+            "calls": self.calls,
+            "records": self.records,
+            "records_per_second": round(self.records / self.seconds, 1) if self.seconds else None,
+            "peak_memory_bytes": self.peak_memory,
+        }
+
+
+class _NullStage():
+    def add_records(self, count):
+        pass
+
+
+NULL_STAGE = _NullStage()
+
+
+class StageProfiler():
+    """Collects per stage wall time, calls, records and peak memory for a job
+
+    trace_memory: run tracemalloc while active, adds allocation overhead
+    profile: also run cProfile, see dump_stats
+    """
+
+    def __init__(self, job=None, trace_memory=False, profile=False):
+        self.job = job or {}
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self._active = []
+        self._cprofile = cProfile.Profile() if profile else None
+        self._start = None
+        self.seconds = 0.0
+
+    def __enter__(self):
+        if self.trace_memory:
+            _start_tracing()
+        _LOCAL.profiler = self
+        self._start = time.perf_counter()
+        if self._cprofile:
+            self._cprofile.enable()
+        return self
+
+    def __exit__(self, *args):
+        if self._cprofile:
+            self._cprofile.disable()
+        self.seconds = time.perf_counter() - self._start
+        _LOCAL.profiler = None
+        if self.trace_memory:
+            _stop_tracing()
+
+    def _traced_memory(self):
+        if not self.trace_memory or not tracemalloc.is_tracing():
+            return None
+        current, _ = tracemalloc.get_traced_memory()
+        return current
+
+    def _update_peaks(self):
+        """Credits the traced memory above their start to the active stages
+
+        Deltas of the current traced memory work on every Python version,
+        tracemalloc.reset_peak only exists from 3.9.
+        """
+
+        current = self._traced_memory()
+        if current is None:
+            return
+        for active, start_memory in self._active:
+            active.peak_memory = max(active.peak_memory or 0, current - start_memory)
+
+    @contextmanager
+    def stage(self, name, records=0):
+        measured = self.stages.setdefault(name, Stage(name, sample=self._update_peaks))
+        # credit the memory so far to enclosing stages before starting a new one
+        self._update_peaks()
+        start_memory = self._traced_memory() or 0
+        self._active.append((measured, start_memory))
+        start = time.perf_counter()
+        try:
+            yield measured
+        finally:
+            measured.seconds += time.perf_counter() - start
+            measured.calls += 1
+            measured.records += records
+            self._update_peaks()
+            self._active.pop()
+
+    def report(self):
+        """Structured report, ready for json logging"""
+
+        return dict(self.job,
+                    seconds=round(self.seconds, 6),
+                    stages={name: measured.report() for name, measured in self.stages.items()})
+
+    def dump_stats(self, path):
+        """Writes cProfile stats, readable with pstats or snakeviz"""
+
+        if self._cprofile:
+            self._cprofile.dump_stats(path)
+
+
+def current_profiler():
+    """The profiler active on this thread, if any"""
+
+    return getattr(_LOCAL, "profiler", None)
+
+
+@contextmanager
+def stage(name, records=0):
+    """Marks a stage on the active profiler, no-op when none is active"""
+
+    profiler = current_profiler()
+    if profiler is None:
+        yield NULL_STAGE
+        return
+    with profiler.stage(name, records=records) as measured:
+        yield measured
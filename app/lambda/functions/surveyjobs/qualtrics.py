@@ -8,8 +8,15 @@ Sync to Dynamo like this:
 
 ./qualtrics.py sync-db
 
+Or download, sync and archive in one pass:
+
+./qualtrics.py pipeline --agencyid AID-BOS-dd3244
+
 """
+import ast
 import base64
+import csv
+import shutil
 import zipfile
 import io
 import os
@@ -17,17 +24,23 @@ import sys
 import json
 import urllib.parse
 import time
+import threading
 import dateutil.parser
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
-import boto3
 import botocore
-import requests
 import pandas as pd
 import click
 
 from hashlib import md5
 
+from clients import configure, get_client, get_resource
+from qualtrics_client import get_qualtrics_client
+from profiler import StageProfiler, stage
+from scorers import get_scorer
+
 #SETUP LOGGING
 import logging
 from pythonjsonlogger import jsonlogger
@@ -41,9 +54,58 @@ LOG.addHandler(logHandler)
 
 #S3 BUCKET
 REGION = "us-east-1"
-DYNAMODB = boto3.resource('dynamodb')
 TABLE = None
 
+#Agencies table of each worker thread, boto3 resources are not thread safe
+_LOCAL = threading.local()
+
+#Survey jobs processed at once from one SQS batch, SURVEY_CONCURRENCY overrides
+SURVEY_CONCURRENCY = 4
+
+#Shared AWS clients, each concurrent survey keeps several requests in flight
+configure(max_pool_connections=25)
+
+#Background S3 archiving, keeps uploads off the sync critical path
+ARCHIVE_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
+#Response record change detection
+FINGERPRINT_EXCLUDED_FIELDS = ("PhoneNumber", "Sentiment", "Fingerprint")
+BATCH_GET_LIMIT = 100
+
+#Rows of survey body parsed at a time, bounds sync memory on large exports
+CSV_CHUNKSIZE = 1000
+
+#Responses hash into SAMPLE_BUCKETS buckets, those in the first SAMPLED_BUCKETS
+#get a SampleSort key for the sparse SampleIndex read by approximate queries
+SAMPLE_BUCKETS = 100
+SAMPLED_BUCKETS = 10
+
+#Written responses carry the Version of their sync for the sparse VersionIndex,
+#and the agency's DataVersion item changes whenever a sync writes anything.
+#crud_handler refreshes its response snapshots from these
+DATA_VERSION_SORT = "DataVersion"
+
+#Qualtrics export polling, seconds.  Lambda timeout is 300
+EXPORT_POLL_INITIAL_DELAY = 0.5
+EXPORT_POLL_MAX_DELAY = 8
+EXPORT_TIMEOUT = 240
+
+def get_table():
+    """The agencies table set by use_table for this thread, TABLE otherwise"""
+
+    return getattr(_LOCAL, "table", None) or TABLE
+
+@contextmanager
+def use_table(table):
+    """Makes table this thread's agencies table for the duration"""
+
+    previous = getattr(_LOCAL, "table", None)
+    _LOCAL.table = table
+    try:
+        yield table
+    finally:
+        _LOCAL.table = previous
+
 def setup_environment():
         ### Qualtrics ###
     try:
@@ -56,7 +118,7 @@ def setup_environment():
     ### DynamoDB
     try:
         AGENCIES_TABLE_ID = os.environ['AGENCIES_TABLE_ID']
-        table = DYNAMODB.Table(AGENCIES_TABLE_ID)
+        table = get_resource('dynamodb').Table(AGENCIES_TABLE_ID)
     except KeyError:
         LOG.error("ERROR!: set environment variable AGENCIES_TABLE_ID [comes from Jet Steps: i.e. policeDepartments-6a2557316621d95d]")
         sys.exit(2)
@@ -72,18 +134,19 @@ def encrypt(secret, extra=None):
     if secret == "":
         LOG.info('Encrypting empty string', extra=extra)
         return ""
-    client = boto3.client('kms')
+    client = get_client('kms')
     key_alias = os.environ.get('KMS_KEY')
-    ciphertext = client.encrypt(
-        KeyId=key_alias,
-        Plaintext=secret,
-    )
+    with stage("encryption", records=1):
+        ciphertext = client.encrypt(
+            KeyId=key_alias,
+            Plaintext=secret,
+        )
     LOG.info(f'Encrypted value: {ciphertext}')
     return base64.b64encode(ciphertext['CiphertextBlob'])
 
 
 def decrypt(secret, extra=None):
-    client = boto3.client('kms')
+    client = get_client('kms')
     LOG.info(f'Decrypting: {secret}', extra)
     plaintext = client.decrypt(
         CiphertextBlob=base64.b64decode(secret)
@@ -114,7 +177,7 @@ def sqs_queue_resource(queue_name):
 
     """
 
-    sqs_resource = boto3.resource('sqs', region_name=REGION)
+    sqs_resource = get_resource('sqs', region_name=REGION)
     log_sqs_resource_msg = "Creating SQS resource conn with qname: [%s] in region: [%s]" %\
      (queue_name, REGION)
     LOG.info(log_sqs_resource_msg)
@@ -124,7 +187,7 @@ def sqs_queue_resource(queue_name):
 def sqs_connection():
     """Creates an SQS Connection which defaults to global var REGION"""
 
-    sqs_client = boto3.client("sqs", region_name=REGION)
+    sqs_client = get_client("sqs", region_name=REGION)
     log_sqs_client_msg = "Creating SQS connection in Region: [%s]" % REGION
     LOG.info(log_sqs_client_msg)
     return sqs_client
@@ -165,7 +228,7 @@ def delete_sqs_msg(queue_name, receipt_handle):
 def s3_resource():
     """Create S3 Resource"""
 
-    resource = boto3.resource('s3', region_name=REGION)
+    resource = get_resource('s3', region_name=REGION)
     LOG.info("s3 RESOURCE connection initiated")
     return resource
 
@@ -175,19 +238,35 @@ def write_s3(source_file, file_to_write, bucket):
     # Boto 3
     s3 = s3_resource()
     path = f'{source_file}'
-    res = s3.Object(bucket, file_to_write).\
-            put(Body=open(path, 'rb'))
+    with open(path, 'rb') as body:
+        res = s3.Object(bucket, file_to_write).put(Body=body)
     LOG.info(f"result of write {file_to_write} | {bucket} with:\n {res}")
     s3_payload = (bucket, file_to_write)
     return s3_payload
 
-def df_read_csv(file_to_read, bucket):
-    """Uses pandas to read s3 csv and return DataFrame
+def archive_s3_async(source_file, file_to_write, bucket):
+    """Write S3 Bucket in a background thread
 
-    Ref:
-    https://stackoverflow.com/questions/37703634/\
-    how-to-import-a-text-file-on-aws-s3-into-pandas\
-    -without-writing-to-disk
+    Returns a Future resolving to the same payload as write_s3.  Callers
+    must wait on the result before the Lambda returns, otherwise the
+    container can freeze mid upload.
+    """
+
+    LOG.info(f"Archiving {source_file} to s3:{bucket}/{file_to_write} in background")
+    return ARCHIVE_EXECUTOR.submit(write_s3, source_file=source_file,
+        file_to_write=file_to_write, bucket=bucket)
+
+def s3_object_name(survey_id, downloaded_csv_file):
+    """Name of the S3 object a downloaded survey csv is archived to"""
+
+    file_name = os.path.split(downloaded_csv_file)[-1]
+    return f"{survey_id}-{file_name}"
+
+def df_read_local_csv(file_to_read):
+    """Uses pandas to read a local csv and return DataFrame
+
+    The whole export in memory, for tests and benchmarks comparing against
+    df_read_csv_chunks.
 
     output looks like:
 
@@ -200,15 +279,60 @@ def df_read_csv(file_to_read, bucket):
        'DistributionChannel', 'UserLanguage', 'Q1', 'Q2',
        'Q_RecipientPhoneNumber'],
       dtype='object')
-
     """
 
-    s3 = boto3.client('s3')
-    obj = s3.get_object(Bucket=bucket, Key=file_to_read)
-    LOG.info(f"reading s3:{bucket}/{file_to_read}")
-    df = pd.read_csv(io.BytesIO(obj['Body'].read()))
+    LOG.info(f"reading local csv: {file_to_read}")
+    df = pd.read_csv(file_to_read)
     return df
 
+def download_s3_csv(file_to_read, bucket, temp_location="/tmp"):
+    """Streams an s3 csv to local disk and returns the filename"""
+
+    s3 = get_client('s3')
+    output_filename = f"{temp_location}/{os.path.split(file_to_read)[-1]}"
+    LOG.info(f"downloading s3:{bucket}/{file_to_read} to {output_filename}")
+    s3.download_file(bucket, file_to_read, output_filename)
+    return output_filename
+
+def read_csv_header(opened_file, extra=None):
+    """Consumes the three Qualtrics header rows and returns column names
+
+    Qualtrics exports start with the export tags, the question texts and the
+    ImportId metadata.  Columns are named by ImportId, as in
+    rename_df_colnames_cleanup.  Rows are read one line at a time so the
+    file position is left at the start of the responses.
+    """
+
+    rows = csv.reader(iter(opened_file.readline, ''))
+    _tags, _texts, import_ids = next(rows), next(rows), next(rows)
+    columns = [ast.literal_eval(x)['ImportId'] for x in import_ids]
+    LOG.info(f"Set Columns from csv header: {columns}", extra=extra)
+    return columns
+
+def df_read_csv_chunks(file_to_read, chunksize=CSV_CHUNKSIZE, extra=None):
+    """Yields DataFrames of at most chunksize survey responses
+
+    Chunks match the body rows of rename_df_colnames_cleanup: columns
+    named by ImportId and empty values filled, without the header rows.
+    """
+
+    with open(file_to_read, newline='') as opened_file:
+        with stage("header_rename"):
+            columns = read_csv_header(opened_file, extra=extra)
+        reader = pd.read_csv(opened_file, header=None, names=columns, dtype=str,
+            chunksize=chunksize)
+        index = 0
+        while True:
+            with stage("parse") as parse:
+                chunk = next(reader, None)
+                if chunk is None:
+                    break
+                chunk = fill_empty_values(df=chunk, extra=extra)
+                parse.add_records(len(chunk))
+            LOG.info(f"Read chunk {index} with {len(chunk)} rows from {file_to_read}", extra=extra)
+            index += 1
+            yield chunk
+
 def list_qualtrics_bucket_content(bucket):
     """Lists content of qualtrics bucket
 
@@ -217,7 +341,7 @@ def list_qualtrics_bucket_content(bucket):
         listing-contents-of-a-bucket-with-boto3
     """
 
-    s3 = boto3.resource('s3')
+    s3 = get_resource('s3')
     my_bucket = s3.Bucket(bucket)
     for found_key in my_bucket.objects.all():
         print(f"Bucket: {bucket} | key: {found_key}")
@@ -228,63 +352,194 @@ def size_of_zip(file_handle):
     size = sum([zinfo.file_size for zinfo in  file_handle.filelist])
     return size
 
-def download_csv_survey(survey_id="SV_1G2GmpaXrcPAenr",
-    api_token=None, data_center="co1", file_format="csv", temp_location="/tmp"):
-    """Download Survey"""
-
-    extra_logging = {"survey_id": survey_id, "temp_location": temp_location}
-    # Setting static parameters
-    requestCheckProgress = 0.0
-    progressStatus = "inProgress"
-    baseUrl = "https://{0}.qualtrics.com/API/v3/surveys/{1}/export-responses/".format(data_center, survey_id)
-    headers = {
-        "content-type": "application/json",
-        "x-api-token": api_token,
-        }
-
-    # Step 1: Creating Data Export
-    downloadRequestUrl = baseUrl
-    downloadRequestPayload = '{"format":"' + file_format + '"}'
-    downloadRequestResponse = requests.request("POST",
-        downloadRequestUrl, data=downloadRequestPayload, headers=headers)
+def qualtrics_api_url(data_center="co1"):
+    """Base url of the Qualtrics v3 API for a data center"""
+
+    return f"https://{data_center}.qualtrics.com/API/v3/"
+
+def export_url(survey_id, api_url):
+    """Export responses endpoint for a survey"""
+
+    return f"{api_url}surveys/{survey_id}/export-responses/"
+
+def start_export(survey_id, api_token=None, api_url=None, file_format="csv",
+    start_date=None, extra=None):
+    """Step 1: Creating Data Export, returns the progressId
+
+    start_date: ISO 8601 string, only export responses recorded since then
+    """
+
+    api_url = api_url or qualtrics_api_url()
+    payload = {"format": file_format}
+    if start_date:
+        LOG.info(f"Exporting responses recorded since {start_date}", extra=extra)
+        payload["startDate"] = start_date
+    downloadRequestPayload = json.dumps(payload)
+    downloadRequestResponse = get_qualtrics_client().post(export_url(survey_id, api_url),
+        api_token=api_token, name="start_export", data=downloadRequestPayload)
+    LOG.info(downloadRequestResponse.text, extra=extra)
     progressId = downloadRequestResponse.json()["result"]["progressId"]
-    LOG.info(downloadRequestResponse.text, extra=extra_logging)
-
-    # Step 2: Checking on Data Export Progress and waiting until export is ready
-    while progressStatus != "complete" and progressStatus != "failed":
-        LOG.info(f"progressStatus {progressStatus}", extra=extra_logging)
-        requestCheckUrl = baseUrl + progressId
-        requestCheckResponse = requests.request("GET", requestCheckUrl, headers=headers)
-        requestCheckProgress = requestCheckResponse.json()["result"]["percentComplete"]
-        LOG.info(f"Download is {str(requestCheckProgress)} complete", extra=extra_logging)
-        progressStatus = requestCheckResponse.json()["result"]["status"]
-
-    #step 2.1: Check for error
-    if progressStatus is "failed":
-        LOG.error("export failed", extra=extra_logging)
-        raise Exception("export failed")
-
-    fileId = requestCheckResponse.json()["result"]["fileId"]
-
-    # Step 3: Downloading file
-    requestDownloadUrl = baseUrl + fileId + '/file'
-    requestDownload = requests.request("GET", requestDownloadUrl, headers=headers, stream=True)
-
-    # Step 4: Unzipping the file
-    zip_temp = io.BytesIO(requestDownload.content)
-    zp = zipfile.ZipFile(zip_temp)
-    size = size_of_zip(zp) #returns size and logs it
-    filename = zp.namelist()[0]
-    LOG.info(f"Zip Size is: {size} with filename: {filename}", extra=extra_logging)
-    output_filename = f"{temp_location}/{survey_id}.csv"
-    LOG.info(f"Writing ZIP CONTENTS to output_filename: {output_filename}", extra=extra_logging)
-    with open(output_filename, "wb") as output_file:
-        LOG.info(f"Reading zipfile with name: {filename}", extra=extra_logging)
-        output_file.write(zp.read(filename))
-
-    LOG.info(f"Zip Extraction Complete.  Returning filename: {output_filename}", extra=extra_logging)
+    return progressId
+
+def poll_export(survey_id, progress_id, api_token=None, api_url=None, extra=None):
+    """Checks on Data Export Progress once, returns the 'result' section
+
+    result looks like:
+    {'percentComplete': 100.0, 'status': 'complete', 'fileId': '1dc4...'}
+    """
+
+    api_url = api_url or qualtrics_api_url()
+    requestCheckUrl = export_url(survey_id, api_url) + progress_id
+    requestCheckResponse = get_qualtrics_client().get(requestCheckUrl,
+        api_token=api_token, name="poll_export")
+    result = requestCheckResponse.json()["result"]
+    LOG.info(f"Download is {str(result['percentComplete'])} complete", extra=extra)
+    return result
+
+def wait_for_export(survey_id, progress_id, api_token=None, api_url=None,
+    initial_delay=EXPORT_POLL_INITIAL_DELAY, max_delay=EXPORT_POLL_MAX_DELAY,
+    timeout=EXPORT_TIMEOUT, extra=None):
+    """Step 2: Polls export progress with exponential backoff until ready
+
+    Returns the fileId of the finished export.  Raises if the export
+    fails or is not ready before timeout seconds have passed.
+    """
+
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        result = poll_export(survey_id, progress_id, api_token=api_token,
+            api_url=api_url, extra=extra)
+        progressStatus = result["status"]
+        LOG.info(f"progressStatus {progressStatus}", extra=extra)
+        if progressStatus == "complete":
+            return result["fileId"]
+        if progressStatus == "failed":
+            LOG.error("export failed", extra=extra)
+            raise Exception("export failed")
+        if time.monotonic() + delay > deadline:
+            LOG.error(f"export not ready after {timeout} seconds", extra=extra)
+            raise TimeoutError(f"export {progress_id} not ready after {timeout} seconds")
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+def download_export(survey_id, file_id, api_token=None, api_url=None,
+    temp_location="/tmp", extra=None):
+    """Step 3 and 4: Downloads and unzips a finished export
+
+    Returns the filename of the extracted csv
+    """
+
+    api_url = api_url or qualtrics_api_url()
+    requestDownloadUrl = export_url(survey_id, api_url) + file_id + '/file'
+    with stage("download"):
+        requestDownload = get_qualtrics_client().get(requestDownloadUrl,
+            api_token=api_token, name="download_export", stream=True)
+        zip_temp = io.BytesIO(requestDownload.content)
+
+    with stage("unzip"):
+        zp = zipfile.ZipFile(zip_temp)
+        size = size_of_zip(zp) #returns size and logs it
+        filename = zp.namelist()[0]
+        LOG.info(f"Zip Size is: {size} with filename: {filename}", extra=extra)
+        output_filename = f"{temp_location}/{survey_id}.csv"
+        LOG.info(f"Writing ZIP CONTENTS to output_filename: {output_filename}", extra=extra)
+        with open(output_filename, "wb") as output_file, zp.open(filename) as zipped_file:
+            LOG.info(f"Reading zipfile with name: {filename}", extra=extra)
+            shutil.copyfileobj(zipped_file, output_file)
+
+    LOG.info(f"Zip Extraction Complete.  Returning filename: {output_filename}", extra=extra)
     return output_filename
 
+def download_csv_survey(survey_id="SV_1G2GmpaXrcPAenr",
+    api_token=None, data_center="co1", file_format="csv", temp_location="/tmp",
+    api_url=None, start_date=None):
+    """Download Survey
+
+    Pass start_date (ISO 8601) to only download responses recorded since then
+    """
+
+    extra_logging = {"survey_id": survey_id, "temp_location": temp_location,
+        "start_date": start_date}
+    api_url = api_url or qualtrics_api_url(data_center)
+    with stage("export"):
+        progressId = start_export(survey_id, api_token=api_token, api_url=api_url,
+            file_format=file_format, start_date=start_date, extra=extra_logging)
+        fileId = wait_for_export(survey_id, progressId, api_token=api_token,
+            api_url=api_url, extra=extra_logging)
+    return download_export(survey_id, fileId, api_token=api_token, api_url=api_url,
+        temp_location=temp_location, extra=extra_logging)
+
+def download_csv_surveys(survey_ids, api_token=None, data_center="co1",
+    file_format="csv", temp_location="/tmp", api_url=None, max_workers=8,
+    initial_delay=EXPORT_POLL_INITIAL_DELAY, max_delay=EXPORT_POLL_MAX_DELAY,
+    timeout=EXPORT_TIMEOUT):
+    """Download many surveys concurrently
+
+    Starts every export up front, polls all in flight exports together
+    on a shared backoff, and downloads each one as soon as it completes.
+    Returns a dict of survey_id to csv filename, or to the exception
+    raised for that survey so one bad survey does not fail the others.
+    """
+
+    api_url = api_url or qualtrics_api_url(data_center)
+    extra_logging = {"survey_ids": survey_ids, "temp_location": temp_location}
+    results = {}
+    pending = {}
+    downloads = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        starts = {survey_id: executor.submit(start_export, survey_id, api_token=api_token,
+                    api_url=api_url, file_format=file_format, extra={"survey_id": survey_id})
+                  for survey_id in survey_ids}
+        for survey_id, future in starts.items():
+            try:
+                pending[survey_id] = future.result()
+            except Exception as error: # pylint:disable=broad-except
+                LOG.exception(f"Unable to start export for {survey_id}", extra=extra_logging)
+                results[survey_id] = error
+
+        deadline = time.monotonic() + timeout
+        delay = initial_delay
+        while pending:
+            polls = {survey_id: executor.submit(poll_export, survey_id, progress_id,
+                        api_token=api_token, api_url=api_url, extra={"survey_id": survey_id})
+                     for survey_id, progress_id in pending.items()}
+            for survey_id, future in polls.items():
+                try:
+                    result = future.result()
+                except Exception as error: # pylint:disable=broad-except
+                    LOG.exception(f"Unable to poll export for {survey_id}", extra=extra_logging)
+                    results[survey_id] = error
+                    del pending[survey_id]
+                    continue
+                if result["status"] == "complete":
+                    del pending[survey_id]
+                    downloads[survey_id] = executor.submit(download_export, survey_id,
+                        result["fileId"], api_token=api_token, api_url=api_url,
+                        temp_location=temp_location, extra={"survey_id": survey_id})
+                elif result["status"] == "failed":
+                    LOG.error(f"export failed for {survey_id}", extra=extra_logging)
+                    results[survey_id] = Exception("export failed")
+                    del pending[survey_id]
+            if not pending:
+                break
+            if time.monotonic() + delay > deadline:
+                for survey_id, progress_id in pending.items():
+                    LOG.error(f"export not ready for {survey_id} after {timeout} seconds", extra=extra_logging)
+                    results[survey_id] = TimeoutError(f"export {progress_id} not ready after {timeout} seconds")
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+        for survey_id, future in downloads.items():
+            try:
+                results[survey_id] = future.result()
+            except Exception as error: # pylint:disable=broad-except
+                LOG.exception(f"Unable to download export for {survey_id}", extra=extra_logging)
+                results[survey_id] = error
+    LOG.info(f"Finished exports: {results}", extra=extra_logging)
+    return results
+
 def collect_survey_endpoint(url="https://co1.qualtrics.com/API/v3/surveys/",
                         survey_id="SV_4JFLLqWZwHJGi3z",extra=None, api_token=None):
 
@@ -296,11 +551,8 @@ def collect_survey_endpoint(url="https://co1.qualtrics.com/API/v3/surveys/",
     
     endpoint = urllib.parse.urljoin(url,survey_id)
     LOG.info(f"Creating endpoint: {endpoint} from url: {url} and survey_id: {survey_id}", extra=extra)
-    headers = {
-        "content-type": "application/json",
-        "x-api-token": api_token,
-        }
-    result = requests.get(endpoint, headers=headers)
+    result = get_qualtrics_client().get(endpoint, api_token=api_token,
+        name="collect_survey_endpoint")
     json_response = result.json()
     LOG.info(f"JSON result: {json_response} of endpoint {endpoint}", extra=extra)
     return json_response
@@ -329,6 +581,18 @@ def make_sort(question, responseid, extra=None):
 
 
 
+def make_sample_sort(sort_value, responseid):
+    """Makes SampleSort for responses in the sampled buckets, None for the rest
+
+    Buckets come from a hash of the response id, so every answer of a
+    respondent is sampled together: S07#RID-QID1-R_1abc
+    """
+
+    bucket = int(md5(responseid.encode()).hexdigest()[:8], 16) % SAMPLE_BUCKETS
+    if bucket >= SAMPLED_BUCKETS:
+        return None
+    return f"S{bucket:02d}#{sort_value}"
+
 def sentiment_mapper(sentiment):
     """Maps a sentiment to a numerical value"""
 
@@ -353,23 +617,48 @@ def create_sentiment(row, extra=None):
      'Negative': 0.011656931601464748,
      'Neutral': 0.9297710061073303,
      'Mixed': 0.003845960134640336},
-    
+
+    Scored by the SENTIMENT_SCORER scorer, see scorers.py.
     """
 
     LOG.info(f"CREATE SENTIMENT with raw value: {row}", extra=extra)
-    comprehend = boto3.client(service_name='comprehend')
-    payload = comprehend.detect_sentiment(Text=row, LanguageCode='en')
-    LOG.info(f"Found Sentiment: {payload}", extra=extra)    
-    sentiment_category = payload['Sentiment']
-    LOG.info(f"Sentiment Category: {sentiment_category}", extra=extra)
-    sentiment_score = payload['SentimentScore']
-    LOG.info(f"Sentiment Score: {sentiment_score}", extra=extra)
-    map_sentiment_result = sentiment_mapper(sentiment=sentiment_category)
-    LOG.info(f"Created Sentiment Score: {map_sentiment_result}")
-    return map_sentiment_result
-
-def make_record(iloc, extra=None, questions_choices=None):
+    return create_sentiments([row], extra=extra)[row]
+
+def create_sentiments(texts, extra=None):
+    """Scores texts with one scorer call, returns mapped sentiment by text"""
+
+    texts = list(dict.fromkeys(texts))
+    if not texts:
+        return {}
+    with stage("sentiment", records=len(texts)):
+        scored = get_scorer().score(texts)
+    sentiments = {}
+    for text, (sentiment_category, confidence) in zip(texts, scored):
+        LOG.info(f"Sentiment Category: {sentiment_category} Confidence: {confidence}", extra=extra)
+        sentiments[text] = sentiment_mapper(sentiment=sentiment_category)
+    LOG.info(f"Created Sentiment Scores for {len(sentiments)} texts", extra=extra)
+    return sentiments
+
+def chunk_texts(chunk):
+    """Free texts of a DataFrame chunk that make_record creates sentiment for
+
+    Text values look like <USER ENTERED TEXT>/<QUESTION ID>/ChoiceTextEntryValue
+    """
+
+    if "Text" not in chunk:
+        return []
+    texts = []
+    for value in chunk["Text"]:
+        parts = value.split('/') if isinstance(value, str) else []
+        if len(parts) == 3 and parts[0] and parts[1].startswith('QID'):
+            texts.append(parts[0])
+    return texts
+
+def make_record(iloc, extra=None, questions_choices=None, sentiments=None):
     """Makes DynamoDB Record From DataFrame
+
+    sentiments maps Text values already scored, see create_sentiments,
+    other texts are scored one at a time.
     
     response = {
     ## More information about these fields
@@ -401,7 +690,10 @@ def make_record(iloc, extra=None, questions_choices=None):
             if text and question.startswith('QID'):
                 #Since there is Text, we can also create sentiment
                 new_rec["Text"] = text
-                new_rec["Sentiment"] = create_sentiment(row=new_rec["Text"],extra=extra) 
+                if sentiments and text in sentiments:
+                    new_rec["Sentiment"] = sentiments[text]
+                else:
+                    new_rec["Sentiment"] = create_sentiment(row=new_rec["Text"],extra=extra)
                 # We want to match the question id of the question in it's own column
                 # so we don't make duplicate rows
                 question = f"{question}_TEXT"
@@ -417,6 +709,9 @@ def make_record(iloc, extra=None, questions_choices=None):
 
         try:
             new_rec["Sort"] = make_sort(question, responseid, extra=extra) 
+            sample_sort = make_sample_sort(new_rec["Sort"], responseid)
+            if sample_sort:
+                new_rec["SampleSort"] = sample_sort
             new_rec["Partition"] = partition
             new_rec["LSI"] = question
             new_rec["Origin"] = iloc.get("Origin")
@@ -426,12 +721,13 @@ def make_record(iloc, extra=None, questions_choices=None):
             
            
             #handle empty latitude
-            latitude = iloc.get('Latitude') or 0.0
+            #DynamoDB rejects floats, keep the default a string like the csv values
+            latitude = iloc.get('Latitude') or "0.0"
             new_rec["Latitude"] = latitude
             new_rec["LatitudeOffset"] = f"{float(latitude):019.15F}" 
             
             #handle empty longitude
-            longitude = iloc.get('Longitude') or 0.0
+            longitude = iloc.get('Longitude') or "0.0"
             new_rec["Longitude"] = longitude
             new_rec["LongitudeOffset"] = f"{(float(longitude) + 200):019.15F}"
             
@@ -452,10 +748,24 @@ def make_record(iloc, extra=None, questions_choices=None):
         LOG.info(f"new_rec **BEFORE** None filter: {new_rec}", extra=extra)
         new_rec = {x:y for x,y in new_rec.items() if y != ""}
         LOG.info(f"new_rec **AFTER** None filter: {new_rec}", extra=extra)
+        new_rec["Fingerprint"] = record_fingerprint(new_rec, phone_number)
         recs.append(new_rec)
     LOG.info(f"Created Records: {recs}", extra=extra)
     return recs
 
+def record_fingerprint(rec, phone_number):
+    """Content hash of a response record
+
+    KMS ciphertext differs on every call and Sentiment is derived from Text,
+    so the plaintext phone number stands in for both.
+    """
+
+    content = {x:y for x,y in rec.items() if x not in FINGERPRINT_EXCLUDED_FIELDS}
+    content["PhoneNumber"] = phone_number
+    h = md5()
+    h.update(json.dumps(content, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
 def get_question_columns(df, extra):
     """takes a DataFrame and returns Question Key/Value Pairs """
 
@@ -474,7 +784,6 @@ def rename_df_colnames_cleanup(df,extra):
     """Rename the columns, drop first two rows and clean"""
 
     #rename columns
-    import ast
     vals = df.iloc[1].tolist()
     columns = [ast.literal_eval(x)['ImportId'] for x in vals]
     df.columns = columns
@@ -504,50 +813,274 @@ def populate_dynamodb(rec, extra=None):
 
     LOG.info(f"Populating DynamoDB with rec: {rec}", extra=extra)
     try:
-        res = TABLE.put_item(Item=rec)
+        res = get_table().put_item(Item=rec)
     except Exception: # pylint:disable=broad-except
         LOG.exception(f"FATAL--ERROR--WRITING--TO--DYNAMO for rec: {rec}", extra=extra)
         return None
     LOG.info(f"SUCCESS**WRITE**RECORD**DYNAMO for rec {rec} with response: {res}", extra=extra)
 
-def pd_table_populate(df=None, extra=None, survey_id=None, api_token=None, agency_id=None):
-    """Populate DynamoDB with contents of survey dataframe"""
+def fetch_fingerprints(recs, extra=None):
+    """Bulk reads the stored fingerprints of records with BatchGetItem
+
+    Returns a dict of (Partition, Sort) to Fingerprint for the items that
+    already exist.
+    """
+
+    keys = list({(rec["Partition"], rec["Sort"]) for rec in recs})
+    fingerprints = {}
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request = {get_table().name: {
+            "Keys": [{"Partition": p, "Sort": s} for p, s in keys[start:start + BATCH_GET_LIMIT]],
+            "ProjectionExpression": "#p, #s, Fingerprint",
+            "ExpressionAttributeNames": {"#p": "Partition", "#s": "Sort"},
+        }}
+        attempt = 0
+        while request:
+            if attempt:
+                time.sleep(min(0.05 * 2 ** attempt, 2))
+            response = get_resource('dynamodb').batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(get_table().name, []):
+                fingerprints[(item["Partition"], item["Sort"])] = item.get("Fingerprint")
+            request = response.get("UnprocessedKeys")
+            attempt += 1
+    LOG.info(f"Found {len(fingerprints)} stored fingerprints for {len(keys)} keys", extra=extra)
+    return fingerprints
+
+def data_version():
+    """Epoch milliseconds, versions syncs and the agency data they change"""
+
+    return int(time.time() * 1000)
+
+def record_data_version(agency_id, extra=None):
+    """Marks the agency's responses changed, see DATA_VERSION_SORT"""
+
+    version = data_version()
+    get_table().put_item(Item={"Partition": agency_id, "Sort": DATA_VERSION_SORT, "DataVersion": version})
+    LOG.info(f"Recorded data version {version} for {agency_id}", extra=extra)
+    return version
+
+def write_changed_records(batch, recs, report, extra=None, version=None):
+    """Puts only the records that are new or differ from the stored item
+
+    Written records are stamped with version when given.
+    Updates the written and skipped counts in report
+    """
+
+    if not recs:
+        return report
+    with stage("dynamodb_write") as dynamodb_write:
+        stored = fetch_fingerprints(recs, extra=extra)
+        for rec in recs:
+            if stored.get((rec["Partition"], rec["Sort"])) == rec["Fingerprint"]:
+                report["skipped"] += 1
+                continue
+            LOG.info(f"Processing a rec: {rec}", extra=extra)
+            if version is not None:
+                rec["Version"] = version
+            batch.put_item(Item=rec)
+            report["written"] += 1
+            dynamodb_write.add_records(1)
+    return report
+
+def latest_recorded_date(df, header_rows=1):
+    """Latest RecordedDate in a renamed survey DataFrame
+
+    Returned as ISO 8601 so it can be passed back to the export API as a
+    startDate.  Returns None when the export has no responses.  Pass
+    header_rows=0 for chunks from df_read_csv_chunks.
+    """
+
+    dates = [x for x in df["recordedDate"].iloc[header_rows:] if x]
+    if not dates:
+        return None
+    latest = max(dateutil.parser.parse(x) for x in dates)
+    return latest.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def advance_watermark(producer_table_id, agency_id, survey_id, recorded_date, extra=None):
+    """Moves the survey's LastRecordedDate forward in the producer table
+
+    The condition keeps a slow or retried job from moving it backwards.
+    """
+
+    LOG.info(f"Advancing watermark for {agency_id}/{survey_id} to {recorded_date}", extra=extra)
+    producer_table = get_resource('dynamodb').Table(producer_table_id)
+    try:
+        producer_table.update_item(
+            Key={"AgencyId": agency_id, "SurveyId": survey_id},
+            UpdateExpression="SET LastRecordedDate = :d",
+            ConditionExpression="attribute_not_exists(LastRecordedDate) OR LastRecordedDate < :d",
+            ExpressionAttributeValues={":d": recorded_date},
+        )
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        LOG.info(f"Watermark already at or past {recorded_date}", extra=extra)
+        return False
+    return True
+
+def record_sync(producer_table_id, agency_id, survey_id, response_count=None,
+                sync_seconds=None, extra=None):
+    """Records a successful sync of the survey in the producer table
+
+    The producer compares LastResponseCount and LastSyncedAt with the survey's
+    Qualtrics metadata to skip emitting jobs for unchanged surveys, and uses
+    LastSyncSeconds as the job's cost when spreading jobs out.
+    """
+
+    synced_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    update_expression = "SET LastSyncedAt = :s"
+    values = {":s": synced_at}
+    if sync_seconds is not None:
+        update_expression += ", LastSyncSeconds = :t"
+        values[":t"] = max(1, int(round(sync_seconds)))
+    if response_count is not None:
+        update_expression += ", LastResponseCount = :c"
+        values[":c"] = response_count
+    LOG.info(f"Recording sync of {agency_id}/{survey_id} at {synced_at}", extra=extra)
+    producer_table = get_resource('dynamodb').Table(producer_table_id)
+    producer_table.update_item(
+        Key={"AgencyId": agency_id, "SurveyId": survey_id},
+        UpdateExpression=update_expression,
+        ExpressionAttributeValues=values,
+    )
+
+def survey_definition_hash(survey_data):
+    """Hash of the parts of a survey definition that become questions and choices"""
+
+    h = md5()
+    h.update(json.dumps(survey_data.get('questions', {}), sort_keys=True).encode())
+    return h.hexdigest()
+
+def dedupe_choices(choices):
+    """Drops repeated choice sets, questions sharing choices share a QCID"""
+
+    unique = {}
+    for choice in choices:
+        unique.setdefault((choice['Partition'], choice['Sort']), choice)
+    return list(unique.values())
+
+def write_metadata(questions, choices, extra=None):
+    """Writes question items and any choice items not already stored
+
+    QCIDs are content hashes, so an existing choice item never changes and
+    the conditional put leaves it alone.  Errors are raised so the survey
+    definition hash is only stored after every item landed.
+    """
 
-    #collect survey metadata
-    response = collect_survey_endpoint(survey_id=survey_id, 
-            extra=extra, api_token=api_token) 
-    questions, choices = process_questions_from_survey(aid=agency_id, 
-                                        survey_data=response['result'], extra=extra)
-    LOG.info(f"Creating questions {questions} and choices {choices}", extra=extra)
-    
-    #Process Questions
     for question in questions:
         LOG.info(f"Processing question: {question}", extra=extra)
-        populate_dynamodb(question, extra=extra)    
-    
-    #Process Choices
+        get_table().put_item(Item=question)
     for choice in choices:
         LOG.info(f"Processing choice: {choice}", extra=extra)
-        populate_dynamodb(choice, extra=extra)   
+        try:
+            get_table().put_item(Item=choice,
+                ConditionExpression="attribute_not_exists(#s)",
+                ExpressionAttributeNames={"#s": "Sort"})
+        except botocore.exceptions.ClientError as error:
+            if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            LOG.info(f"Choice already stored: {choice['Sort']}", extra=extra)
+
+def populate_metadata(survey_id=None, api_token=None, agency_id=None, extra=None,
+    api_url=None):
+    """Writes the survey's questions and choices, returns question choices map
+
+    Skips the writes when the survey definition hash matches the one stored
+    by the last sync.
+    """
+
+    #collect survey metadata
+    api_url = api_url or qualtrics_api_url()
+    response = collect_survey_endpoint(url=f"{api_url}surveys/", survey_id=survey_id,
+            extra=extra, api_token=api_token)
+    questions, choices = process_questions_from_survey(aid=agency_id, 
+                                        survey_data=response['result'], extra=extra)
+    choices = dedupe_choices(choices)
+    LOG.info(f"Creating questions {questions} and choices {choices}", extra=extra)
+
+    definition_key = {"Partition": agency_id, "Sort": f"SURVEYDEF-{survey_id}"}
+    definition_hash = survey_definition_hash(response['result'])
+    stored = get_table().get_item(Key=definition_key).get("Item", {})
+    if stored.get("DefinitionHash") == definition_hash:
+        LOG.info(f"Survey definition unchanged: {definition_hash}, skipping questions and choices", extra=extra)
+    else:
+        write_metadata(questions, choices, extra=extra)
+        get_table().put_item(Item=dict(definition_key, DefinitionHash=definition_hash))
+        LOG.info(f"Stored survey definition hash: {definition_hash}", extra=extra)
 
     #Create Question Choices
     questions_choices = {x['Sort']: x['QuestionChoicesId'] for x in questions if 'QuestionChoicesId' in x}
     LOG.info(f"Create Question Choices: {questions_choices}", extra=extra)
+    return questions_choices
 
-    #Rename columns and process records
-    df = rename_df_colnames_cleanup(df, extra)
-    LOG.info(f"Created DataFrame: {df.iloc[1]}", extra=extra)
-    rows,_ = df.shape
-    LOG.info(f"Found number of rows: {rows}", extra=extra)
-    for index in range(1,rows):
-        LOG.info(f"Processing DataFrame Row {index}", extra=extra)
-        recs = make_record(df.iloc[index], extra=extra, questions_choices=questions_choices)
-        for rec in recs:
-            LOG.info(f"Processing a rec: {rec}", extra=extra)
-            populate_dynamodb(rec, extra=extra)
+def populate_records(chunks, questions_choices, extra=None, version=None):
+    """Writes response records for DataFrames of survey body rows
+
+    chunks is any iterable of DataFrames, so a whole export and a chunked
+    reader go through the same path.  Written records are stamped with
+    version.  Returns a report with written and skipped counts and the
+    latest RecordedDate seen.
+    """
+
+    report = {"written": 0, "skipped": 0, "rows": 0, "latest_recorded_date": None}
+    pending = []
+    #batch writer raises if any record fails, so returning means every row landed
+    with get_table().batch_writer(overwrite_by_pkeys=["Partition", "Sort"]) as batch:
+        for chunk in chunks:
+            #score the chunk's texts in batch calls rather than one call per row
+            sentiments = create_sentiments(chunk_texts(chunk), extra=extra)
+            for index, row in chunk.iterrows():
+                LOG.info(f"Processing DataFrame Row {index}", extra=extra)
+                with stage("record_build") as record_build:
+                    recs = make_record(row, extra=extra, questions_choices=questions_choices,
+                                       sentiments=sentiments)
+                    record_build.add_records(len(recs))
+                pending.extend(recs)
+                if len(pending) >= BATCH_GET_LIMIT:
+                    write_changed_records(batch, pending, report, extra=extra, version=version)
+                    pending = []
+            report["rows"] += len(chunk)
+            latest = latest_recorded_date(chunk, header_rows=0)
+            if latest and (report["latest_recorded_date"] or "") < latest:
+                report["latest_recorded_date"] = latest
+        write_changed_records(batch, pending, report, extra=extra, version=version)
     LOG.info(f"FINISHED: Processing DataFrame Rows", extra=extra)
+    LOG.info(f"SYNC REPORT: written {report['written']} skipped {report['skipped']}",
+        extra=dict(extra or {}, **report))
+    return report
+
+def pd_table_populate(df=None, extra=None, survey_id=None, api_token=None, agency_id=None,
+    api_url=None):
+    """Populate DynamoDB with contents of survey dataframe"""
+
+    questions_choices = populate_metadata(survey_id=survey_id, api_token=api_token,
+        agency_id=agency_id, extra=extra, api_url=api_url)
+
+    #Rename columns and process records
+    with stage("header_rename"):
+        df = rename_df_colnames_cleanup(df, extra)
+    LOG.info(f"Found number of rows: {df.shape[0]}", extra=extra)
+    report = populate_records([df.iloc[1:]], questions_choices, extra=extra, version=data_version())
+    if agency_id and report["written"]:
+        record_data_version(agency_id, extra=extra)
     return df
 
+def csv_table_populate(csvfile, extra=None, survey_id=None, api_token=None,
+    agency_id=None, chunksize=CSV_CHUNKSIZE, api_url=None):
+    """Populate DynamoDB with contents of a local survey csv, chunk by chunk
+
+    Memory is bounded by chunksize rather than the size of the export.
+    Returns the populate_records report.
+    """
+
+    questions_choices = populate_metadata(survey_id=survey_id, api_token=api_token,
+        agency_id=agency_id, extra=extra, api_url=api_url)
+    chunks = df_read_csv_chunks(csvfile, chunksize=chunksize, extra=extra)
+    report = populate_records(chunks, questions_choices, extra=extra, version=data_version())
+    if agency_id and report["written"]:
+        record_data_version(agency_id, extra=extra)
+    return report
+
 
 def process_questions_from_survey(aid, survey_data, extra=None):
     ''' Take suvey data and determine quesion choices and questions to make
@@ -584,59 +1117,90 @@ def process_questions_from_survey(aid, survey_data, extra=None):
     return questions_items, choices_items
 
 
+def process_sqs_record(record, table, extra=None):
+    """Runs the pipeline for the survey job in one SQS record"""
+
+    body = json.loads(record['body'])
+    survey_id = body['SurveyId']
+    agency_id = body['AgencyId']
+    api_token = os.environ.get('X_API_TOKEN')
+    bucket = os.environ.get('S3_BUCKET')
+    #'eventSourceARN': 'arn:aws:sqs:us-east-1:698112575222:etl-queue-etl-resources'
+    event_source_arn = record['eventSourceARN']
+    extra_logging = {"body": body, "survey_id": survey_id, "lambda role": "SURVEYJOB",
+     "agency_id":agency_id, "bucket": bucket, "table": str(table),
+     "message_id": record['messageId']}
+    LOG.info(f"SURVEYJOB LAMBDA, splitting sqs arn with value: {event_source_arn}",extra=extra_logging)
+    qname = event_source_arn.split(":")[-1]
+    extra_logging["queue"] = qname
+    args = [
+        'pipeline',
+        '--surveyid', survey_id,
+        '--apitoken', api_token,
+        '--bucket', bucket,
+        '--agencyid', agency_id,
+        '--queue', qname
+    ]
+    #producer items carry the watermark of the last successful sync,
+    #remove it from the item to force a full resync
+    if body.get('LastRecordedDate'):
+        args.extend(['--since', body['LastRecordedDate']])
+    #response count the producer saw when it checked the survey for changes
+    if body.get('ResponseCount') is not None:
+        args.extend(['--responsecount', str(body['ResponseCount'])])
+    LOG.info(f"Calling click pipeline function:  Will download qualtrics data, sync to dynamodb and archive to s3", extra=extra_logging)
+    with use_table(table):
+        written_bucket, downloaded_csv_file = cli.main(
+            args=args,
+            standalone_mode=False
+        )
+    extra_logging["csvfile"] = downloaded_csv_file
+    extra_logging["written_bucket"] = written_bucket
+    LOG.info(f"Archived csv file: {downloaded_csv_file} to bucket: {written_bucket}", extra=extra_logging)
+    return written_bucket, downloaded_csv_file
+
 def entrypoint(event, context):
     '''
     Lambda entrypoint
+
+    Processes every survey job in the SQS batch concurrently, up to
+    SURVEY_CONCURRENCY at once.  Failed jobs are returned as
+    batchItemFailures so only their messages are redelivered, the event
+    source mapping deletes the rest.
     '''
 
     LOG.info(f"SURVEYJOB LAMBDA, event {event}, context {context}", extra=os.environ)
-    receipt_handle  = event['Records'][0]['receiptHandle'] #sqs message
-    #'eventSourceARN': 'arn:aws:sqs:us-east-1:698112575222:etl-queue-etl-resources'
-    event_source_arn = event['Records'][0]['eventSourceARN']
-    for record in event['Records']:
-        body = json.loads(record['body'])
-        survey_id = body['SurveyId']
-        agency_id = body['AgencyId']
-        api_token = os.environ.get('X_API_TOKEN')
-        table_id = os.environ.get('AGENCIES_TABLE_ID')
-        global TABLE # pylint:disable=W0603
-        TABLE = DYNAMODB.Table(table_id)# pylint:disable=W0621
-        bucket = os.environ.get('S3_BUCKET')
-        extra_logging = {"body": body, "survey_id": survey_id, "lambda role": "SURVEYJOB",
-         "agency_id":agency_id, api_token: "api_token", "bucket": bucket, "table": {TABLE}}
-        LOG.info(f"SURVEYJOB LAMBDA, splitting sqs arn with value: {event_source_arn}",extra=extra_logging)
-        qname = event_source_arn.split(":")[-1]
-        extra_logging["queue"] = qname
-        LOG.info(f"Calling click run function:  Will download qualtrics data and write to s3", extra=extra_logging)
-        written_bucket, downloaded_csv_file = cli.main(
-            args=[
-                'run',
-                '--surveyid', survey_id,
-                '--apitoken', api_token,
-                '--bucket', bucket,
-                '--queue', qname
-            ],
-            standalone_mode=False
-        )
-        LOG.info(f"this is downloaded_csv_file path: {downloaded_csv_file} from bucket: {written_bucket}",extra=extra_logging)
-        extra_logging["csvfile"] = downloaded_csv_file
-        extra_logging["written_bucket"] = written_bucket
-        LOG.info(f"Running sync-db click function:  will read from s3 and map csv data to dynamodb",extra=extra_logging)
-        cli.main(
-            args=[
-                'sync-db',
-                '--surveyid', survey_id,
-                '--apitoken', api_token,
-                '--bucket', written_bucket,
-                '--agencyid', agency_id,
-                '--csvfile', downloaded_csv_file,
-                  '--queue', qname
-            ],
-            standalone_mode=False
-        )
-        LOG.info(f"Attemping Deleting SQS receiptHandle {receipt_handle} with queue_name {qname}", extra=extra_logging)
-        res = delete_sqs_msg(queue_name=qname, receipt_handle=receipt_handle)
-        LOG.info(f"Deleted SQS receipt_handle {receipt_handle} with res {res}", extra=extra_logging)
+    table_id = os.environ.get('AGENCIES_TABLE_ID')
+    records = event['Records']
+
+    def process(record):
+        #each worker builds its own table, resources are cached per thread
+        return process_sqs_record(record, get_resource('dynamodb').Table(table_id))
+
+    concurrency = int(os.environ.get('SURVEY_CONCURRENCY', SURVEY_CONCURRENCY))
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(records)))) as executor:
+        futures = {executor.submit(process, record): record for record in records}
+        for future in as_completed(futures):
+            record = futures[future]
+            try:
+                future.result()
+            except Exception: # pylint:disable=broad-except
+                LOG.exception(f"SURVEYJOB FAILED for message {record['messageId']}",
+                    extra={"body": record['body'], "message_id": record['messageId']})
+                failures.append({"itemIdentifier": record['messageId']})
+    LOG.info(f"SURVEYJOB LAMBDA finished {len(records)} records with {len(failures)} failures",
+        extra={"qualtrics_api": get_qualtrics_client().metrics_report(),
+               "sentiment_scorer": get_scorer().stats()})
+    return {"batchItemFailures": failures}
+
+def log_profile(profiler, profile_path=None, extra=None):
+    """Logs the stage report as structured json, dumps cProfile stats if asked"""
+
+    LOG.info(f"SYNC PROFILE", extra=dict(extra or {}, profile=profiler.report()))
+    if profile_path:
+        profiler.dump_stats(profile_path)
+        LOG.info(f"Wrote cProfile stats to {profile_path}", extra=extra)
 
 @click.group()
 def cli():
@@ -664,9 +1228,7 @@ def run(surveyid, apitoken, bucket, queue):
     extra_logging = {"surveyid":surveyid, "apitoken":apitoken, "bucket":bucket, "queue":queue}
     LOG.info(f"Running Click run with surveyid", extra=extra_logging)
     downloaded_csv_file = download_csv_survey(api_token=apitoken, survey_id=surveyid)
-    file_name = os.path.split(downloaded_csv_file)[-1]
-    LOG.info(f"Found filename {file_name}", extra=extra_logging)
-    s3_name_to_create = f"{surveyid}-{file_name}"
+    s3_name_to_create = s3_object_name(surveyid, downloaded_csv_file)
     LOG.info(f"Writing qualtrics download with name: {s3_name_to_create} to S3", extra=extra_logging)
     s3_file_handle = write_s3(source_file=downloaded_csv_file,
         file_to_write=s3_name_to_create, bucket=bucket)
@@ -674,6 +1236,34 @@ def run(surveyid, apitoken, bucket, queue):
     LOG.info(f"Boto S3 file handle:  {s3_file_handle}", extra=extra_logging)
     return s3_file_handle
 
+@cli.command()
+@click.option("--surveyid", "surveyids", multiple=True, required=True,
+    help="qualtrics survey id, repeat for each survey")
+@click.option("--apitoken", envvar="X_API_TOKEN", help="apitoken")
+@click.option("--bucket", envvar="SURVEY_BUCKET", help="S3 bucket to write survey csv")
+@click.option("--workers", default=8, help="concurrent export requests")
+def run_many(surveyids, apitoken, bucket, workers):
+    """Run exports for many surveys concurrently and write to s3
+
+    python qualtrics.py run-many --surveyid SV_1G2GmpaXrcPAenr --surveyid SV_cGXWxvADgIihxrf
+    """
+
+    extra_logging = {"surveyids":surveyids, "bucket":bucket, "workers":workers}
+    LOG.info(f"Running Click run-many", extra=extra_logging)
+    downloads = download_csv_surveys(list(surveyids), api_token=apitoken, max_workers=workers)
+    archives = {}
+    for survey_id, downloaded_csv_file in downloads.items():
+        if isinstance(downloaded_csv_file, Exception):
+            LOG.error(f"Skipping s3 write for failed export {survey_id}: {downloaded_csv_file}", extra=extra_logging)
+            continue
+        archives[survey_id] = archive_s3_async(source_file=downloaded_csv_file,
+            file_to_write=s3_object_name(survey_id, downloaded_csv_file), bucket=bucket)
+    s3_file_handles = {survey_id: archive.result() for survey_id, archive in archives.items()}
+    LOG.info(f"Boto S3 file handles:  {s3_file_handles}", extra=extra_logging)
+    LOG.info(f"Qualtrics API metrics", extra={"qualtrics_api": get_qualtrics_client().metrics_report()})
+    click.echo(s3_file_handles)
+    return s3_file_handles
+
 @cli.command()
 @click.option("--csvfile", envvar="CSV_FILE",
     help="s3 based csv file")
@@ -685,7 +1275,12 @@ def run(surveyid, apitoken, bucket, queue):
 @click.option("--surveyid", envvar="SURVEY_TABLE",
     default="SV_1G2GmpaXrcPAenr", help="qualtrics survey id")
 @click.option("--apitoken", envvar="X_API_TOKEN", help="apitoken")
-def sync_db(csvfile, bucket, agencyid, queue, surveyid, apitoken):
+@click.option("--chunksize", default=CSV_CHUNKSIZE, help="responses parsed at a time")
+@click.option("--profile", is_flag=True, help="also dump cProfile stats to /tmp")
+@click.option("--trace-memory/--no-trace-memory", default=False,
+    help="track peak memory per stage with tracemalloc, slows the sync")
+def sync_db(csvfile, bucket, agencyid, queue, surveyid, apitoken, chunksize, profile,
+    trace_memory):
     """Sync CSV to DynamoDB
     
     
@@ -706,18 +1301,88 @@ def sync_db(csvfile, bucket, agencyid, queue, surveyid, apitoken):
         "locals": saved_args
     }
     LOG.info(f"Running Click syncdb with csvfile", extra=extra_logging)
-    df = df_read_csv(
+    local_csv_file = download_s3_csv(
         file_to_read=csvfile,
         bucket=bucket
     )
-    LOG.info(f"Contents of initial dataframe: {df.to_dict()}", extra=extra_logging)
-    #LOG.info(f"Found Survey Metadata: {}")
-    LOG.info(f"Found DataFrame Columns: {df.columns}", extra=extra_logging);df.head()
     LOG.info(f"START SYNCDB:", extra=extra_logging)
-    pd_table_populate(df,extra=extra_logging, survey_id=surveyid, 
-                    api_token=apitoken, agency_id=agencyid)
+    profiler = StageProfiler(job={"survey_id": surveyid, "agency_id": agencyid},
+        trace_memory=trace_memory, profile=profile)
+    try:
+        with profiler:
+            csv_table_populate(local_csv_file, extra=extra_logging, survey_id=surveyid,
+                            api_token=apitoken, agency_id=agencyid, chunksize=chunksize)
+    finally:
+        log_profile(profiler, profile_path=f"/tmp/{surveyid}-sync-db.prof" if profile else None,
+            extra=extra_logging)
     LOG.info(f"FINISH SYNCDB: ", extra=extra_logging)
 
+@cli.command()
+@click.option("--surveyid", envvar="SURVEY_TABLE",
+    default="SV_1G2GmpaXrcPAenr", help="qualtrics survey id")
+@click.option("--apitoken", envvar="X_API_TOKEN", help="apitoken")
+@click.option("--bucket", envvar="SURVEY_BUCKET", help="S3 bucket to archive survey csv")
+@click.option("--agencyid",
+    help="Agency ID")
+@click.option("--queue", default=None)
+@click.option("--since", default=None,
+    help="only sync responses recorded since this ISO 8601 date")
+@click.option("--producertable", envvar="PRODUCER_JOB_TABLE", default=None,
+    help="producer table to advance the survey's LastRecordedDate in")
+@click.option("--responsecount", type=int, default=None,
+    help="survey response count to record in the producer table after the sync")
+@click.option("--chunksize", default=CSV_CHUNKSIZE, help="responses parsed at a time")
+@click.option("--profile", is_flag=True, help="also dump cProfile stats to /tmp")
+@click.option("--trace-memory/--no-trace-memory", default=False,
+    help="track peak memory per stage with tracemalloc, slows the sync")
+def pipeline(surveyid, apitoken, bucket, agencyid, queue, since, producertable, responsecount,
+    chunksize, profile, trace_memory):
+    """Download export and sync to DynamoDB in one pass
+
+    Same result as `run` followed by `sync-db`, but the downloaded csv is
+    parsed locally and archived to s3 concurrently instead of being
+    uploaded and read back.
+
+    python qualtrics.py pipeline --surveyid SV_cGXWxvADgIihxrf \
+            --bucket rojopolis-survey-us-east-1-698112575222 --agencyid AID-BOS-dd3244
+
+    With --since only newer responses are exported, and with --producertable
+    the survey's watermark is advanced once every record has been written,
+    and the sync time, its duration and --responsecount are recorded for the
+    producer.
+    A per stage SYNC PROFILE report is logged at the end of every run.
+    """
+
+    extra_logging = {"surveyid":surveyid, "bucket":bucket, "agencyid":agencyid,
+        "queue":queue, "since":since, "function_name": "pipeline"}
+    LOG.info(f"Running Click pipeline with surveyid", extra=extra_logging)
+    profiler = StageProfiler(job={"survey_id": surveyid, "agency_id": agencyid},
+        trace_memory=trace_memory, profile=profile)
+    started = time.perf_counter()
+    try:
+        with profiler:
+            downloaded_csv_file = download_csv_survey(api_token=apitoken, survey_id=surveyid,
+                start_date=since)
+            s3_name_to_create = s3_object_name(surveyid, downloaded_csv_file)
+            archive = archive_s3_async(source_file=downloaded_csv_file,
+                file_to_write=s3_name_to_create, bucket=bucket)
+            LOG.info(f"START SYNCDB:", extra=extra_logging)
+            report = csv_table_populate(downloaded_csv_file, extra=extra_logging, survey_id=surveyid,
+                            api_token=apitoken, agency_id=agencyid, chunksize=chunksize)
+            LOG.info(f"FINISH SYNCDB: ", extra=extra_logging)
+            watermark = report["latest_recorded_date"]
+            if producertable and watermark:
+                advance_watermark(producertable, agencyid, surveyid, watermark, extra=extra_logging)
+            if producertable:
+                record_sync(producertable, agencyid, surveyid, response_count=responsecount,
+                    sync_seconds=time.perf_counter() - started, extra=extra_logging)
+            s3_file_handle = archive.result()
+    finally:
+        log_profile(profiler, profile_path=f"/tmp/{surveyid}-pipeline.prof" if profile else None,
+            extra=extra_logging)
+    LOG.info(f"Boto S3 file handle:  {s3_file_handle}", extra=extra_logging)
+    return s3_file_handle
+
 if __name__ == "__main__":
     API_TOKEN, TABLE = setup_environment()
     cli()
@@ -0,0 +1,117 @@
+"""
+Pooled HTTP client for the Qualtrics v3 API
+
+One keep-alive requests.Session per container, so export polling and
+downloads reuse connections instead of doing a TCP+TLS handshake per call.
+Throttled (429) and server error responses are retried with backoff,
+honouring Retry-After, except that POSTs, which are not idempotent, are only
+resent after a 429 or a connection error.  Every call is timed by name:
+
+In [1]: client = get_qualtrics_client()
+In [2]: client.metrics_report()
+Out[2]:
+{'poll_export': {'calls': 6, 'errors': 0, 'seconds': 0.84, 'max_seconds': 0.21}}
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import logging
+
+LOG = logging.getLogger()
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+QUALTRICS_CLIENT = None
+_LOCK = threading.Lock()
+
+
+class QualtricsRetry(Retry):
+    """Retry that also resends POSTs answered 429
+
+    POST is left out of allowed_methods, so a POST answered with a server
+    error or timing out, which Qualtrics may have acted on, is not sent
+    again.  A 429 is refused before the request is handled, and connection
+    errors happen before it is sent, so both are safe to retry.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == "POST" and status_code == 429:
+            return True
+        return super().is_retry(method, status_code, has_retry_after=has_retry_after)
+
+
+class QualtricsClient():
+    """Keep-alive session with retries and per call timing"""
+
+    def __init__(self, pool_maxsize=25, retries=5, backoff_factor=0.5, timeout=(5, 60)):
+        retry = QualtricsRetry(total=retries,
+                               backoff_factor=backoff_factor,
+                               status_forcelist=RETRY_STATUSES,
+                               allowed_methods=frozenset(["GET"]),
+                               respect_retry_after_header=True,
+                               raise_on_status=False)
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "content-type": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+        })
+        self.timeout = timeout
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, api_token=None, name=None, **kwargs):
+        """Send a request, raising for error statuses left after retries"""
+
+        name = name or method
+        headers = {"x-api-token": api_token}
+        headers.update(kwargs.pop("headers", {}))
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(method, url, headers=headers,
+                timeout=self.timeout, **kwargs)
+            response.raise_for_status()
+            failed = False
+            return response
+        finally:
+            self._record(name, time.perf_counter() - start, failed)
+
+    def get(self, url, api_token=None, name=None, **kwargs):
+        return self.request("GET", url, api_token=api_token, name=name, **kwargs)
+
+    def post(self, url, api_token=None, name=None, **kwargs):
+        return self.request("POST", url, api_token=api_token, name=name, **kwargs)
+
+    def _record(self, name, seconds, failed):
+        with self._lock:
+            metric = self.metrics.setdefault(name,
+                {"calls": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0})
+            metric["calls"] += 1
+            metric["errors"] += int(failed)
+            metric["seconds"] += seconds
+            metric["max_seconds"] = max(metric["max_seconds"], seconds)
+
+    def metrics_report(self):
+        """Call counts and timings by name, seconds rounded for logging"""
+
+        with self._lock:
+            return {name: dict(metric, seconds=round(metric["seconds"], 3),
+                               max_seconds=round(metric["max_seconds"], 3))
+                    for name, metric in self.metrics.items()}
+
+
+def get_qualtrics_client():
+    """Manages lazy global client instantiation"""
+
+    global QUALTRICS_CLIENT # pylint: disable=global-statement
+    if QUALTRICS_CLIENT is None:
+        with _LOCK:
+            if QUALTRICS_CLIENT is None:
+                QUALTRICS_CLIENT = QualtricsClient()
+    return QUALTRICS_CLIENT
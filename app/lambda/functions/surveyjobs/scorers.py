@@ -0,0 +1,267 @@
+"""
+Sentiment scorers
+
+Every scorer takes a list of texts and returns one (sentiment, confidence)
+pair per text, with sentiment one of POSITIVE, NEGATIVE, NEUTRAL or MIXED:
+
+In [1]: LexiconScorer().score(["thanks", "the officer was rude"])
+Out[1]: [('POSITIVE', 0.95), ('NEGATIVE', 0.667)]
+
+comprehend: AWS Comprehend, the default, raises SentimentError for texts it
+    cannot score after retries rather than leaving them without a sentiment
+local: offline lexicon classifier scoring a whole batch with vectorized ops
+cascade: local scoring, with only low confidence texts sent to Comprehend
+
+The scorer is picked with the SENTIMENT_SCORER environment variable.
+"""
+import os
+import threading
+import time
+from hashlib import md5
+
+import numpy as np
+import pandas as pd
+
+from clients import get_client
+
+import logging
+
+LOG = logging.getLogger()
+
+BATCH_SIZE = 25
+RETRIES = 3
+RETRYABLE_ERRORS = ("InternalServerException", "ThrottlingException")
+CONFIDENCE_THRESHOLD = 0.6
+AUDIT_RATE = 0.05
+
+# whole replies common enough to settle without looking at words
+REPLIES = {
+    "": "NEUTRAL", "yes": "NEUTRAL", "no": "NEUTRAL", "n/a": "NEUTRAL", "na": "NEUTRAL",
+    "none": "NEUTRAL", "nothing": "NEUTRAL", "ok": "NEUTRAL", "okay": "NEUTRAL",
+    "no comment": "NEUTRAL", "no comments": "NEUTRAL",
+    "thanks": "POSITIVE", "thank you": "POSITIVE", "thank you!": "POSITIVE",
+    "thanks!": "POSITIVE", "great": "POSITIVE", "good": "POSITIVE",
+    "excellent": "POSITIVE", "bad": "NEGATIVE", "terrible": "NEGATIVE",
+}
+REPLY_CONFIDENCE = 0.95
+
+LEXICON = {
+    "good": 1.0, "great": 1.5, "excellent": 2.0, "amazing": 2.0, "awesome": 2.0,
+    "helpful": 1.5, "kind": 1.0, "friendly": 1.5, "polite": 1.5, "courteous": 1.5,
+    "professional": 1.5, "respectful": 1.5, "quick": 1.0, "fast": 1.0,
+    "thanks": 1.0, "thank": 1.0, "appreciate": 1.5, "appreciated": 1.5,
+    "happy": 1.5, "satisfied": 1.5, "safe": 1.0, "calm": 1.0, "best": 1.5,
+    "love": 2.0, "nice": 1.0, "pleasant": 1.0, "responsive": 1.0,
+    "bad": -1.0, "poor": -1.5, "terrible": -2.0, "awful": -2.0, "horrible": -2.0,
+    "rude": -2.0, "unhelpful": -1.5, "slow": -1.0, "late": -1.0, "never": -0.5,
+    "angry": -1.5, "upset": -1.5, "unsafe": -1.5, "scared": -1.5, "afraid": -1.5,
+    "disrespectful": -2.0, "unprofessional": -2.0, "worst": -2.0, "hate": -2.0,
+    "ignored": -1.5, "waited": -0.5, "wait": -0.5, "disappointed": -1.5,
+    "useless": -2.0, "aggressive": -1.5, "hostile": -2.0,
+}
+NEGATORS = ("not", "no", "never", "didn't", "don't", "wasn't", "isn't", "nothing")
+# words after a negator it flips, "did not feel safe" reaches safe
+NEGATION_WINDOW = 3
+
+
+class SentimentError(Exception):
+    """Texts Comprehend could not score, errors holds the last ErrorList entries"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} texts could not be scored: "
+                         f"{sorted(set(x.get('ErrorCode') for x in errors))}")
+        self.errors = errors
+
+
+class ComprehendScorer():
+    """Scores with AWS Comprehend, 25 texts per batch call"""
+
+    name = "comprehend"
+
+    def __init__(self, client=None, retries=RETRIES):
+        self.client = client
+        self.retries = retries
+
+    def _client(self):
+        return self.client or get_client('comprehend')
+
+    def score(self, texts):
+        if len(texts) == 1:
+            payload = self._client().detect_sentiment(Text=texts[0], LanguageCode='en')
+            return [(payload['Sentiment'], max(payload['SentimentScore'].values()))]
+        results = {}
+        for start in range(0, len(texts), BATCH_SIZE):
+            results.update(self._score_batch(texts[start:start + BATCH_SIZE]))
+        return [results[text] for text in texts]
+
+    def _score_batch(self, texts):
+        """Texts failing with a retryable error are sent again with backoff
+
+        Raises SentimentError when texts are still failing after the retries
+        or fail with an error that is not retryable.
+        """
+
+        results = {}
+        remaining = list(dict.fromkeys(texts))
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(min(0.2 * 2 ** attempt, 5))
+            payload = self._client().batch_detect_sentiment(TextList=remaining, LanguageCode='en')
+            for result in payload['ResultList']:
+                results[remaining[result['Index']]] = (result['Sentiment'],
+                    max(result['SentimentScore'].values()))
+            errors = payload.get('ErrorList', [])
+            if errors:
+                LOG.debug(f"Sentiment errors: {errors}")
+            failed = [error for error in errors if error.get('ErrorCode') not in RETRYABLE_ERRORS]
+            remaining = [remaining[error['Index']] for error in errors
+                         if error.get('ErrorCode') in RETRYABLE_ERRORS]
+            if failed or not remaining:
+                break
+        if errors:
+            LOG.error(f"Sentiment failed for {len(errors)} of {len(texts)} texts",
+                      extra={"errors": errors})
+            raise SentimentError(errors)
+        return results
+
+    def stats(self):
+        return {"scorer": self.name}
+
+
+class LexiconScorer():
+    """Offline word list classifier
+
+    Words are weighted from LEXICON and flipped when one of the
+    NEGATION_WINDOW words before them is a negator.  Polarity is
+    the weighted sum over the total absolute weight, and confidence grows with
+    the polarity and the number of sentiment words found, so texts with few
+    or conflicting cues come back with low confidence.
+    """
+
+    name = "local"
+
+    def __init__(self, lexicon=None, replies=None):
+        self.lexicon = pd.Series(lexicon or LEXICON, dtype=float)
+        self.replies = replies or REPLIES
+
+    def score(self, texts):
+        texts = pd.Series(texts, dtype=object).fillna("").astype(str)
+        cleaned = texts.str.strip().str.lower()
+        tokens = cleaned.str.findall(r"[a-z']+").explode()
+        weights = tokens.map(self.lexicon).fillna(0.0)
+        by_text = tokens.groupby(level=0)
+        negated = np.logical_or.reduce([by_text.shift(n).isin(NEGATORS).to_numpy()
+                                        for n in range(1, NEGATION_WINDOW + 1)])
+        weights = weights.where(~negated, -weights)
+
+        total = weights.groupby(level=0).sum().reindex(texts.index, fill_value=0.0).to_numpy()
+        magnitude = weights.abs().groupby(level=0).sum().reindex(texts.index, fill_value=0.0).to_numpy()
+        hits = (weights != 0).groupby(level=0).sum().reindex(texts.index, fill_value=0).to_numpy()
+        words = tokens.notna().groupby(level=0).sum().reindex(texts.index, fill_value=0).to_numpy()
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            polarity = np.where(magnitude > 0, total / magnitude, 0.0)
+        confidence = np.abs(polarity) * np.minimum(1.0, (hits + 1) / 3.0) * np.where(words > 20, 0.5, 1.0)
+        sentiment = np.select([polarity > 0, polarity < 0], ["POSITIVE", "NEGATIVE"], "NEUTRAL")
+
+        reply = cleaned.map(self.replies)
+        known = reply.notna().to_numpy()
+        sentiment = np.where(known, reply.to_numpy(), sentiment)
+        confidence = np.where(known, REPLY_CONFIDENCE, np.round(confidence, 3))
+        return list(zip(sentiment.tolist(), confidence.tolist()))
+
+    def stats(self):
+        return {"scorer": self.name}
+
+
+class CascadeScorer():
+    """Local scoring first, the remote scorer only for low confidence texts
+
+    A deterministic audit_rate sample of confident texts is also scored
+    remotely, and stats() reports how often the two agreed.
+    """
+
+    name = "cascade"
+
+    def __init__(self, local=None, remote=None, threshold=CONFIDENCE_THRESHOLD,
+                 audit_rate=AUDIT_RATE):
+        self.local = local or LexiconScorer()
+        self.remote = remote or ComprehendScorer()
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.counts = {"texts": 0, "local": 0, "remote": 0, "agreed": 0,
+                       "audited": 0, "audit_agreed": 0}
+        self._lock = threading.Lock()
+
+    def _audit(self, text):
+        return int(md5(text.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF < self.audit_rate
+
+    def score(self, texts):
+        results = self.local.score(texts)
+        ambiguous = [i for i, (_, confidence) in enumerate(results) if confidence < self.threshold]
+        audited = [i for i, (_, confidence) in enumerate(results)
+                   if confidence >= self.threshold and self._audit(texts[i])]
+        remote_indexes = ambiguous + audited
+        remote = self.remote.score([texts[i] for i in remote_indexes]) if remote_indexes else []
+        local_sentiments = [sentiment for sentiment, _ in results]
+        for i, scored in zip(remote_indexes, remote):
+            results[i] = scored
+        agreed = [sentiment == local_sentiments[i] for i, (sentiment, _) in zip(remote_indexes, remote)]
+        with self._lock:
+            self.counts["texts"] += len(texts)
+            self.counts["local"] += len(texts) - len(ambiguous)
+            self.counts["remote"] += len(remote_indexes)
+            self.counts["agreed"] += sum(agreed)
+            self.counts["audited"] += len(audited)
+            self.counts["audit_agreed"] += sum(agreed[len(ambiguous):])
+        return results
+
+    def stats(self):
+        """Texts kept local or sent remote, and how often local matched remote
+
+        agreement covers every remotely scored text, audit_agreement only the
+        sample of texts the local scorer was confident about.
+        """
+
+        with self._lock:
+            counts = dict(self.counts)
+        ratio = lambda part, whole: round(part / whole, 3) if whole else None
+        return dict(counts, scorer=self.name,
+                    agreement=ratio(counts["agreed"], counts["remote"]),
+                    audit_agreement=ratio(counts["audit_agreed"], counts["audited"]))
+
+
+SCORERS = {
+    "comprehend": ComprehendScorer,
+    "local": LexiconScorer,
+    "cascade": CascadeScorer,
+}
+SCORER = None
+_LOCK = threading.Lock()
+
+
+def make_scorer(name):
+    try:
+        return SCORERS[name]()
+    except KeyError:
+        raise ValueError(f"unknown sentiment scorer {name}, expected one of {sorted(SCORERS)}")
+
+
+def get_scorer():
+    """Manages lazy global scorer instantiation from SENTIMENT_SCORER"""
+
+    global SCORER # pylint: disable=global-statement
+    if SCORER is None:
+        with _LOCK:
+            if SCORER is None:
+                SCORER = make_scorer(os.environ.get("SENTIMENT_SCORER", "comprehend"))
+    return SCORER
+
+
+def set_scorer(scorer):
+    """Replaces the global scorer, returns the previous one"""
+
+    global SCORER # pylint: disable=global-statement
+    with _LOCK:
+        previous, SCORER = SCORER, scorer
+    return previous
@@ -1,4 +1,15 @@
-"""Sentiments Tool"""
+"""Sentiments Tool
+
+Scores a text column of a CSV or Parquet file, with AWS Comprehend by default:
+
+    python sentiment.py dataframe-sentiments --input responses.csv \
+        --column Text --output scored.csv
+
+The input is read in chunks and each distinct text is scored once, 25 texts
+per batch with several batches in flight.  Scored chunks are appended to the
+output as they finish.  --scorer local scores offline, --scorer cascade
+only sends texts the local scorer is unsure about to Comprehend.
+"""
 
 #SETUP LOGGING
 import logging
@@ -11,10 +22,20 @@ formatter = jsonlogger.JsonFormatter()
 logHandler.setFormatter(formatter)
 LOG.addHandler(logHandler)
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import click
-import boto3
 import pandas as pd
 
+from clients import configure
+from scorers import SCORERS, get_scorer, make_scorer
+
+BATCH_SIZE = 25
+MAX_WORKERS = 4
+CHUNKSIZE = 10000
+configure(max_pool_connections=MAX_WORKERS + 2)
+
 TEST_DF = pd.DataFrame(
     {"SentimentRaw": ["I am very Angry",
                     "We are very Happy",
@@ -22,37 +43,140 @@ TEST_DF = pd.DataFrame(
 )
 
 def create_sentiment(row):
-    """Uses AWS Comprehend to Create Sentiments on a DataFrame"""
+    """Scores one text with the configured scorer, see scorers.py"""
 
     LOG.info(f"Processing {row}")
-    comprehend = boto3.client(service_name='comprehend')
-    payload = comprehend.detect_sentiment(Text=row, LanguageCode='en')
-    LOG.debug(f"Found Sentiment: {payload}")    
-    sentiment = payload['Sentiment']
+    [(sentiment, confidence)] = get_scorer().score([row])
+    LOG.debug(f"Found Sentiment: {sentiment} with confidence {confidence}")
     return sentiment
 
-def apply_sentiment(df, column="SentimentRaw"):
-    """Uses Pandas Apply to Create Sentiment Analysis"""
+def batch_sentiment(texts, scorer=None):
+    """Scores a batch of texts, returns a dictionary of text to sentiment"""
+
+    scorer = scorer or get_scorer()
+    return {text: sentiment for text, (sentiment, _) in zip(texts, scorer.score(texts))}
+
+def batch_sentiments(texts, executor, cache=None, batch_size=BATCH_SIZE, scorer=None):
+    """Scores distinct, non empty texts in concurrent batches
+
+    cache holds texts already scored, it is updated and returned.
+    """
+
+    cache = {} if cache is None else cache
+    unique = [text for text in dict.fromkeys(texts)
+              if isinstance(text, str) and text.strip() and text not in cache]
+    batches = [unique[i:i + batch_size] for i in range(0, len(unique), batch_size)]
+    for results in executor.map(lambda batch: batch_sentiment(batch, scorer=scorer), batches):
+        cache.update(results)
+    return cache
 
-    df['Sentiment'] = df[column].apply(create_sentiment)
+def apply_sentiment(df, column="SentimentRaw", executor=None, cache=None, scorer=None):
+    """Adds a Sentiment column, scoring each distinct text once"""
+
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            return apply_sentiment(df, column=column, executor=pool, cache=cache, scorer=scorer)
+    cache = batch_sentiments(df[column], executor, cache=cache, scorer=scorer)
+    df['Sentiment'] = df[column].map(cache)
     return df
 
+def read_chunks(path, chunksize=CHUNKSIZE):
+    """Yields DataFrames of at most chunksize rows from a CSV or Parquet file"""
+
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq # pylint: disable=import-outside-toplevel
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, dtype=str, chunksize=chunksize)
+
+class ChunkWriter():
+    """Appends DataFrames to a CSV or Parquet file as they are produced"""
+
+    def __init__(self, path):
+        self.path = path
+        self._parquet = None
+        self._started = False
+
+    def write(self, df):
+        if self.path.endswith(".parquet"):
+            import pyarrow as pa # pylint: disable=import-outside-toplevel
+            import pyarrow.parquet as pq # pylint: disable=import-outside-toplevel
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+        else:
+            df.to_csv(self.path, mode="a" if self._started else "w",
+                      header=not self._started, index=False)
+        self._started = True
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+def score_file(input_path, output_path, column="SentimentRaw", chunksize=CHUNKSIZE,
+               max_workers=MAX_WORKERS, progress=None, scorer=None):
+    """Scores a file chunk by chunk, returns a report of rows and texts scored"""
+
+    cache = {}
+    report = {"chunks": 0, "rows": 0, "texts_scored": 0}
+    writer = ChunkWriter(output_path)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for chunk in read_chunks(input_path, chunksize=chunksize):
+                writer.write(apply_sentiment(chunk, column=column, executor=executor,
+                                             cache=cache, scorer=scorer))
+                report["chunks"] += 1
+                report["rows"] += len(chunk)
+                report["texts_scored"] = len(cache)
+                LOG.info(f"Scored chunk {report['chunks']} of {input_path}", extra=report)
+                if progress:
+                    progress(report)
+    finally:
+        writer.close()
+    return report
+
 @click.group()
 def cli():
     pass
 
 @cli.command()
-def dataframe_sentiments(df=TEST_DF):
+@click.option("--input", "input_path", type=click.Path(exists=True), default=None,
+    help="CSV or Parquet file, the built in test DataFrame when omitted")
+@click.option("--output", "output_path", default=None,
+    help="CSV or Parquet file to write, defaults to <input>-sentiment")
+@click.option("--column", default="SentimentRaw", help="text column to score")
+@click.option("--chunksize", default=CHUNKSIZE, help="rows read at a time")
+@click.option("--workers", default=MAX_WORKERS, help="batch requests in flight")
+@click.option("--scorer", "scorer_name", type=click.Choice(sorted(SCORERS)), default=None,
+    help="sentiment scorer, defaults to SENTIMENT_SCORER or comprehend")
+def dataframe_sentiments(input_path, output_path, column, chunksize, workers, scorer_name):
     """Processes DataFrame and adds Sentiment
-    
+
     To run:
         python sentiment.py dataframe-sentiments
+        python sentiment.py dataframe-sentiments --input responses.parquet --column Text
     """
-    
-    df_incoming = apply_sentiment(df)
-    click.echo(df_incoming)
+
+    scorer = make_scorer(scorer_name) if scorer_name else get_scorer()
+    if input_path is None:
+        df_incoming = apply_sentiment(TEST_DF.copy(), scorer=scorer)
+        click.echo(df_incoming)
+        click.echo(scorer.stats())
+        return
+    if output_path is None:
+        root, ext = os.path.splitext(input_path)
+        output_path = f"{root}-sentiment{ext}"
+    LOG.setLevel(logging.INFO)
+    report = score_file(input_path, output_path, column=column, chunksize=chunksize,
+        max_workers=workers, scorer=scorer,
+        progress=lambda report: click.echo(
+            f"{report['rows']} rows, {report['texts_scored']} distinct texts scored", err=True))
+    click.echo(f"Wrote {report['rows']} rows to {output_path}")
+    click.echo(scorer.stats())
 
 
 
 if __name__ == "__main__":
-    cli()
\ No newline at end of file
+    cli()
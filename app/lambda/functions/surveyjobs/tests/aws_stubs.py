@@ -0,0 +1,148 @@
+'''
+Local stand-ins for the AWS services used during ingestion
+
+StubTable keeps items in memory keyed on Partition/Sort, StubKMS and
+StubComprehend answer deterministically.  stub_aws swaps them in for the
+clients and table used by qualtrics.
+'''
+import base64
+from contextlib import contextmanager
+from hashlib import md5
+
+import botocore
+
+import qualtrics
+import scorers
+
+SENTIMENTS = ('POSITIVE', 'NEGATIVE', 'NEUTRAL', 'MIXED')
+
+
+class StubBatchWriter():
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def put_item(self, Item):
+        self.table.items[(Item['Partition'], Item['Sort'])] = Item
+        self.table.puts.append((Item['Partition'], Item['Sort']))
+
+
+class StubTable():
+    '''Minimal agencies table keyed on Partition/Sort'''
+    def __init__(self, name='agencies-test'):
+        self.name = name
+        self.items = {}
+        self.puts = []
+        self.updates = []
+
+    def get_item(self, Key):
+        item = self.items.get((Key['Partition'], Key['Sort']))
+        return {'Item': item} if item else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None):
+        key = (Item['Partition'], Item['Sort'])
+        if ConditionExpression and key in self.items:
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+        self.items[key] = Item
+        self.puts.append(key)
+
+    def update_item(self, Key, **kwargs):
+        self.updates.append(dict(kwargs, Key=Key))
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return StubBatchWriter(self)
+
+
+class StubDynamoDB():
+    '''table answers for every name but those already in tables'''
+    def __init__(self, table, tables=None):
+        self.table = table
+        self.tables = tables or {}
+
+    def Table(self, name): # pylint: disable=invalid-name
+        return self.tables.get(name, self.table)
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for name, request in RequestItems.items():
+            found = [self.table.items.get((key['Partition'], key['Sort'])) for key in request['Keys']]
+            responses[name] = [x for x in found if x]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+class StubS3Object():
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.key = (bucket, key)
+
+    def put(self, Body):
+        self.s3.objects[self.key] = Body.read()
+        return {'ETag': md5(self.s3.objects[self.key]).hexdigest()}
+
+
+class StubS3():
+    def __init__(self):
+        self.objects = {}
+
+    def Object(self, bucket, key): # pylint: disable=invalid-name
+        return StubS3Object(self, bucket, key)
+
+
+class StubKMS():
+    def encrypt(self, KeyId, Plaintext):
+        return {'CiphertextBlob': md5(str(Plaintext).encode()).digest()}
+
+    def decrypt(self, CiphertextBlob):
+        return {'Plaintext': base64.b64encode(CiphertextBlob)}
+
+
+class StubComprehend():
+    '''errors maps a text to the ErrorCodes its next batch calls fail with'''
+    def __init__(self, errors=None):
+        self.batches = []
+        self.errors = {text: list(codes) for text, codes in (errors or {}).items()}
+
+    def detect_sentiment(self, Text, LanguageCode):
+        sentiment = SENTIMENTS[int(md5(Text.encode()).hexdigest(), 16) % len(SENTIMENTS)]
+        scores = {x.capitalize(): 0.0 for x in SENTIMENTS}
+        scores[sentiment.capitalize()] = 1.0
+        return {'Sentiment': sentiment, 'SentimentScore': scores}
+
+    def batch_detect_sentiment(self, TextList, LanguageCode):
+        assert len(TextList) <= 25
+        self.batches.append(list(TextList))
+        results, errors = [], []
+        for index, text in enumerate(TextList):
+            if self.errors.get(text):
+                errors.append({'Index': index, 'ErrorCode': self.errors[text].pop(0)})
+            else:
+                results.append(dict(self.detect_sentiment(text, LanguageCode), Index=index))
+        return {'ResultList': results, 'ErrorList': errors}
+
+
+@contextmanager
+def stub_aws(table=None, scorer=None, tables=None):
+    '''
+    Points qualtrics at in memory AWS stand-ins, yields the table.
+    tables maps other DynamoDB table names, like the producer table, to stubs.
+    Sentiment is scored by scorer, Comprehend on StubComprehend by default.
+    '''
+    table = table or StubTable()
+    clients = {'kms': StubKMS(), 'comprehend': StubComprehend()}
+    resources = {'dynamodb': StubDynamoDB(table, tables), 's3': StubS3()}
+    saved = (qualtrics.TABLE, qualtrics.get_client, qualtrics.get_resource)
+    qualtrics.TABLE = table
+    qualtrics.get_client = lambda service_name, region_name=None: clients[service_name]
+    qualtrics.get_resource = lambda service_name, region_name=None: resources[service_name]
+    saved_scorer = scorers.set_scorer(scorer or scorers.ComprehendScorer(client=clients['comprehend']))
+    try:
+        yield table
+    finally:
+        qualtrics.TABLE, qualtrics.get_client, qualtrics.get_resource = saved
+        scorers.set_scorer(saved_scorer)
@@ -0,0 +1,132 @@
+'''
+Offline ingestion benchmark
+
+Scales the example Qualtrics export to any number of synthetic responses and
+runs ingestion end to end against the local Qualtrics stub and in memory
+AWS stand-ins, so no network or credentials are needed:
+
+    cd app/lambda/functions/surveyjobs
+    python -m tests.bench_ingestion --responses 10000 --responses 100000
+
+Modes:
+    dataframe: df_read_local_csv + pd_table_populate, the whole export in memory
+    chunked: csv_table_populate, as run by sync-db and pipeline
+
+Prints one JSON report per run with throughput, the peak traced memory of
+the whole run and the stage breakdown from the sync profiler, whose
+peak_memory_bytes are each stage's own peak above its start.
+'''
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import csv
+import json
+import logging
+import tempfile
+import time
+import tracemalloc
+from itertools import cycle
+
+import click
+
+import qualtrics
+import scorers
+from profiler import StageProfiler
+from tests.aws_stubs import stub_aws
+from tests.qualtrics_stub import EXAMPLE_CSV, QualtricsStub
+
+AGENCY_ID = 'AID-BENCH-000000'
+SURVEY_ID = 'SV_cGXWxvADgIihxrf'
+
+# Columns the example export leaves empty but make_record relies on
+EXTRA_COLUMNS = ('Date', 'Text')
+
+
+def scaled_export(path, responses, agency_id=AGENCY_ID):
+    '''
+    Writes a copy of the example export with `responses` synthetic rows.
+    Example rows are cycled with unique response ids, the agency partition,
+    a Date and a free text answer so every record path is exercised.
+    '''
+    with open(EXAMPLE_CSV, newline='') as opened_file:
+        rows = list(csv.reader(opened_file))
+    tags, texts, import_ids, body = rows[0], rows[1], rows[2], rows[3:]
+    index = {json.loads(x)['ImportId']: i for i, x in enumerate(import_ids)}
+
+    with open(path, 'w', newline='') as opened_file:
+        writer = csv.writer(opened_file)
+        writer.writerow(tags + list(EXTRA_COLUMNS))
+        writer.writerow(texts + list(EXTRA_COLUMNS))
+        writer.writerow(import_ids + [json.dumps({'ImportId': x}) for x in EXTRA_COLUMNS])
+        for number, row in zip(range(responses), cycle(body)):
+            row = list(row)
+            row[index['_recordId']] = f"R_{number:012d}"
+            row[index['Partition']] = agency_id
+            row[index['PhoneNumber']] = f"555{number:07d}"
+            row[index['Latitude']] = row[index['locationLatitude']]
+            row[index['Longitude']] = row[index['locationLongitude']]
+            free_text = (row[index['QID7_TEXT']] or 'Thanks').replace('/', ' ')
+            writer.writerow(row + [row[index['recordedDate']], f"{free_text}/QID7/ChoiceTextEntryValue"])
+    return path
+
+
+def run_benchmark(responses, mode='chunked', chunksize=qualtrics.CSV_CHUNKSIZE,
+                  trace_memory=True, temp_location=None, scorer=None):
+    '''
+    Ingests a scaled export once, returns the benchmark report.
+    scorer names a sentiment scorer, Comprehend on the stub by default.
+    '''
+    with tempfile.TemporaryDirectory(dir=temp_location) as temp_dir:
+        csvfile = scaled_export(os.path.join(temp_dir, f"{SURVEY_ID}.csv"), responses)
+        scorer = scorers.make_scorer(scorer) if scorer else None
+        with QualtricsStub() as qualtrics_api, stub_aws(scorer=scorer) as table:
+            profiler = StageProfiler(job={'mode': mode, 'responses': responses},
+                                     trace_memory=trace_memory)
+            start = time.perf_counter()
+            with profiler:
+                if trace_memory:
+                    # the peak since the profiler started tracing covers only the run
+                    tracemalloc.clear_traces()
+                if mode == 'dataframe':
+                    df = qualtrics.df_read_local_csv(csvfile)
+                    qualtrics.pd_table_populate(df, survey_id=SURVEY_ID, agency_id=AGENCY_ID,
+                                                api_url=qualtrics_api.api_url)
+                else:
+                    qualtrics.csv_table_populate(csvfile, survey_id=SURVEY_ID, agency_id=AGENCY_ID,
+                                                 chunksize=chunksize, api_url=qualtrics_api.api_url)
+                peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+            seconds = time.perf_counter() - start
+
+    report = profiler.report()
+    stages = report['stages']
+    records = stages.get('record_build', {}).get('records', 0)
+    return dict(report,
+                seconds=round(seconds, 3),
+                records=records,
+                items_stored=len(table.items),
+                responses_per_second=round(responses / seconds, 1),
+                records_per_second=round(records / seconds, 1),
+                peak_memory_bytes=peak_memory)
+
+
+@click.command()
+@click.option('--responses', multiple=True, type=int, default=[10000],
+              help='synthetic responses to ingest, repeat for several runs')
+@click.option('--mode', type=click.Choice(['chunked', 'dataframe', 'both']), default='both')
+@click.option('--chunksize', default=qualtrics.CSV_CHUNKSIZE)
+@click.option('--trace-memory/--no-trace-memory', default=True)
+@click.option('--scorer', type=click.Choice(['local']), default=None,
+              help='sentiment scorer, Comprehend on the stub by default')
+@click.option('--log-level', default='WARNING', help='qualtrics logs every record at DEBUG')
+def main(responses, mode, chunksize, trace_memory, scorer, log_level):
+    '''Benchmark survey ingestion offline'''
+    logging.getLogger().setLevel(log_level)
+    modes = ['chunked', 'dataframe'] if mode == 'both' else [mode]
+    for count in responses:
+        for run_mode in modes:
+            report = run_benchmark(count, mode=run_mode, chunksize=chunksize,
+                                   trace_memory=trace_memory, scorer=scorer)
+            click.echo(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main() # pylint: disable=no-value-for-parameter
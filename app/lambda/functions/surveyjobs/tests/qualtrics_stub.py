@@ -0,0 +1,148 @@
+'''
+Local stand-in for the Qualtrics v3 API used in tests
+
+Serves the export-responses flow and the survey endpoint from the example
+files shipped in this directory and the surveyjobs function.
+'''
+import io
+import json
+import re
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+
+BASEPATH = path.dirname(__file__)
+EXAMPLE_CSV = path.abspath(path.join(BASEPATH, '..', 'SV_cGXWxvADgIihxrf-Example Qualtrics Output.csv'))
+SURVEY_RESPONSE = path.abspath(path.join(BASEPATH, 'surveys_endpoint_response.json'))
+
+EXPORT_START = re.compile(r'^/API/v3/surveys/(?P<survey>[^/]+)/export-responses/$')
+EXPORT_PROGRESS = re.compile(r'^/API/v3/surveys/(?P<survey>[^/]+)/export-responses/(?P<progress>ES_[^/]+)$')
+EXPORT_FILE = re.compile(r'^/API/v3/surveys/(?P<survey>[^/]+)/export-responses/(?P<file>[^/]+)/file$')
+SURVEY = re.compile(r'^/API/v3/surveys/(?P<survey>[^/]+)$')
+
+
+def zipped_csv(csv_bytes, name='export.csv'):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zp:
+        zp.writestr(name, csv_bytes)
+    return buffer.getvalue()
+
+
+class QualtricsStub():
+    '''
+    Threaded http server mimicking the Qualtrics API
+
+    polls_until_complete: number of progress checks answered 'inProgress'
+    failed_surveys: survey ids whose export reports 'failed'
+    csv_bytes: contents of every exported file, defaults to the example export
+    throttled_requests: number of first requests answered 429 with Retry-After
+    failed_requests: number of requests after those answered 502
+    '''
+    def __init__(self, polls_until_complete=2, failed_surveys=(), csv_bytes=None,
+                 throttled_requests=0, failed_requests=0):
+        self.polls_until_complete = polls_until_complete
+        self.throttled_requests = throttled_requests
+        self.failed_requests = failed_requests
+        self.failed_surveys = set(failed_surveys)
+        if csv_bytes is None:
+            with open(EXAMPLE_CSV, 'rb') as opened_file:
+                csv_bytes = opened_file.read()
+        self.csv_bytes = csv_bytes
+        with open(SURVEY_RESPONSE, 'r') as opened_file:
+            self.survey_response = json.load(opened_file)
+        self.requests = []
+        self.polls = {}
+        self.export_payloads = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def api_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/API/v3/"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _record(self, method, request_path):
+        '''Records the request, returns the error status to answer it with, if any'''
+        with self._lock:
+            self.requests.append((method, request_path))
+            if len(self.requests) <= self.throttled_requests:
+                return 429
+            if len(self.requests) <= self.throttled_requests + self.failed_requests:
+                return 502
+            return None
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args): # pylint: disable=arguments-differ
+                pass
+
+            def _send(self, status, body, content_type='application/json', headers=None):
+                if isinstance(body, dict):
+                    body = json.dumps(body).encode()
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _error(self, status):
+                if status == 429:
+                    return self._send(429, {'meta': {'httpStatus': '429 - Too Many Requests'}},
+                                      headers={'Retry-After': '0'})
+                return self._send(status, {'meta': {'httpStatus': f"{status} - Bad Gateway"}})
+
+            def do_POST(self): # pylint: disable=invalid-name
+                length = int(self.headers.get('Content-Length', 0))
+                payload = self.rfile.read(length)
+                error = stub._record('POST', self.path)
+                if error:
+                    return self._error(error)
+                match = EXPORT_START.match(self.path)
+                if not match:
+                    return self._send(404, {'meta': {'httpStatus': '404 - Not Found'}})
+                survey_id = match.group('survey')
+                with stub._lock:
+                    stub.export_payloads[survey_id] = json.loads(payload or b'{}')
+                return self._send(200, {'result': {'progressId': f"ES_{survey_id}"}})
+
+            def do_GET(self): # pylint: disable=invalid-name
+                error = stub._record('GET', self.path)
+                if error:
+                    return self._error(error)
+                match = EXPORT_PROGRESS.match(self.path)
+                if match:
+                    survey_id = match.group('survey')
+                    with stub._lock:
+                        stub.polls[survey_id] = stub.polls.get(survey_id, 0) + 1
+                        polls = stub.polls[survey_id]
+                    if survey_id in stub.failed_surveys:
+                        result = {'percentComplete': 0.0, 'status': 'failed'}
+                    elif polls > stub.polls_until_complete:
+                        result = {'percentComplete': 100.0, 'status': 'complete',
+                                  'fileId': f"FILE_{survey_id}"}
+                    else:
+                        result = {'percentComplete': 50.0, 'status': 'inProgress'}
+                    return self._send(200, {'result': result})
+                match = EXPORT_FILE.match(self.path)
+                if match:
+                    return self._send(200, zipped_csv(stub.csv_bytes), 'application/zip')
+                match = SURVEY.match(self.path)
+                if match:
+                    return self._send(200, stub.survey_response)
+                return self._send(404, {'meta': {'httpStatus': '404 - Not Found'}})
+
+        return Handler
@@ -0,0 +1,25 @@
+import sys;sys.path.append("..")
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from tests.bench_ingestion import run_benchmark
+
+def test_bench_ingestion_modes_agree():
+    chunked = run_benchmark(150, mode="chunked", chunksize=40, trace_memory=False)
+    dataframe = run_benchmark(150, mode="dataframe", trace_memory=False)
+
+    assert chunked["stages"]["parse"]["records"] == 150
+    # one scorer call per chunk of 40 rows, one for the whole DataFrame
+    assert chunked["stages"]["sentiment"]["calls"] == 4
+    assert dataframe["stages"]["sentiment"]["calls"] == 1
+    # texts are deduplicated per call, so chunks score some texts more than once
+    assert chunked["stages"]["sentiment"]["records"] >= dataframe["stages"]["sentiment"]["records"] > 0
+    assert chunked["records"] == dataframe["records"] > 150
+    assert chunked["items_stored"] == dataframe["items_stored"]
+    assert chunked["records_per_second"] > 0
+
+def test_bench_ingestion_reports_run_peak_memory():
+    report = run_benchmark(60, mode="chunked", chunksize=20)
+    stage_peaks = [x["peak_memory_bytes"] for x in report["stages"].values()]
+
+    assert report["peak_memory_bytes"] >= max(stage_peaks)
+    assert run_benchmark(20, trace_memory=False)["peak_memory_bytes"] is None
@@ -0,0 +1,15 @@
+import sys;sys.path.append("..")
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import pandas as pd
+from qualtrics import df_read_csv_chunks, df_read_local_csv, rename_df_colnames_cleanup
+from tests.qualtrics_stub import EXAMPLE_CSV
+
+def test_df_read_csv_chunks_matches_full_read():
+    expected = rename_df_colnames_cleanup(df_read_local_csv(EXAMPLE_CSV), extra=None).iloc[1:]
+    chunks = list(df_read_csv_chunks(EXAMPLE_CSV, chunksize=30))
+
+    assert [len(x) for x in chunks] == [30, 30, 30, 10]
+    combined = pd.concat(chunks)
+    assert list(combined.columns) == list(expected.columns)
+    assert combined.reset_index(drop=True).equals(expected.reset_index(drop=True))
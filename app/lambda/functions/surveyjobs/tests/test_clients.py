@@ -0,0 +1,33 @@
+import sys;sys.path.append("..")
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import clients
+
+# Config options of botocore 1.23, the python3.6 Lambda runtime's
+RUNTIME_CONFIG_OPTIONS = ('region_name', 'signature_version', 'user_agent', 'user_agent_extra',
+                          'connect_timeout', 'read_timeout', 'parameter_validation',
+                          'max_pool_connections', 'proxies', 'proxies_config', 's3', 'retries',
+                          'client_cert', 'inject_host_prefix', 'endpoint_discovery_enabled',
+                          'use_dualstack_endpoint', 'use_fips_endpoint')
+
+def test_client_config_builds_clients():
+    config = clients.client_config()
+    client = clients.get_client('sqs', region_name='us-east-1')
+
+    assert set(config._user_provided_options) <= set(RUNTIME_CONFIG_OPTIONS)
+    assert client.meta.config.max_pool_connections == clients.MAX_POOL_CONNECTIONS
+    assert client.meta.config.retries['mode'] == 'adaptive'
+    assert clients.get_client('sqs', region_name='us-east-1') is client
+    assert clients.get_resource('dynamodb', region_name='us-east-1').meta.client.meta.config.retries == \
+        client.meta.config.retries
+
+def test_clients_copies_are_identical():
+    functions = os.path.dirname(os.path.dirname(os.path.abspath(clients.__file__)))
+    copies = [os.path.join(functions, x, 'clients.py') for x in os.listdir(functions)
+              if os.path.exists(os.path.join(functions, x, 'clients.py'))]
+    sources = set()
+    for path in copies:
+        with open(path) as copy:
+            sources.add(copy.read())
+
+    assert len(copies) == 3 and len(sources) == 1
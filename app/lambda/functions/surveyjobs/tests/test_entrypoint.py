@@ -0,0 +1,59 @@
+import sys;sys.path.append("..")
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import json
+import threading
+import qualtrics
+
+def _record(message_id, survey_id):
+    return {'messageId': message_id,
+            'receiptHandle': f"handle-{message_id}",
+            'eventSourceARN': 'arn:aws:sqs:us-east-1:698112575222:etl-queue-etl-resources',
+            'body': json.dumps({'AgencyId': 'AID-BOS-dd3244', 'SurveyId': survey_id})}
+
+def test_entrypoint_reports_failed_records(monkeypatch):
+    processed = []
+    def fake_process(record, table, extra=None):
+        processed.append(record['messageId'])
+        if json.loads(record['body'])['SurveyId'] == 'SV_BAD':
+            raise Exception("export failed")
+    monkeypatch.setenv('AGENCIES_TABLE_ID', 'agencies-test')
+    monkeypatch.setattr(qualtrics, 'process_sqs_record', fake_process)
+    event = {'Records': [_record('1', 'SV_1'), _record('2', 'SV_BAD'), _record('3', 'SV_3')]}
+
+    response = qualtrics.entrypoint(event, None)
+
+    assert sorted(processed) == ['1', '2', '3']
+    assert response == {'batchItemFailures': [{'itemIdentifier': '2'}]}
+
+def test_process_sqs_record_passes_producer_state(monkeypatch):
+    calls = []
+    monkeypatch.setattr(qualtrics.cli, 'main',
+        lambda args, standalone_mode: calls.append(args) or ('bucket', 'file.csv'))
+    record = _record('1', 'SV_1')
+    record['body'] = json.dumps({'AgencyId': 'AID-BOS-dd3244', 'SurveyId': 'SV_1',
+                                 'LastRecordedDate': '2018-11-15T21:39:58Z', 'ResponseCount': 12})
+
+    qualtrics.process_sqs_record(record, table=None)
+
+    args = calls[0]
+    assert args[args.index('--since') + 1] == '2018-11-15T21:39:58Z'
+    assert args[args.index('--responsecount') + 1] == '12'
+
+def test_entrypoint_builds_a_table_per_worker(monkeypatch):
+    class Resource():
+        def Table(self, name): # pylint: disable=invalid-name
+            return (name, threading.get_ident())
+    seen = []
+    def fake_process(record, table, extra=None):
+        with qualtrics.use_table(table):
+            seen.append((table, qualtrics.get_table()))
+    monkeypatch.setenv('AGENCIES_TABLE_ID', 'agencies-test')
+    monkeypatch.setattr(qualtrics, 'get_resource', lambda service_name, region_name=None: Resource())
+    monkeypatch.setattr(qualtrics, 'process_sqs_record', fake_process)
+
+    qualtrics.entrypoint({'Records': [_record('1', 'SV_1'), _record('2', 'SV_2')]}, None)
+
+    assert all(table == used and table[0] == 'agencies-test' for table, used in seen)
+    assert all(table[1] != threading.get_ident() for table, _ in seen)
+    assert qualtrics.get_table() is qualtrics.TABLE
@@ -0,0 +1,89 @@
+import sys;sys.path.append("..")
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import pytest
+import requests
+from qualtrics import download_csv_survey, download_csv_surveys, wait_for_export, start_export
+from tests.qualtrics_stub import QualtricsStub, EXAMPLE_CSV
+
+FAST_POLL = {'initial_delay': 0.01, 'max_delay': 0.02}
+
+def _read(file_name):
+    with open(file_name, 'rb') as opened_file:
+        return opened_file.read()
+
+def test_download_csv_survey(tmp_path):
+    with QualtricsStub(polls_until_complete=0) as stub:
+        output_filename = download_csv_survey(survey_id='SV_cGXWxvADgIihxrf',
+                                              api_token='token',
+                                              temp_location=str(tmp_path),
+                                              api_url=stub.api_url)
+    assert output_filename == f"{tmp_path}/SV_cGXWxvADgIihxrf.csv"
+    assert _read(output_filename) == _read(EXAMPLE_CSV)
+    assert stub.export_payloads['SV_cGXWxvADgIihxrf'] == {'format': 'csv'}
+
+def test_wait_for_export_backs_off():
+    with QualtricsStub(polls_until_complete=3) as stub:
+        progress_id = start_export('SV_1', api_token='token', api_url=stub.api_url)
+        file_id = wait_for_export('SV_1', progress_id, api_token='token',
+                                  api_url=stub.api_url, **FAST_POLL)
+    assert file_id == 'FILE_SV_1'
+    assert stub.polls['SV_1'] == 4
+
+def test_wait_for_export_timeout():
+    with QualtricsStub(polls_until_complete=1000) as stub:
+        progress_id = start_export('SV_1', api_token='token', api_url=stub.api_url)
+        with pytest.raises(TimeoutError):
+            wait_for_export('SV_1', progress_id, api_token='token',
+                            api_url=stub.api_url, timeout=0.05, **FAST_POLL)
+
+def test_wait_for_export_failed():
+    with QualtricsStub(failed_surveys=['SV_1']) as stub:
+        progress_id = start_export('SV_1', api_token='token', api_url=stub.api_url)
+        with pytest.raises(Exception, match='export failed'):
+            wait_for_export('SV_1', progress_id, api_token='token',
+                            api_url=stub.api_url, **FAST_POLL)
+
+def test_download_csv_surveys(tmp_path):
+    survey_ids = ['SV_1', 'SV_2', 'SV_3', 'SV_BAD']
+    with QualtricsStub(polls_until_complete=2, failed_surveys=['SV_BAD']) as stub:
+        results = download_csv_surveys(survey_ids, api_token='token',
+                                       temp_location=str(tmp_path),
+                                       api_url=stub.api_url, **FAST_POLL)
+    assert set(results) == set(survey_ids)
+    for survey_id in ['SV_1', 'SV_2', 'SV_3']:
+        assert _read(results[survey_id]) == _read(EXAMPLE_CSV)
+    assert isinstance(results['SV_BAD'], Exception)
+
+def test_download_csv_survey_since(tmp_path):
+    with QualtricsStub(polls_until_complete=0) as stub:
+        download_csv_survey(survey_id='SV_1', api_token='token',
+                            temp_location=str(tmp_path), api_url=stub.api_url,
+                            start_date='2018-11-15T21:39:46Z')
+    assert stub.export_payloads['SV_1'] == {'format': 'csv',
+                                            'startDate': '2018-11-15T21:39:46Z'}
+
+def test_qualtrics_client_retries_throttled_requests(tmp_path):
+    from qualtrics_client import QualtricsClient
+    client = QualtricsClient(backoff_factor=0)
+    with QualtricsStub(throttled_requests=2) as stub:
+        response = client.get(f"{stub.api_url}surveys/SV_1", api_token='token', name='survey')
+    assert response.json()['result']['id'] == 'SV_4JFLLqWZwHJGi3z'
+    assert len(stub.requests) == 3
+    assert client.metrics_report()['survey']['calls'] == 1
+    assert client.metrics_report()['survey']['errors'] == 0
+
+def test_qualtrics_client_retries_posts_only_when_throttled():
+    from qualtrics_client import QualtricsClient
+    client = QualtricsClient(backoff_factor=0)
+    with QualtricsStub(throttled_requests=2) as stub:
+        assert start_export('SV_1', api_token='token', api_url=stub.api_url) == 'ES_SV_1'
+        assert len(stub.requests) == 3
+    with QualtricsStub(failed_requests=2) as stub:
+        with pytest.raises(requests.HTTPError):
+            client.post(f"{stub.api_url}surveys/SV_1/export-responses/", api_token='token',
+                        name='start_export', data='{}')
+        assert stub.requests == [('POST', '/API/v3/surveys/SV_1/export-responses/')]
+        # GETs are idempotent and retried on server errors
+        assert client.get(f"{stub.api_url}surveys/SV_1", api_token='token').status_code == 200
+        assert len(stub.requests) == 3
@@ -0,0 +1,47 @@
+import sys;sys.path.append("..")
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import qualtrics
+from qualtrics import record_fingerprint, write_changed_records
+
+REC = {'Partition': 'AID-BOS-dd3244', 'Sort': 'RID-QID3-R_1', 'LSI': 'QID3', 'Choice': '2'}
+
+class StubBatch():
+    def __init__(self):
+        self.items = []
+    def put_item(self, Item):
+        self.items.append(Item)
+
+def test_record_fingerprint_ignores_ciphertext_and_sentiment():
+    first = dict(REC, PhoneNumber=b'cipher-1', Sentiment='3')
+    second = dict(REC, PhoneNumber=b'cipher-2')
+    assert record_fingerprint(first, '5551234') == record_fingerprint(second, '5551234')
+    assert record_fingerprint(first, '5551234') != record_fingerprint(first, '5559999')
+    assert record_fingerprint(first, '5551234') != record_fingerprint(dict(first, Choice='3'), '5551234')
+
+def test_write_changed_records(monkeypatch):
+    unchanged = dict(REC, Fingerprint=record_fingerprint(REC, ''))
+    changed = dict(REC, Sort='RID-QID3-R_2', Choice='1')
+    changed['Fingerprint'] = record_fingerprint(changed, '')
+    new = dict(REC, Sort='RID-QID3-R_3')
+    new['Fingerprint'] = record_fingerprint(new, '')
+    stored = {(REC['Partition'], 'RID-QID3-R_1'): unchanged['Fingerprint'],
+              (REC['Partition'], 'RID-QID3-R_2'): 'stale'}
+    monkeypatch.setattr(qualtrics, 'fetch_fingerprints', lambda recs, extra=None: stored)
+
+    batch = StubBatch()
+    report = write_changed_records(batch, [unchanged, changed, new], {'written': 0, 'skipped': 0})
+    assert report == {'written': 2, 'skipped': 1}
+    assert batch.items == [changed, new]
+
+def test_written_records_carry_the_sync_version(monkeypatch):
+    unchanged = dict(REC, Fingerprint=record_fingerprint(REC, ''))
+    new = dict(REC, Sort='RID-QID3-R_3')
+    new['Fingerprint'] = record_fingerprint(new, '')
+    stored = {(REC['Partition'], REC['Sort']): unchanged['Fingerprint']}
+    monkeypatch.setattr(qualtrics, 'fetch_fingerprints', lambda recs, extra=None: stored)
+
+    batch = StubBatch()
+    write_changed_records(batch, [unchanged, new], {'written': 0, 'skipped': 0}, version=1234)
+    assert [x.get('Version') for x in batch.items] == [1234]
+    assert 'Version' not in unchanged
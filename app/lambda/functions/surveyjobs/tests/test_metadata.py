@@ -0,0 +1,35 @@
+import sys;sys.path.append("..")
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import json
+import qualtrics
+from tests.aws_stubs import StubTable
+from tests.qualtrics_stub import SURVEY_RESPONSE
+
+AID = 'AID-BOS-dd3244'
+
+def _survey():
+    with open(SURVEY_RESPONSE, 'r') as opened_file:
+        return json.load(opened_file)
+
+def test_populate_metadata_writes_once(monkeypatch):
+    table = StubTable()
+    survey = _survey()
+    monkeypatch.setattr(qualtrics, 'TABLE', table)
+    monkeypatch.setattr(qualtrics, 'collect_survey_endpoint', lambda **kwargs: survey)
+
+    first = qualtrics.populate_metadata(survey_id='SV_4JFLLqWZwHJGi3z', agency_id=AID)
+    choice_puts = [x for x in table.puts if x[1].startswith('QCID-')]
+    assert len(choice_puts) == len(set(choice_puts)) == 3
+    assert (AID, 'SURVEYDEF-SV_4JFLLqWZwHJGi3z') in table.items
+    writes = len(table.puts)
+
+    second = qualtrics.populate_metadata(survey_id='SV_4JFLLqWZwHJGi3z', agency_id=AID)
+    assert second == first
+    assert len(table.puts) == writes
+
+    survey['result']['questions']['QID26']['questionText'] = 'Can you please explain?'
+    qualtrics.populate_metadata(survey_id='SV_4JFLLqWZwHJGi3z', agency_id=AID)
+    new_puts = table.puts[writes:]
+    assert (AID, 'QID26') in new_puts
+    assert not [x for x in new_puts if x[1].startswith('QCID-')]
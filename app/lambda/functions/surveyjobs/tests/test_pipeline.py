@@ -0,0 +1,33 @@
+import sys;sys.path.append("..")
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import qualtrics
+from tests.aws_stubs import StubTable, stub_aws
+from tests.bench_ingestion import AGENCY_ID, SURVEY_ID, scaled_export
+from tests.qualtrics_stub import QualtricsStub
+
+def test_pipeline_syncs_archives_and_records_the_sync(tmp_path, monkeypatch):
+    with open(scaled_export(str(tmp_path / 'export.csv'), 40), 'rb') as opened_file:
+        csv_bytes = opened_file.read()
+    producer = StubTable('producer')
+    args = ['pipeline', '--surveyid', SURVEY_ID, '--apitoken', 'token', '--bucket', 'archive',
+            '--agencyid', AGENCY_ID, '--since', '2018-11-01T00:00:00Z', '--producertable', 'producer',
+            '--responsecount', '40', '--chunksize', '15']
+
+    with QualtricsStub(polls_until_complete=0, csv_bytes=csv_bytes) as api, \
+            stub_aws(tables={'producer': producer}) as table:
+        monkeypatch.setattr(qualtrics, 'qualtrics_api_url', lambda data_center='co1': api.api_url)
+        archived = qualtrics.cli.main(args=args, standalone_mode=False)
+        s3 = qualtrics.get_resource('s3')
+
+    assert archived == ('archive', f"{SURVEY_ID}-{SURVEY_ID}.csv")
+    assert s3.objects[archived] == csv_bytes
+    assert api.export_payloads[SURVEY_ID] == {'format': 'csv', 'startDate': '2018-11-01T00:00:00Z'}
+    responses = [x for x in table.items.values() if x['Sort'].startswith('RID')]
+    assert len({x['Sort'].split('-')[-1] for x in responses}) == 40
+    assert (AGENCY_ID, 'DataVersion') in table.items
+    watermark, sync = producer.updates
+    assert watermark['Key'] == sync['Key'] == {'AgencyId': AGENCY_ID, 'SurveyId': SURVEY_ID}
+    assert watermark['ExpressionAttributeValues'][':d'] == qualtrics.latest_recorded_date(
+        qualtrics.rename_df_colnames_cleanup(qualtrics.df_read_local_csv(str(tmp_path / 'export.csv')), extra=None))
+    assert sync['ExpressionAttributeValues'][':c'] == 40
@@ -0,0 +1,47 @@
+import sys;sys.path.append("..")
+import os
+import tracemalloc
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from profiler import StageProfiler, stage, current_profiler
+from qualtrics import df_read_csv_chunks
+from tests.qualtrics_stub import EXAMPLE_CSV
+
+def test_stage_without_profiler_is_noop():
+    assert current_profiler() is None
+    with stage("parse") as parse:
+        parse.add_records(10)
+
+def test_stage_profiler_report(tmp_path):
+    with StageProfiler(job={"survey_id": "SV_1"}, trace_memory=True, profile=True) as profiler:
+        chunks = list(df_read_csv_chunks(EXAMPLE_CSV, chunksize=40))
+        with stage("record_build") as record_build:
+            with stage("sentiment", records=1):
+                payload = [str(x) * 100 for x in range(1000)]
+            record_build.add_records(len(payload))
+    report = profiler.report()
+    profiler.dump_stats(str(tmp_path / "sync.prof"))
+
+    assert current_profiler() is None
+    assert report["survey_id"] == "SV_1"
+    assert report["stages"]["header_rename"]["calls"] == 1
+    assert report["stages"]["parse"]["records"] == sum(len(x) for x in chunks) == 100
+    assert report["stages"]["parse"]["records_per_second"] > 0
+    sentiment = report["stages"]["sentiment"]
+    record_build = report["stages"]["record_build"]
+    assert sentiment["calls"] == 1 and sentiment["records"] == 1
+    assert record_build["records"] == 1000
+    assert record_build["peak_memory_bytes"] >= sentiment["peak_memory_bytes"] > 0
+    assert (tmp_path / "sync.prof").exists()
+
+def test_tracing_lasts_until_the_last_profiler_exits():
+    first = StageProfiler(trace_memory=True)
+    second = StageProfiler(trace_memory=True)
+    with first:
+        second.__enter__()
+    assert tracemalloc.is_tracing()
+    second.__exit__(None, None, None)
+    assert not tracemalloc.is_tracing()
+    with StageProfiler() as untraced:
+        with stage("parse"):
+            assert not tracemalloc.is_tracing()
+    assert untraced.report()["stages"]["parse"]["peak_memory_bytes"] is None
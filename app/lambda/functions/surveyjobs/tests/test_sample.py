@@ -0,0 +1,14 @@
+import sys;sys.path.append("..")
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from qualtrics import make_sample_sort, SAMPLED_BUCKETS
+
+def test_sample_sort_is_deterministic_and_sparse():
+    sorts = [make_sample_sort(f"RID-QID1-R_{x}", f"R_{x}") for x in range(5000)]
+    sampled = [x for x in sorts if x]
+
+    assert 350 < len(sampled) < 650
+    assert all(x[1:3].isdigit() and int(x[1:3]) < SAMPLED_BUCKETS for x in sampled)
+    assert sorts == [make_sample_sort(f"RID-QID1-R_{x}", f"R_{x}") for x in range(5000)]
+    # every answer of a respondent lands in the same bucket
+    assert make_sample_sort("RID-QID2-R_7", "R_7") == (sorts[7] and sorts[7].replace("QID1", "QID2"))
@@ -0,0 +1,67 @@
+import sys;sys.path.append("..")
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import pandas as pd
+import pytest
+import sentiment
+import scorers
+from tests.aws_stubs import StubComprehend
+
+def test_score_file_batches_distinct_texts(tmp_path, monkeypatch):
+    comprehend = StubComprehend()
+    monkeypatch.setattr(scorers, 'get_client', lambda service_name: comprehend)
+    monkeypatch.setattr(scorers, 'SCORER', scorers.ComprehendScorer())
+    texts = [f"reply {x % 60}" for x in range(200)] + [None]
+    pd.DataFrame({"Text": texts}).to_csv(tmp_path / "in.csv", index=False)
+
+    report = sentiment.score_file(str(tmp_path / "in.csv"), str(tmp_path / "out.csv"),
+                                  column="Text", chunksize=50)
+
+    scored = pd.read_csv(tmp_path / "out.csv")
+    assert report == {"chunks": 5, "rows": 201, "texts_scored": 60}
+    assert sum(len(x) for x in comprehend.batches) == 60
+    assert list(scored["Text"][:200]) == texts[:200]
+    assert scored["Sentiment"][0] == comprehend.detect_sentiment("reply 0", "en")["Sentiment"]
+    assert pd.isna(scored["Sentiment"][200])
+
+def test_cascade_scores_confident_texts_locally():
+    comprehend = StubComprehend()
+    cascade = scorers.CascadeScorer(remote=scorers.ComprehendScorer(client=comprehend), audit_rate=0)
+    texts = ["thanks", "No", "The officer was rude", "Friendly and professional", "It was raining"]
+
+    results = cascade.score(texts)
+
+    assert [x for x, _ in results[:4]] == ["POSITIVE", "NEUTRAL", "NEGATIVE", "POSITIVE"]
+    assert comprehend.batches == [] and results[4][0] == comprehend.detect_sentiment(texts[4], "en")["Sentiment"]
+    stats = cascade.stats()
+    assert (stats["local"], stats["remote"], stats["audited"]) == (4, 1, 0)
+    assert stats["agreement"] in (0.0, 1.0)
+
+def test_lexicon_negates_words_a_few_tokens_after_a_negator():
+    scorer = scorers.LexiconScorer()
+    [(sentiment, _), (negated, _), (far, _)] = scorer.score(
+        ["I felt safe", "I did not feel safe", "not rude at all, the officer was very helpful"])
+    assert sentiment == "POSITIVE"
+    assert negated == "NEGATIVE"
+    assert far == "POSITIVE"
+
+def test_comprehend_retries_throttled_texts(monkeypatch):
+    monkeypatch.setattr(scorers.time, 'sleep', lambda seconds: None)
+    texts = [f"reply {x}" for x in range(30)]
+    comprehend = StubComprehend(errors={"reply 3": ["ThrottlingException"] * 2})
+
+    results = scorers.ComprehendScorer(client=comprehend).score(texts)
+
+    assert [len(x) for x in comprehend.batches] == [25, 1, 1, 5]
+    assert results == [(comprehend.detect_sentiment(x, "en")["Sentiment"], 1.0) for x in texts]
+
+@pytest.mark.parametrize("codes", [["ThrottlingException"] * 4, ["TextSizeLimitExceededException"]])
+def test_comprehend_raises_for_texts_never_scored(monkeypatch, codes):
+    monkeypatch.setattr(scorers.time, 'sleep', lambda seconds: None)
+    comprehend = StubComprehend(errors={"reply 3": codes})
+
+    with pytest.raises(scorers.SentimentError) as error:
+        scorers.ComprehendScorer(client=comprehend, retries=3).score([f"reply {x}" for x in range(5)])
+
+    assert error.value.errors == [{'Index': 0 if len(codes) > 1 else 3, 'ErrorCode': codes[-1]}]
+    assert len(comprehend.batches) == len(codes)
@@ -0,0 +1,13 @@
+import sys;sys.path.append("..")
+import os
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from qualtrics import df_read_local_csv, rename_df_colnames_cleanup, latest_recorded_date
+from tests.qualtrics_stub import EXAMPLE_CSV
+
+def test_latest_recorded_date():
+    df = rename_df_colnames_cleanup(df_read_local_csv(EXAMPLE_CSV), extra=None)
+    assert latest_recorded_date(df) == '2018-11-15T21:39:58Z'
+
+def test_latest_recorded_date_no_responses():
+    df = rename_df_colnames_cleanup(df_read_local_csv(EXAMPLE_CSV).iloc[:2], extra=None)
+    assert latest_recorded_date(df) is None
@@ -8,8 +8,10 @@ terraform {
   }
 }
 
+# 3.x for function_response_types on the SQS event source mapping, the
+# other stacks stay on 2.x.  See README.md before applying.
 provider "aws" {
-  version = "~> 2.7"
+  version = "~> 3.51"
   region  = "us-east-1"
 }
 
@@ -126,9 +128,14 @@ resource "aws_lambda_function" "crud_handler" {
   source_code_hash  = "${module.crud_handler_archive.source_code_hash}"
   runtime           = "python3.6"
   publish           = true
+  memory_size       = var.crud_memory_size
+  timeout           = var.crud_timeout
   environment {
     variables = {
-      AGENCY_TABLE_ID = data.terraform_remote_state.dynamodb.outputs.agencies_table_id
+      AGENCY_TABLE_ID       = data.terraform_remote_state.dynamodb.outputs.agencies_table_id
+      SNAPSHOT_MEMORY_MB    = var.crud_snapshot_memory_mb
+      SNAPSHOT_LOAD_SECONDS = var.crud_snapshot_load_seconds
+      CACHE_CONTROL         = var.crud_cache_control
     }
   }
 }
@@ -172,10 +179,12 @@ resource "aws_lambda_function" "surveyjobs_handler" {
   timeout           = 300
   environment {
     variables = {
-      S3_BUCKET         = "${aws_s3_bucket.rojopolis_survey_bucket.id}"
-      X_API_TOKEN       = "${var.qualtrics_api_key}"
-      AGENCIES_TABLE_ID = "${data.terraform_remote_state.dynamodb.outputs.agencies_table_id}"
-      KMS_KEY           = "${data.terraform_remote_state.kms.outputs.kms_key}"
+      S3_BUCKET          = "${aws_s3_bucket.rojopolis_survey_bucket.id}"
+      X_API_TOKEN        = "${var.qualtrics_api_key}"
+      AGENCIES_TABLE_ID  = "${data.terraform_remote_state.dynamodb.outputs.agencies_table_id}"
+      KMS_KEY            = "${data.terraform_remote_state.kms.outputs.kms_key}"
+      PRODUCER_JOB_TABLE = "${data.terraform_remote_state.dynamodb.outputs.producer_table_id}"
+      SURVEY_CONCURRENCY = "${var.survey_concurrency}"
     }
   }
 }
@@ -207,8 +216,10 @@ EOF
 }
 
 resource "aws_lambda_event_source_mapping" "etl_event_source_mapping" {
-  event_source_arn = "${data.terraform_remote_state.sqs.outputs.etl_queue_arn}"
-  function_name    = "${aws_lambda_function.surveyjobs_handler.qualified_arn}"
+  event_source_arn        = "${data.terraform_remote_state.sqs.outputs.etl_queue_arn}"
+  function_name           = "${aws_lambda_function.surveyjobs_handler.qualified_arn}"
+  batch_size              = var.survey_batch_size
+  function_response_types = ["ReportBatchItemFailures"]
 }
 
 #-------------------------------------------------------------------------------
@@ -240,8 +251,13 @@ resource "aws_lambda_function" "producerjobs_handler" {
   publish           = true
   environment {
     variables = {
-      PRODUCER_JOB_QUEUE = "${data.terraform_remote_state.sqs.outputs.etl_queue_name}"
-      PRODUCER_JOB_TABLE = "${data.terraform_remote_state.dynamodb.outputs.producer_table_id}"
+      PRODUCER_JOB_QUEUE          = "${data.terraform_remote_state.sqs.outputs.etl_queue_name}"
+      PRODUCER_JOB_TABLE          = "${data.terraform_remote_state.dynamodb.outputs.producer_table_id}"
+      PRODUCER_SCAN_SEGMENTS      = "${var.producer_scan_segments}"
+      PRODUCER_MAX_AGE            = "${var.producer_max_age}"
+      PRODUCER_SPREAD_SECONDS     = "${var.producer_spread_seconds}"
+      PRODUCER_AGENCY_CONCURRENCY = "${var.producer_agency_concurrency}"
+      X_API_TOKEN                 = "${var.qualtrics_api_key}"
     }
   }
 }
@@ -0,0 +1,364 @@
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'functions', 'crud_handler'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AGENCY_TABLE_ID', 'agencies-test')
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+import app
+import clients
+import snapshot
+
+def epoch(*args):
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+def dated(*epochs):
+    return [{'Date': str(x)} for x in epochs]
+
+def test_bin_dates_days_follow_dst():
+    # New York moved from UTC-5 to UTC-4 at 2019-03-10 07:00 UTC
+    data = dated(epoch(2019, 3, 10, 4, 59), epoch(2019, 3, 10, 5, 0),
+                 epoch(2019, 3, 11, 3, 59), epoch(2019, 3, 11, 4, 0))
+
+    bins = app.bin_dates(data, granularity='day', tz='America/New_York')
+
+    assert bins == ['2019-03-09', '2019-03-10', '2019-03-11']
+    assert [x['DateBin'] for x in data] == [0, 1, 1, 2]
+
+def test_bin_dates_weeks_start_on_local_monday():
+    # 2019-03-11 was a Monday, 04:00 UTC is midnight in New York after DST
+    data = dated(epoch(2019, 3, 11, 3, 30), epoch(2019, 3, 11, 4, 30), epoch(2019, 3, 25, 12))
+
+    bins = app.bin_dates(data, granularity='week', tz='America/New_York')
+
+    assert bins == ['2019-03-04', '2019-03-11', '2019-03-18', '2019-03-25']
+    assert [x['DateBin'] for x in data] == [0, 1, 3]
+    assert app.bin_dates(dated(epoch(2019, 3, 11, 3, 30)), granularity='week') == ['2019-03-11']
+
+def test_bin_dates_months_ahead_of_utc():
+    # Sydney is UTC+11 until daylight saving ends on 2019-04-07
+    data = dated(epoch(2019, 2, 28, 12, 30), epoch(2019, 2, 28, 13, 30),
+                 epoch(2019, 4, 30, 13, 30), epoch(2019, 4, 30, 14, 30), None)
+
+    bins = app.bin_dates(data, granularity='month', tz='Australia/Sydney')
+
+    assert bins == ['2019-02-01', '2019-03-01', '2019-04-01', '2019-05-01']
+    assert [x.get('DateBin') for x in data] == [0, 1, 2, 3, None]
+
+@pytest.mark.parametrize('granularity', app.GRANULARITIES)
+@pytest.mark.parametrize('tz', ['UTC', 'America/New_York', 'Australia/Sydney', 'Asia/Kolkata'])
+def test_bin_date_array_matches_bin_dates(granularity, tz):
+    epochs = np.array([epoch(2018, 12, 31, 23) + 5923 * x for x in range(3000)] + [np.nan])
+    data = [{'Date': str(x)} for x in epochs[:-1]] + [{}]
+
+    bins, labels = app.bin_date_array(epochs, granularity=granularity, tz=tz)
+
+    assert labels == app.bin_dates(data, granularity=granularity, tz=tz)
+    assert bins.tolist() == [x.get('DateBin', -1) for x in data]
+
+def test_bin_dates_rejects_unknown_arguments():
+    with pytest.raises(ValueError):
+        app.bin_dates(dated(0), granularity='year')
+    with pytest.raises(ValueError):
+        app.bin_date_array(np.zeros(1), tz='Mars/Olympus_Mons')
+
+class StubTable():
+    '''
+    Agencies table answering queries from items, in pages of page_size.
+    Key and filter conditions are not evaluated, except the VersionIndex
+    reading items stamped after its Version bound.
+    '''
+    def __init__(self, items=(), page_size=100, data_version=None):
+        self.items = {x['Sort']: x for x in items}
+        self.page_size = page_size
+        self.data_version = data_version
+        self.queries = []
+        self.gets = []
+
+    def get_item(self, Key):
+        self.gets.append(Key)
+        if Key['Sort'] == 'DataVersion' and self.data_version is not None:
+            return {'Item': dict(Key, DataVersion=self.data_version)}
+        return {}
+
+    def query(self, **kwargs):
+        self.queries.append(kwargs)
+        items = sorted(self.items.values(), key=lambda x: x['Sort'])
+        if kwargs.get('IndexName') == 'VersionIndex':
+            since = kwargs['KeyConditionExpression'].get_expression()['values'][1].get_expression()['values'][1]
+            items = [x for x in items if 'Version' in x and x['Version'] > since]
+        start = kwargs.get('ExclusiveStartKey', {}).get('index', 0)
+        response = {'Items': [dict(x) for x in items[start:start + self.page_size]]}
+        response['Count'] = response['ScannedCount'] = len(response['Items'])
+        if start + self.page_size < len(items):
+            response['LastEvaluatedKey'] = {'index': start + self.page_size}
+        return response
+
+@pytest.fixture
+def table(monkeypatch):
+    table = StubTable()
+    monkeypatch.setattr(app, 'AGENCY_TABLE', table)
+    return table
+
+def response_item(index, question='QID-1', **fields):
+    item = {'Partition': 'AID-1', 'Sort': f"RID-{question}-R_{index:05d}", 'LSI': question,
+            'Date': str(epoch(2019, 3, 1) + 3600 * (index % 500)), 'Age': str(index % 6),
+            'Gender': str(index % 4), 'Race': str(index % 7), 'Origin': str(index % 2 + 1),
+            'Choice': str(index % 5), 'QuestionChoicesId': 'QCID-1',
+            'LatitudeOffset': f"{30 + index % 20:019.15F}", 'LongitudeOffset': f"{100 + index % 40:019.15F}"}
+    if index % 3:
+        item['Sentiment'] = str(index % 4)
+    if index % 4:
+        item['rojopolisGeneralScore'] = str(index % 5 + 1)
+    if index % 5:
+        item['rojopolisEncounterScore'] = str(index % 3 + 1)
+    item.update(fields)
+    return item
+
+def test_field_estimate_without_a_sample():
+    estimates = app.field_estimate('Age', [], 0.1, app.SCALES['age'])
+
+    assert len(estimates) == len(app.SCALES['age'])
+    assert all(x == {'count': 0, 'countCi': [0.0, 0.0], 'percent': 0, 'percentCi': [0, 0],
+                     'rojopolisGeneralScoreAvg': 0, 'rojopolisGeneralScoreAvgCi': [0, 0],
+                     'rojopolisEncounterScoreAvg': 0, 'rojopolisEncounterScoreAvgCi': [0, 0]}
+               for x in estimates)
+    assert app.approx_count_and_mean([], 0.1)['dayBins'] == []
+
+def test_field_estimate_at_full_coverage():
+    data = app._cast_ints([response_item(x) for x in range(600)])
+
+    estimates = app.field_estimate('Age', data, 1.0, app.SCALES['age'])
+
+    exact = app.field_count_score_avg('Age', data, app.SCALES['age'])
+    assert [x['count'] for x in estimates] == [x['count'] for x in exact]
+    assert all(x['countCi'] == [x['count'], x['count']] for x in estimates)
+    assert [x['rojopolisGeneralScoreAvg'] for x in estimates] == [x['rojopolisGeneralScoreAvg'] for x in exact]
+    assert sum(x['percent'] for x in estimates) == pytest.approx(100)
+
+def test_field_estimate_intervals_hold_the_estimate():
+    data = app._cast_ints([response_item(x) for x in range(60)])
+
+    for estimate in app.field_estimate('Race', data, 0.1, app.SCALES['race']):
+        low, high = estimate['countCi']
+        assert 0 <= low < estimate['count'] < high
+        low, high = estimate['percentCi']
+        assert 0 <= low < estimate['percent'] < high <= 100
+        low, high = estimate['rojopolisGeneralScoreAvgCi']
+        assert low <= estimate['rojopolisGeneralScoreAvg'] <= high
+
+def test_approximate_responses_metadata_reads_the_sample_index(table):
+    table.items = {x['Sort']: x for x in (response_item(x) for x in range(250))}
+
+    response = app.responsesMetadata('AID-1', approx='true', sampleRate='0.05')
+
+    assert [x.get('IndexName') for x in table.queries] == ['SampleIndex'] * 3
+    assert response['Approximate'] == {'sampleRate': 0.05, 'sampledItems': 250, 'confidenceLevel': 0.95}
+    assert sum(x['count'] for x in response['Items']['age']) == 250 * 20
+    assert app._sample_buckets('0.5') == app.SAMPLED_BUCKETS and app._sample_buckets('0') == 1
+
+@pytest.fixture
+def snapshots(monkeypatch, table):
+    monkeypatch.setattr(snapshot, '_SNAPSHOTS', OrderedDict())
+    monkeypatch.setattr(snapshot, '_TOO_LARGE', {})
+    monkeypatch.setattr(snapshot, 'MEMORY_BYTES', 2 ** 20)
+    monkeypatch.setattr(app, '_get_question_choices_count', lambda item: tuple(range(5)))
+    table.items = {x['Sort']: x for x in (response_item(x, question=f"QID-{x % 3}") for x in range(1000))}
+    table.data_version = 1
+    return table
+
+def snapshot_rows(snap, items):
+    '''items cast as _responses returns them, in snapshot row order'''
+    return app._cast_ints(sorted(items, key=lambda x: snap.rows[x['Sort']]))
+
+def test_snapshot_upsert_overwrites_changed_rows():
+    snap = snapshot.ResponseSnapshot('AID-1')
+    snap.upsert([response_item(x, Version=10) for x in range(3)])
+    snap.upsert([response_item(1, Age='5', Topic='Parking', Version=12), response_item(3, Age='x')])
+
+    assert len(snap) == 4 and snap.version == 12
+    assert snap.column('Age').tolist() == [0, 5, 2, -1]
+    assert [snap.label('Topic', x) for x in snap.column('Topic')] == [None, 'Parking', None, None]
+    assert np.isnan(snap.column('rojopolisGeneralScore')[0])
+    assert snap.column('rojopolisGeneralScore')[1] == 2.0
+
+def test_snapshot_mask_matches_filters():
+    items = [response_item(x, question=f"QID-{x % 3}", Topic=f"T{x % 2}") for x in range(300)]
+    snap = snapshot.ResponseSnapshot('AID-1')
+    snap.upsert(items)
+    start = epoch(2019, 3, 5)
+
+    mask = snap.mask(question='QID-1', startDate=str(start), age='45', sentiment='0,2',
+                     origin='1', geo='35,-100,45,-70', topic='T0')
+
+    expected = [x['LSI'] == 'QID-1' and float(x['Date']) >= start and x['Age'] in ('4', '5') and
+                x.get('Sentiment') in ('0', '2') and x['Origin'] == '1' and x['Topic'] == 'T0' and
+                35 <= float(x['LatitudeOffset']) <= 45 and 100 <= float(x['LongitudeOffset']) <= 130
+                for x in items]
+    assert mask.tolist() == expected and any(expected)
+    assert not snap.mask(question='QID-9').any() and snap.mask().all()
+
+@pytest.mark.parametrize('filters,granularity,tz', [
+    ({}, 'day', 'UTC'),
+    ({'age': '12', 'sentiment': '1,3'}, 'week', 'America/New_York'),
+    ({'question': 'QID-1', 'geo': '35,-100,45,-70', 'origin': '2'}, 'month', 'Australia/Sydney'),
+])
+def test_snapshot_aggregates_match_list_aggregates(snapshots, filters, granularity, tz):
+    snap = snapshot.get_snapshot(snapshots, 'AID-1')
+    mask = snap.mask(**filters)
+    columns = snap.select(mask)
+    rows = [x for x, keep in zip(snapshot_rows(snap, list(snapshots.items.values())), mask) if keep]
+
+    assert app.columns_count_and_mean(columns, granularity=granularity, tz=tz) == \
+        app.count_and_mean([dict(x) for x in rows], granularity=granularity, tz=tz)
+    assert app.columns_count_by_scale(snap, columns, group_field='Sentiment', granularity=granularity, tz=tz) == \
+        app.count_by_scale([dict(x) for x in rows], group_field='Sentiment', granularity=granularity, tz=tz)
+    assert app.columns_count_by_scale(snap, columns, granularity=granularity, tz=tz) == \
+        app.count_by_scale([dict(x) for x in rows], granularity=granularity, tz=tz)
+
+def test_get_snapshot_refreshes_from_the_version_index(snapshots):
+    loaded = snapshot.get_snapshot(snapshots, 'AID-1')
+    assert [x.get('IndexName') for x in snapshots.queries] == [None] * 10
+    del snapshots.queries[:]
+    assert snapshot.get_snapshot(snapshots, 'AID-1') is loaded and snapshots.queries == []
+
+    snapshots.items.update({x['Sort']: x for x in [response_item(x, Version=5000000) for x in range(1000, 1050)]})
+    snapshots.items[response_item(7)['Sort']] = response_item(7, Age='0', Version=5000000)
+    snapshots.data_version = 2
+    refreshed = snapshot.get_snapshot(snapshots, 'AID-1')
+
+    assert refreshed is loaded and len(refreshed) == 1050 and refreshed.version == 5000000
+    assert [x.get('IndexName') for x in snapshots.queries] == ['VersionIndex']
+    reloaded = snapshot.load(snapshots, 'AID-1')
+    for field in snapshot.CODE_FIELDS + ('Date',):
+        by_key = lambda snap: {key: snap.column(field)[row] for key, row in snap.rows.items()}
+        assert by_key(refreshed) == by_key(reloaded)
+    assert refreshed.column('Age')[refreshed.rows[response_item(7)['Sort']]] == 0
+
+def test_get_snapshot_stops_reading_past_the_memory_cap(snapshots, monkeypatch):
+    # a snapshot row takes at most 266 bytes, 40000 holds one 100 item page
+    monkeypatch.setattr(snapshot, 'MEMORY_BYTES', 40000)
+
+    assert snapshot.get_snapshot(snapshots, 'AID-1') is None
+    assert len(snapshots.queries) == 2 and not snapshot._SNAPSHOTS
+    assert snapshot.get_snapshot(snapshots, 'AID-1') is None
+    assert len(snapshots.queries) == 2
+    assert snapshot.get_snapshot(snapshots, 'AID-1', now=time.time() + snapshot.MAX_AGE + 1) is None
+    assert len(snapshots.queries) == 4
+
+    # the query fallback follows every page, not just the first
+    response = app.responsesMetadata('AID-1')
+    assert response['Count'] == 1000 and sum(x['count'] for x in response['Items']['age']) == 1000
+    assert len(snapshots.queries) == 14
+
+def test_get_snapshot_stops_reading_past_the_time_budget(snapshots, monkeypatch):
+    monkeypatch.setattr(snapshot, 'LOAD_SECONDS', 0)
+
+    assert snapshot.get_snapshot(snapshots, 'AID-1') is None
+    assert len(snapshots.queries) == 1 and 'AID-1' in snapshot._TOO_LARGE
+    assert snapshot.get_snapshot(snapshots, 'AID-1') is None
+    assert len(snapshots.queries) == 1
+
+def test_refresh_past_the_memory_cap_drops_the_snapshot(snapshots, monkeypatch):
+    monkeypatch.setattr(snapshot, 'MEMORY_BYTES', 400000)
+    assert snapshot.get_snapshot(snapshots, 'AID-1') is not None
+
+    snapshots.items.update({x['Sort']: x for x in [response_item(x, Version=5000000) for x in range(1000, 2500)]})
+    snapshots.data_version = 2
+
+    assert snapshot.get_snapshot(snapshots, 'AID-1') is None
+    assert not snapshot._SNAPSHOTS
+
+def test_evict_drops_least_recently_used(snapshots):
+    for agency_id in ('AID-1', 'AID-2', 'AID-3'):
+        snapshot.get_snapshot(snapshots, agency_id)
+    snapshot.get_snapshot(snapshots, 'AID-1')
+    size = snapshot._SNAPSHOTS['AID-1'].nbytes
+
+    snapshot.evict(2 * size)
+
+    assert list(snapshot._SNAPSHOTS) == ['AID-3', 'AID-1']
+
+@pytest.mark.parametrize('memory_bytes', [2 ** 20, 0])
+def test_dashboard_metadata_matches_the_separate_endpoints(snapshots, monkeypatch, memory_bytes):
+    monkeypatch.setattr(snapshot, 'MEMORY_BYTES', memory_bytes)
+    if not memory_bytes:
+        # the stub does not evaluate FilterExpression, keep the question's responses only
+        snapshots.items = {k: v for k, v in snapshots.items.items() if v['LSI'] == 'QID-1'}
+    filters = {'age': '12', 'sentiment': '0,1,3', 'granularity': 'week', 'tz': 'America/New_York'}
+
+    dashboard = app.dashboardMetadata('AID-1', question='QID-1', **filters)
+
+    separate = app.responsesMetadata('AID-1', **filters)
+    assert dashboard['Items'] == {
+        'responsesMetadata': separate['Items'],
+        'responsesSentimentMetadata': app.responsesSentimentMetadata('AID-1', **filters)['Items'],
+        'questionResponsesMetadata': app.questionResponsesMetadata('AID-1', 'QID-1', **filters)['Items']}
+    assert dashboard['Count'] == separate['Count'] > 0
+    assert set(app.dashboardMetadata('AID-1', **filters)['Items']) == {
+        'responsesMetadata', 'responsesSentimentMetadata'}
+
+def get_event(route, headers=None, params=None):
+    return {'httpMethod': 'GET', 'path': f"/{route}/AID-1", 'pathParameters': {'aId': 'AID-1'},
+            'queryStringParameters': params, 'headers': headers}
+
+def test_entrypoint_answers_matching_etags_with_304(snapshots):
+    params = {'tz': 'UTC', 'granularity': 'week'}
+    first = app.entrypoint(get_event('responsesMetadata', params=params), None)
+    etag = first['headers']['ETag']
+    queries = len(snapshots.queries)
+
+    for headers in ({'If-None-Match': etag}, {'if-none-match': f"W/{etag}"},
+                    {'If-None-Match': f'"other", {etag}'}, {'If-None-Match': '*'}):
+        response = app.entrypoint(get_event('responsesMetadata', headers, dict(params, tz='UTC ')), None)
+        assert response['statusCode'] == 304 and response['body'] == ''
+        assert response['headers']['ETag'] == etag
+        assert response['headers']['Cache-Control'] == app.CACHE_CONTROL
+        assert response['headers']['Access-Control-Allow-Origin'] == '*'
+        assert response['headers']['Access-Control-Expose-Headers'] == 'ETag'
+        assert 'If-None-Match' in response['headers']['Access-Control-Allow-Headers'].split(',')
+    assert len(snapshots.queries) == queries
+
+    assert first['statusCode'] == 200 and first['headers']['Cache-Control'] == app.CACHE_CONTROL
+    other = app.entrypoint(get_event('responsesMetadata', {'If-None-Match': etag}, {'tz': 'Europe/Paris'}), None)
+    assert other['statusCode'] == 200 and other['headers']['ETag'] != etag
+
+def test_entrypoint_answers_200_after_the_data_version_changes(snapshots):
+    etag = app.entrypoint(get_event('dashboardMetadata'), None)['headers']['ETag']
+    snapshots.data_version = 2
+
+    response = app.entrypoint(get_event('dashboardMetadata', {'If-None-Match': etag}), None)
+
+    assert response['statusCode'] == 200 and response['headers']['ETag'] != etag
+    assert set(json.loads(response['body'])['Items']) == {'responsesMetadata', 'responsesSentimentMetadata'}
+
+@pytest.mark.parametrize('route', ['responsesMetadata', 'dashboardMetadata', 'responses'])
+def test_entrypoint_reads_the_data_version_once(snapshots, route):
+    app.entrypoint(get_event(route), None)
+    del snapshots.gets[:]
+
+    response = app.entrypoint(get_event(route), None)
+
+    assert response['statusCode'] == 200
+    assert snapshots.gets == [{'Partition': 'AID-1', 'Sort': 'DataVersion'}]
+
+def test_entrypoint_without_a_data_version_sends_no_etag(snapshots):
+    snapshots.data_version = None
+
+    response = app.entrypoint(get_event('responsesMetadata', {'If-None-Match': '*'}), None)
+
+    assert response['statusCode'] == 200
+    assert 'ETag' not in response['headers'] and 'Cache-Control' not in response['headers']
+
+def test_client_config_builds_clients():
+    client = clients.get_client('dynamodb', region_name='us-east-1')
+
+    assert client.meta.config.max_pool_connections == clients.MAX_POOL_CONNECTIONS
+    assert client.meta.config.retries['mode'] == 'adaptive'
+    assert clients.get_resource('dynamodb', region_name='us-east-1').meta.client.meta.config.retries == \
+        client.meta.config.retries
@@ -1,5 +1,71 @@
 variable "qualtrics_api_key" {
   description = "Qualtrics API key"
-  type        = "string"
+  type        = string
   default     = "0123456789abcdef"
-}
\ No newline at end of file
+}
+
+variable "survey_batch_size" {
+  description = "Survey jobs delivered to one surveyjobs invocation"
+  type        = number
+  default     = 10
+}
+
+variable "survey_concurrency" {
+  description = "Survey jobs from one batch processed at once"
+  type        = number
+  default     = 4
+}
+
+variable "producer_scan_segments" {
+  description = "Parallel scan segments used to read the producer table"
+  type        = number
+  default     = 1
+}
+
+variable "producer_max_age" {
+  description = "Seconds after which an unchanged survey is synced again"
+  type        = number
+  default     = 86400
+}
+
+variable "producer_spread_seconds" {
+  description = "Window in seconds (at most 900) to spread survey jobs over, 0 to send at once"
+  type        = number
+  default     = 0
+}
+
+variable "producer_agency_concurrency" {
+  description = "Survey jobs per agency allowed to run at once when spreading"
+  type        = number
+  default     = 2
+}
+
+variable "crud_memory_size" {
+  description = "Memory in MB for the CRUD handler, warm response snapshots live in it"
+  type        = number
+  default     = 512
+}
+
+variable "crud_timeout" {
+  description = "Seconds the CRUD handler may run, below the 29 second API Gateway integration timeout"
+  type        = number
+  default     = 28
+}
+
+variable "crud_snapshot_load_seconds" {
+  description = "Seconds a CRUD handler may spend reading responses into a snapshot before falling back to queries"
+  type        = number
+  default     = 5
+}
+
+variable "crud_snapshot_memory_mb" {
+  description = "Memory in MB response snapshots may use in each CRUD handler container, 0 to disable"
+  type        = number
+  default     = 128
+}
+
+variable "crud_cache_control" {
+  description = "Cache-Control sent with versioned CRUD responses, use public or s-maxage to let a CDN cache them"
+  type        = string
+  default     = "private, max-age=60"
+}
@@ -3,6 +3,10 @@ data "external" "google_cloud_cidrs" {
         "python3",
         "${path.module}/scripts/datasource.py",
     ]
+
+    query = {
+        max_prefixes = var.max_prefixes
+    }
 }
 
 locals {
@@ -1,48 +1,224 @@
 '''
 Generate IP Whitelist for published GCP ranges
 https://cloud.google.com/compute/docs/faq#find_ip_range
+
+The include tree under _cloud-netblocks.googleusercontent.com is resolved
+concurrently and cached on disk until the shortest TXT record TTL expires.
+
+Ranges are collapsed into the fewest equivalent prefixes. Terraform may pass
+max_prefixes in the external data source query to coarsen them further.
+
+Environment:
+    NETBLOCK_CACHE: cache file, empty to disable caching
+    NETBLOCK_STUB: json file of {"record": ["txt", ...]} answered instead of DNS,
+        the cache is neither read nor written while it is set
 '''
 
+import ipaddress
 import json
 import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
 import dns.resolver
 
 logging.basicConfig(level='ERROR')
 
-def get_netblock(record, cidrs):
+ROOT_RECORD = '_cloud-netblocks.googleusercontent.com'
+MAX_WORKERS = 8
+STUB_TTL = 300
+DEFAULT_CACHE = os.path.join(tempfile.gettempdir(), 'terraform-google-ip-range-datasource.json')
+
+
+def resolve_txt(record):
     '''
-    Recurse through netblocks and append CIDRS
+    Resolve TXT records, returns the strings and their TTL
     '''
-    includes = []
     answers = dns.resolver.query(record, 'TXT')
     logging.debug(f'answers={answers}')
-    for rdata in answers:
-        logging.debug(f'rdata={rdata}')
-        logging.debug(f'type={type(rdata)}')
-        includes = [x.split('include:')[1] for x in str(rdata).split(' ') if x.startswith('include:')]
-        cidrs.extend([x for x in str(rdata).split(' ') if x.startswith('ip')])
-    logging.debug(f'includes={includes}')
+    return [str(rdata) for rdata in answers], answers.rrset.ttl
+
+
+def stub_resolver(path):
+    '''
+    Resolver answering from a json file instead of DNS, for tests
+    '''
+    with open(path) as stub_file:
+        records = json.load(stub_file)
+
+    def resolve(record):
+        return records[record], STUB_TTL
+    return resolve
+
+
+def parse_netblock(txt):
+    '''
+    Split an SPF TXT record into includes and ip4:/ip6: CIDRS
+    '''
+    terms = txt.strip('"').split(' ')
+    includes = [x.split('include:')[1] for x in terms if x.startswith('include:')]
+    cidrs = [x for x in terms if x.startswith('ip')]
+    return includes, cidrs
+
+
+def get_netblocks(record=ROOT_RECORD, resolve=resolve_txt, max_workers=MAX_WORKERS):
+    '''
+    Resolve the include tree concurrently, each record at most once so
+    cycles and repeated includes are not followed again.
+    Returns the CIDRS and the shortest TTL seen.
+    '''
+    cidrs = []
+    ttl = None
+    seen = {record}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(resolve, record)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                txts, record_ttl = future.result()
+                ttl = record_ttl if ttl is None else min(ttl, record_ttl)
+                for txt in txts:
+                    logging.debug(f'rdata={txt}')
+                    includes, record_cidrs = parse_netblock(txt)
+                    cidrs.extend(record_cidrs)
+                    for include in includes:
+                        if include in seen:
+                            logging.debug(f'skipping repeated include={include}')
+                            continue
+                        seen.add(include)
+                        pending.add(executor.submit(resolve, include))
     logging.debug(f'cidrs={cidrs}')
-    for include in includes:
-        get_netblock(include, cidrs)
+    return cidrs, ttl
 
-def stringify_cidrs(cidr_list, ip_ver='4'):
+
+def get_netblock(record, cidrs):
+    '''
+    Recurse through netblocks and append CIDRS
+    '''
+    cidrs.extend(get_netblocks(record)[0])
+
+
+def read_cache(path, record):
+    '''
+    Cached CIDRS for record, None when missing or expired
+    '''
+    try:
+        with open(path) as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if cache.get('record') != record or cache.get('expires', 0) <= time.time():
+        return None
+    return cache['cidrs']
+
+
+def write_cache(path, record, cidrs, ttl):
+    '''
+    Atomically replace the cache so concurrent plans never read a partial file
+    '''
+    cache = {'record': record, 'expires': time.time() + ttl, 'cidrs': cidrs}
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(cache_file.name, path)
+
+
+def cached_netblocks(record=ROOT_RECORD, cache_path=DEFAULT_CACHE, resolve=resolve_txt):
+    '''
+    CIDRS from the cache while it is fresh, resolved and cached otherwise
+    '''
+    if cache_path:
+        cidrs = read_cache(cache_path, record)
+        if cidrs is not None:
+            logging.debug(f'using cached cidrs from {cache_path}')
+            return cidrs
+    cidrs, ttl = get_netblocks(record, resolve=resolve)
+    if cache_path and ttl:
+        try:
+            write_cache(cache_path, record, cidrs, ttl)
+        except OSError:
+            logging.warning(f'could not write cache {cache_path}')
+    return cidrs
+
+
+def parse_cidrs(cidr_list, ip_ver='4'):
+    '''
+    ipaddress networks for the ip4: or ip6: entries of the list
+    '''
+    return [ipaddress.ip_network(x.split(f'ip{ip_ver}:')[1], strict=False)
+            for x in cidr_list if x.startswith(f'ip{ip_ver}:')]
+
+
+def common_supernet(first, second):
+    '''
+    Smallest network containing both networks
+    '''
+    differing_bits = (int(first.network_address) ^ int(second.network_address)).bit_length()
+    prefixlen = min(first.prefixlen, second.prefixlen, first.max_prefixlen - differing_bits)
+    return first.supernet(new_prefix=prefixlen)
+
+
+def coarsen_cidrs(networks, max_prefixes):
+    '''
+    Merge neighbouring networks into supernets until at most max_prefixes
+    remain, always taking the merge that adds the fewest addresses.
+    Coarsening widens the allowlist beyond the published ranges.
+    '''
+    networks = sorted(networks)
+    while len(networks) > max(max_prefixes, 1):
+        candidates = [(common_supernet(a, b), i) for i, (a, b) in enumerate(zip(networks, networks[1:]))]
+        supernet, _ = min(candidates, key=lambda x: (
+            x[0].num_addresses - networks[x[1]].num_addresses - networks[x[1] + 1].num_addresses, x[1]))
+        networks = sorted(ipaddress.collapse_addresses(networks + [supernet]))
+    return networks
+
+
+def aggregate_cidrs(cidr_list, ip_ver='4', max_prefixes=None):
+    '''
+    Sorted, de-duplicated networks with overlapping and adjacent ranges collapsed
+    '''
+    networks = sorted(ipaddress.collapse_addresses(parse_cidrs(cidr_list, ip_ver)))
+    if max_prefixes:
+        networks = coarsen_cidrs(networks, max_prefixes)
+    return networks
+
+
+def stringify_cidrs(cidr_list, ip_ver='4', max_prefixes=None):
     '''
     Terraform only supports strings for external data sources,
     so flatten lists inst space separated strings
     '''
-    cidr_string = ''
-    for cidr in [x.split(f'ip{ip_ver}:')[1] for x in cidrs if x.startswith(f'ip{ip_ver}')]:
-        cidr_string += cidr + ' '
-    return cidr_string
+    return ' '.join(str(x) for x in aggregate_cidrs(cidr_list, ip_ver, max_prefixes))
+
+
+def read_query():
+    '''
+    Query arguments Terraform passes as json on stdin, empty when run by hand
+    '''
+    if sys.stdin.isatty():
+        return {}
+    return json.loads(sys.stdin.read() or '{}')
+
+
+def datasource(query, environ=os.environ):
+    '''
+    The external data source result for query
+    '''
+    max_prefixes = int(query.get('max_prefixes') or 0)
+    stub = environ.get('NETBLOCK_STUB')
+    if stub:
+        # stubbed answers must not be served to, or from, real runs
+        netblocks = cached_netblocks(cache_path=None, resolve=stub_resolver(stub))
+    else:
+        netblocks = cached_netblocks(cache_path=environ.get('NETBLOCK_CACHE', DEFAULT_CACHE))
+    return {
+        'ipv4Cidrs': stringify_cidrs(netblocks, '4', max_prefixes),
+        'ipv6Cidrs': stringify_cidrs(netblocks, '6', max_prefixes)
+    }
+
 
 if __name__ == '__main__':
-    cidrs = []
-    get_netblock('_cloud-netblocks.googleusercontent.com', cidrs)
-    print(json.dumps(
-            {
-                'ipv4Cidrs': stringify_cidrs(cidrs, '4'),
-                'ipv6Cidrs': stringify_cidrs(cidrs, '6')
-            }
-        )
-    )
\ No newline at end of file
+    print(json.dumps(datasource(read_query())))
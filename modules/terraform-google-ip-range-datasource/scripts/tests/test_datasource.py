@@ -0,0 +1,113 @@
+import sys;sys.path.append("..")
+import json
+
+import datasource
+
+ROOT = datasource.ROOT_RECORD
+RECORDS = {
+    ROOT: ['"v=spf1 include:_cloud-netblocks1.googleusercontent.com '
+           'include:_cloud-netblocks2.googleusercontent.com ?all"'],
+    '_cloud-netblocks1.googleusercontent.com': [
+        '"v=spf1 ip4:8.34.208.0/20 ip4:8.35.192.0/21 include:_cloud-netblocks2.googleusercontent.com ?all"'],
+    '_cloud-netblocks2.googleusercontent.com': [
+        f'"v=spf1 ip6:2600:1900::/35 include:{ROOT} include:_cloud-netblocks1.googleusercontent.com ?all"'],
+}
+
+def write_stub(tmp_path, records=RECORDS):
+    path = tmp_path / 'stub.json'
+    path.write_text(json.dumps(records))
+    return str(path)
+
+def test_stub_resolver(tmp_path):
+    resolve = datasource.stub_resolver(write_stub(tmp_path))
+
+    assert resolve(ROOT) == (RECORDS[ROOT], datasource.STUB_TTL)
+
+def test_get_netblocks_resolves_each_record_once(tmp_path):
+    resolve = datasource.stub_resolver(write_stub(tmp_path))
+    resolved = []
+
+    cidrs, ttl = datasource.get_netblocks(resolve=lambda record: resolved.append(record) or resolve(record))
+
+    assert sorted(resolved) == sorted(RECORDS)
+    assert sorted(cidrs) == ['ip4:8.34.208.0/20', 'ip4:8.35.192.0/21', 'ip6:2600:1900::/35']
+    assert ttl == datasource.STUB_TTL
+
+def test_get_netblocks_keeps_the_shortest_ttl():
+    ttls = {ROOT: 3600, '_cloud-netblocks1.googleusercontent.com': 60,
+            '_cloud-netblocks2.googleusercontent.com': 600}
+
+    _, ttl = datasource.get_netblocks(resolve=lambda record: (RECORDS[record], ttls[record]))
+
+    assert ttl == 60
+
+def test_cache_expires_after_ttl(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache.json')
+    monkeypatch.setattr(datasource.time, 'time', lambda: 1000.0)
+    datasource.write_cache(path, ROOT, ['ip4:10.0.0.0/8'], 300)
+
+    assert datasource.read_cache(path, ROOT) == ['ip4:10.0.0.0/8']
+    assert datasource.read_cache(path, 'other.example.com') is None
+    monkeypatch.setattr(datasource.time, 'time', lambda: 1300.0)
+    assert datasource.read_cache(path, ROOT) is None
+    assert datasource.read_cache(str(tmp_path / 'missing.json'), ROOT) is None
+
+def test_cached_netblocks_resolves_only_when_expired(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache.json')
+    resolved = []
+    def resolve(record):
+        resolved.append(record)
+        return RECORDS[record], 300
+    now = [1000.0]
+    monkeypatch.setattr(datasource.time, 'time', lambda: now[0])
+
+    first = datasource.cached_netblocks(cache_path=path, resolve=resolve)
+    assert datasource.cached_netblocks(cache_path=path, resolve=resolve) == first
+    assert len(resolved) == 3
+    now[0] += 300
+    assert sorted(datasource.cached_netblocks(cache_path=path, resolve=resolve)) == sorted(first)
+    assert len(resolved) == 6
+
+def test_stub_bypasses_the_cache(tmp_path):
+    cache = tmp_path / 'cache.json'
+    datasource.write_cache(str(cache), ROOT, ['ip4:10.0.0.0/8'], 300)
+    cached = cache.read_text()
+
+    result = datasource.datasource({}, environ={'NETBLOCK_STUB': write_stub(tmp_path),
+                                                'NETBLOCK_CACHE': str(cache)})
+
+    assert result == {'ipv4Cidrs': '8.34.208.0/20 8.35.192.0/21', 'ipv6Cidrs': '2600:1900::/35'}
+    assert cache.read_text() == cached
+
+def test_aggregate_cidrs_collapses_overlapping_and_adjacent():
+    cidrs = ['ip4:10.0.0.0/24', 'ip4:10.0.0.128/25', 'ip4:10.0.1.0/24', 'ip4:10.0.0.0/24',
+             'ip4:192.168.0.0/24', 'ip6:2600:1900::/35']
+
+    assert [str(x) for x in datasource.aggregate_cidrs(cidrs)] == ['10.0.0.0/23', '192.168.0.0/24']
+
+def test_aggregate_cidrs_ipv6():
+    cidrs = ['ip6:2600:1900::/35', 'ip6:2600:1900:2000::/35', 'ip6:2600:1900:1000::/48',
+             'ip6:2001:4860::/32', 'ip4:10.0.0.0/8']
+
+    assert [str(x) for x in datasource.aggregate_cidrs(cidrs, '6')] == ['2001:4860::/32', '2600:1900::/34']
+
+def test_common_supernet():
+    network = datasource.ipaddress.ip_network
+
+    assert datasource.common_supernet(network('10.0.0.0/24'), network('10.0.3.0/24')) == network('10.0.0.0/22')
+    assert datasource.common_supernet(network('10.0.0.0/8'), network('10.1.0.0/16')) == network('10.0.0.0/8')
+    assert datasource.common_supernet(network('2600:1900::/35'),
+                                      network('2600:1901::/48')) == network('2600:1900::/31')
+
+def test_coarsen_cidrs_covers_every_address():
+    cidrs = [f'ip4:{x}.{y}.0.0/20' for x in (8, 34, 35, 104) for y in range(0, 256, 37)]
+    cidrs += ['ip6:2600:1900::/35', 'ip6:2600:1901:8000::/37', 'ip6:2001:4860::/32']
+    for ip_ver in ('4', '6'):
+        original = datasource.aggregate_cidrs(cidrs, ip_ver)
+        for max_prefixes in (1, 2, 5, len(original)):
+            coarse = datasource.aggregate_cidrs(cidrs, ip_ver, max_prefixes)
+
+            assert len(coarse) <= max_prefixes
+            assert all(any(x.subnet_of(y) for y in coarse) for x in original)
+            assert sum(x.num_addresses for x in coarse) >= sum(x.num_addresses for x in original)
+    assert datasource.aggregate_cidrs(cidrs, '4', 28) == datasource.aggregate_cidrs(cidrs, '4')
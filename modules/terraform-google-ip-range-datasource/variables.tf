@@ -0,0 +1,5 @@
+variable "max_prefixes" {
+    description = "Coarsen each address family to at most this many CIDR blocks, 0 keeps the exact ranges. Coarsening allows addresses outside the published ranges."
+    type        = number
+    default     = 0
+}